@@ -5,7 +5,8 @@ from enum import Enum
 import binascii
 import networkx as nx
 import numpy as np
-from bitarray import bitarray
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
 
 global_origin_id = 0
 
@@ -81,51 +82,113 @@ class DRSMode(Enum):
 class Provenance:
     """
     Nodes are Hit (only). Origin nodes are given a special Hit object too.
+    Provenance is recorded as an append-only log of operations and merges; the graph is only
+    built when it is asked for, and then kept up to date with the new log entries.
     """
 
     def __init__(self, data, operation):
-        self._p_graph = nx.MultiDiGraph()
+        self._log = []
+        self._base = None  # graph the log applies to, see swap_p_graph
+        self._p_graph = None  # graph of the first _built log entries, built on demand
+        self._built = 0
+        self._older = dict()  # length -> graph of fewer than _built entries, see _graph_at
         op = operation.op
         params = operation.params
         self.populate_provenance(data, op, params)
 
     def prov_graph(self):
-        return self._p_graph
+        return self._graph_at(len(self._log))
 
     def swap_p_graph(self, new):
-        self._p_graph = new
+        self._log = []
+        self._base = new
+        self._p_graph = None
+        self._built = 0
+        self._older = dict()
+
+    def _new_graph(self):
+        return self._base.copy() if self._base is not None else nx.MultiDiGraph()
 
     def populate_provenance(self, data, op, params):
         if op == OP.NONE:
             # This is a carrier DRS, skip
             return
         elif op == OP.ORIGIN:
-            for element in data:
-                self._p_graph.add_node(element)
+            self._log.append(('populate', op, None, data))
         # We check operations that come with parameters
         elif op == OP.SCHNAME_LOOKUP or op == OP.ENTITY_LOOKUP or op == OP.KW_LOOKUP:
             global global_origin_id
             hit = Hit(global_origin_id, params[0], params[0], params[0], -1)
             global_origin_id += 1
-            self._p_graph.add_node(hit)
-            for element in data:  # now we connect the new node to data with the op
-                self._p_graph.add_node(element)
-                self._p_graph.add_edge(hit, element, op)
+            self._log.append(('populate', op, hit, data))
         else:  # This all come with a Hit parameter
             hit = params[0]  # get the hit that comes with the op otherwise
-            self._p_graph.add_node(hit)  # we add the param
+            self._log.append(('populate', op, hit, data))
+
+    def absorb(self, provenance, labels=(), nodes=None):
+        """
+        Logs the merge of provenance, as it is now, into self
+        :param provenance: the Provenance to merge
+        :param labels: labels to annotate the incoming edges of some nodes with, once merged
+        :param nodes: function that returns the nodes to annotate
+        """
+        self._log.append(('absorb', provenance, len(provenance._log), labels, nodes))
+
+    def _graph_at(self, length):
+        """
+        Returns the graph of the first length log entries. The latest graph built is kept and
+        extended with the entries appended after it. A graph of fewer entries, for a merge
+        logged before the latest graph was built, is built once from the closest one kept
+        """
+        if self._p_graph is None:
+            self._p_graph = self._new_graph()
+            self._built = 0
+        if self._built <= length:
+            while self._built < length:
+                # applied before it counts as built, so that merging self at this length
+                # finds the graph itself
+                self._apply(self._p_graph, self._log[self._built])
+                self._built += 1
+            return self._p_graph
+        if length not in self._older:
+            start = max((older for older in self._older if older < length), default=None)
+            graph = self._older[start].copy() if start is not None else self._new_graph()
+            for entry in self._log[start or 0:length]:
+                self._apply(graph, entry)
+            self._older[length] = graph
+        return self._older[length]
+
+    def _apply(self, graph, entry):
+        if entry[0] == 'populate':
+            _, op, hit, data = entry
+            if op == OP.ORIGIN:
+                graph.add_nodes_from(data)
+                return
+            graph.add_node(hit)  # we add the param
             for element in data:  # now we connect the new node to data with the op
-                self._p_graph.add_node(element)
-                self._p_graph.add_edge(hit, element, op)
+                graph.add_node(element)
+                graph.add_edge(hit, element, op)
+        elif entry[0] == 'absorb':
+            _, provenance, length, labels, nodes = entry
+            merging = provenance._graph_at(length)
+            if merging is not graph:
+                graph.add_nodes_from(merging.nodes(data=True))
+                graph.add_edges_from(merging.edges(keys=True, data=True))
+            if labels:
+                for el in nodes():
+                    for src, trg, key in graph.in_edges(el, keys=True):
+                        for label in labels:
+                            graph[src][trg][key][label] = 1
 
     def get_leafs_and_heads(self):
         # Compute leafs and heads
         # FIXME: cache this to avoid graph traversal every time
         leafs = []
         heads = []
-        for node in self._p_graph.nodes():
-            pre = self._p_graph.predecessors(node)
-            suc = self._p_graph.successors(node)
+        p_graph = self.prov_graph()
+        for node in p_graph.nodes():
+            pre = p_graph.predecessors(node)
+            suc = p_graph.successors(node)
             no_cycles = set(pre) - set(suc)
             pre = list(no_cycles)
             if len(pre) == 0:
@@ -137,9 +200,10 @@ class Provenance:
     def compute_paths_from_origin_to(self, a: Hit, leafs=None, heads=None):
         if leafs is None and heads is None:
             leafs, heads = self.get_leafs_and_heads()
+        p_graph = self.prov_graph()
         all_paths = []
         for l in leafs:
-            paths = nx.all_simple_paths(self._p_graph, l, a)
+            paths = nx.all_simple_paths(p_graph, l, a)
             all_paths.extend(paths)
         return all_paths
 
@@ -161,23 +225,24 @@ class Provenance:
         # FIXME: refactor with compute_paths_from_origin and all that
         if leafs is None and heads is None:
             leafs, heads = self.get_leafs_and_heads()
+        p_graph = self.prov_graph()
         all_paths = []
         if a in leafs:
             for h in heads:
-                paths = nx.all_simple_paths(self._p_graph, a, h)
+                paths = nx.all_simple_paths(p_graph, a, h)
                 all_paths.extend(paths)
         elif a in heads:
             for l in leafs:
-                paths = nx.all_simple_paths(self._p_graph, l, a)
+                paths = nx.all_simple_paths(p_graph, l, a)
                 all_paths.extend(paths)
         else:
             upstreams = []
             for l in leafs:
-                paths = nx.all_simple_paths(self._p_graph, l, a)
+                paths = nx.all_simple_paths(p_graph, l, a)
                 upstreams.extend(paths)
             downstreams = []
             for h in heads:
-                paths = nx.all_simple_paths(self._p_graph, a, h)
+                paths = nx.all_simple_paths(p_graph, a, h)
                 downstreams.extend(paths)
 
             if len(downstreams) > len(upstreams):
@@ -208,6 +273,7 @@ class Provenance:
             return string
 
         explanation = ""
+        p_graph = self.prov_graph()
 
         slice_range = lambda a: a + 1  # pairs
         for idx in range(len(p)):
@@ -215,7 +281,7 @@ class Provenance:
                 pair = p[idx::slice_range(idx)]
                 src, trg = pair
                 explanation = explanation + get_name_from_hit(src) + " -> "
-                edge_info = self._p_graph[src][trg]
+                edge_info = p_graph[src][trg]
                 explanation = explanation + get_string_from_edge_info(edge_info) + " -> " \
                     + get_name_from_hit(trg) + '\n'
         return explanation
@@ -229,6 +295,7 @@ class DRS:
 
     def __init__(self, data, operation):
         self._data = data
+        self._sorted_nids = None  # see get_sorted_nids
         self._provenance = Provenance(data, operation)
         self._table_view = []
         self._idx = 0
@@ -275,6 +342,7 @@ class DRS:
 
     def set_data(self, data):
         self._data = list(data)
+        self._sorted_nids = None
         self._table_view = []
         self._idx = 0
         self._idx_table = 0
@@ -289,6 +357,24 @@ class DRS:
     def size(self):
         return len(self.data)
 
+    def get_sorted_nids(self):
+        """
+        Returns the sorted array of the (unique) int nids in data, and the position in data of
+        the hit of each. Computed once per data
+        """
+        if self._sorted_nids is None:
+            nids = np.fromiter((int(hit.nid) for hit in self._data), dtype=np.int64, count=len(self._data))
+            self._sorted_nids = np.unique(nids, return_index=True)
+        return self._sorted_nids
+
+    def _set_sorted_data(self, nids, hits):
+        """
+        Sets as data the hits, which have the given unique nids, in nid order
+        """
+        order = np.argsort(nids, kind='mergesort')
+        self.set_data([hits[i] for i in order])
+        self._sorted_nids = (nids[order], np.arange(len(order)))
+
     def get_provenance(self):
         return self._provenance
 
@@ -309,49 +395,22 @@ class DRS:
         :param drs:
         :return:
         """
-        def annotate_union_edges(label):
-            # Find nodes that intersect (those that will contain add_edges)
-            my_data = set(self.data)
-            merging_data = set(drs.data)
-            disjoint = my_data.intersection(
-                merging_data)  # where a union is created
-            # Now find the incoming edges to these nodes in each of the drs's
-            node_and_edges = []
-            for el in disjoint:
-                input_edges1 = self._provenance.prov_graph().in_edges(el, data=True)
-                input_edges2 = drs._provenance.prov_graph().in_edges(el, data=True)
-                node_and_edges.append((input_edges1, input_edges2))
-            # Now locate the nodes in the merged prov graph and annotate edges
-            # with AND
-            for input1, input2 in node_and_edges:
-                for src1, tar1, dic1 in input1:
-                    # this is the edge information
-                    edge_data = merge[src1][tar1]
-                    for e in edge_data:  # we iterate over each edge
-                        # we assign the new metadata as data assigned to the
-                        # edge
-                        edge_data[e][label] = 1
-                for src2, tar2, dic2 in input2:
-                    edge_data = merge[src2][tar2]
-                    for e in edge_data:
-                        edge_data[e][label] = 1
+        my_data = self.data
+        merging_data = drs.data
+
+        def union_nodes():
+            # Nodes that intersect (those that will contain add_edges)
+            return set(my_data).intersection(set(merging_data))
 
         # Reset ranking
         self._ranked = False
-        # Get prov graph of merging
-        prov_graph_of_merging = drs.get_provenance().prov_graph()
-        # Compose into my prov graph
-        merge = nx.compose(self._provenance.prov_graph(),
-                           prov_graph_of_merging)
-
+        # Log the merge, the graphs are composed only if the provenance is asked for
+        labels = []
         if annotate_and_edges:
-            annotate_union_edges('AND')
-
+            labels.append('AND')
         if annotate_or_edges:
-            annotate_union_edges('OR')
-
-        # Rewrite my prov graph to the new merged one and return
-        self._provenance.swap_p_graph(merge)
+            labels.append('OR')
+        self._provenance.absorb(drs.get_provenance(), labels, union_nodes)
         return self
 
     def absorb(self, drs):
@@ -363,10 +422,7 @@ class DRS:
         # Reset ranking
         self._ranked = False
         # Set union merge data
-        merging_data = set(drs.data)
-        my_data = set(self.data)
-        new_data = merging_data.union(my_data)
-        self.set_data(list(new_data))
+        self._union_data(drs)
         # Merge provenance
         self.absorb_provenance(drs)
         return self
@@ -375,25 +431,35 @@ class DRS:
     Set operations
     """
 
+    def _union_data(self, drs):
+        my_nids, my_idx = self.get_sorted_nids()
+        merging_nids, merging_idx = drs.get_sorted_nids()
+        # the hits of drs are kept for the nids in both
+        only_mine = ~np.isin(my_nids, merging_nids, assume_unique=True)
+        hits = [drs.data[i] for i in merging_idx] + [self.data[i] for i in my_idx[only_mine]]
+        self._set_sorted_data(np.concatenate((merging_nids, my_nids[only_mine])), hits)
+
     def intersection(self, drs):
         # Reset ranking
         self._ranked = False
-        new_data = []
-        # FIXME: There are more efficient ways of doing this
         if drs.mode == DRSMode.TABLE:
-            merging_tables = [(hit.source_name, hit) for hit in drs.data]
-            my_tables = [(hit.source_name, hit) for hit in self.data]
-            for table, hit_ext in merging_tables:
-                for t, hit_in in my_tables:
-                    if table == t:
-                        new_data.append(hit_ext)
-                        new_data.append(hit_in)
+            # join on the tables: the hits of both whose table is in both
+            merging_tables = np.array([hit.source_name for hit in drs.data], dtype=object)
+            my_tables = np.array([hit.source_name for hit in self.data], dtype=object)
+            tables, codes = np.unique(np.concatenate((merging_tables, my_tables)).astype(str), return_inverse=True)
+            merging_codes, my_codes = codes[:len(merging_tables)], codes[len(merging_tables):]
+            common = np.intersect1d(merging_codes, my_codes)
+            merging_hits = [drs.data[i] for i in np.flatnonzero(np.isin(merging_codes, common))]
+            my_hits = [self.data[i] for i in np.flatnonzero(np.isin(my_codes, common))]
+            hits = merging_hits + my_hits
+            nids = np.array([int(hit.nid) for hit in hits], dtype=np.int64)
+            nids, first = np.unique(nids, return_index=True)
+            self._set_sorted_data(nids, [hits[i] for i in first])
         elif drs.mode == DRSMode.FIELDS:
-            merging_data = set(drs.data)
-            my_data = set(self.data)
-            new_data = list(merging_data.intersection(my_data))
-        # We set the new data into our DRS again
-        self.set_data(new_data)
+            my_nids, my_idx = self.get_sorted_nids()
+            merging_nids, _ = drs.get_sorted_nids()
+            in_both = np.isin(my_nids, merging_nids, assume_unique=True)
+            self._set_sorted_data(my_nids[in_both], [self.data[i] for i in my_idx[in_both]])
         # Merge provenance
         # FIXME: perhaps we need to do some garbage collection of the prov graph at some point
         # FIXME: or alternatively perform a more fine-grained merging
@@ -403,10 +469,7 @@ class DRS:
     def union(self, drs):
         # Reset ranking
         self._ranked = False
-        merging_data = set(drs.data)
-        my_data = set(self.data)
-        new_data = merging_data.union(my_data)
-        self.set_data(list(new_data))
+        self._union_data(drs)
         # Merge provenance
         # FIXME: perhaps we need to do some garbage collection of the prov
         # graph at some point
@@ -416,10 +479,10 @@ class DRS:
     def set_difference(self, drs):
         # Reset ranking
         self._ranked = False
-        merging_data = set(drs.data)
-        my_data = set(self.data)
-        new_data = my_data - merging_data
-        self.set_data(list(new_data))
+        my_nids, my_idx = self.get_sorted_nids()
+        merging_nids, _ = drs.get_sorted_nids()
+        only_mine = ~np.isin(my_nids, merging_nids, assume_unique=True)
+        self._set_sorted_data(my_nids[only_mine], [self.data[i] for i in my_idx[only_mine]])
         # Merge provenance
         # FIXME: perhaps we need to do some garbage collection of the prov
         # graph at some point
@@ -528,86 +591,111 @@ class DRS:
     Ranking functions
     """
 
-    def _compute_certainty_scores(self, aggr_strategy=None):
+    def _provenance_dag(self):
         """
-        FIXME: scores being part of nodes instead of edges mean we cannot implement the
-        best aggregation method. Only one temporal one that works ok in practice.
-        :param aggregation:
-        :return:
+        Condenses the provenance graph into a DAG, with one node per strongly connected component,
+        and splits it in levels: the components whose longest path from a component without
+        predecessors has length i are in level i
+        :return: (the component of each node, the edges (src, target) between components whose target
+        is in each level, the highest score of the members of each component, whether each component
+        is a cycle, i.e., its members derive from each other, and the score of each node)
         """
+        pg = self._provenance.prov_graph()
+        nodes = list(pg.nodes())
+        index = {node: i for i, node in enumerate(nodes)}
+        edges = np.array([(index[u], index[v]) for u, v in pg.edges()], dtype=np.int64).reshape(-1, 2)
+        adjacency = csr_matrix((np.ones(len(edges)), (edges[:, 0], edges[:, 1])), shape=(len(nodes), len(nodes)))
+        num, labels = connected_components(adjacency, directed=True, connection='strong')
+        mapping = {node: labels[i] for node, i in index.items()}
+
+        src, trg = labels[edges[:, 0]], labels[edges[:, 1]]
+        cyclic = np.bincount(labels, minlength=num) > 1
+        cyclic[src[edges[:, 0] == edges[:, 1]]] = True  # self loops
+        node_scores = np.array([float(node.score) for node in nodes])
+        own = np.full(num, -np.inf)
+        np.maximum.at(own, labels, node_scores)
+
+        # unique edges between components
+        between = np.unique((src * num + trg)[src != trg])
+        src, trg = between // num, between % num
+        dag = csr_matrix((np.ones(len(src)), (src, trg)), shape=(num, num))
+
+        # levels, removing the components without predecessors left
+        indegree = np.bincount(trg, minlength=num)
+        depth = np.zeros(num, dtype=np.int64)
+        level = np.flatnonzero(indegree == 0)
+        i = 0
+        while len(level) > 0:
+            depth[level] = i
+            successors = dag[level].indices
+            np.subtract.at(indegree, successors, 1)
+            successors = np.unique(successors)
+            level = successors[indegree[successors] == 0]
+            i += 1
+        edge_depth = depth[trg]
+        by_depth = np.argsort(edge_depth, kind='mergesort')
+        bounds = np.searchsorted(edge_depth[by_depth], np.arange(i + 1))
+        levels = [(src[by_depth[a:b]], trg[by_depth[a:b]]) for a, b in zip(bounds[1:], bounds[2:])]
+        return mapping, levels, own, cyclic, dict(zip(nodes, node_scores.tolist()))
 
-        def decide_path(pg, ns, nodes_already_visited):
-            """
-            Given n score_paths, it chooses one according to an aggregation strategy
-            :param pg:
-            :return:
-            """
-            if aggr_strategy is None:
-                max_score = 0
-                for n in ns:
-                    nodes_already_visited.add(n)
-                    score = get_score_continuous_path(pg, n, nodes_already_visited)
-                    if score > max_score:
-                        max_score = score
-            # FIXME: plug in here the logic for the other aggr strategies
-            return score
-
-        def get_score_continuous_path(pg, src, nodes_already_visited):
-            """
-            Traverse graph from src forming a score path
-            :param pg:
-            :param src:
-            :return:
-            """
-            current_score = float(src.score)
-            ns = [x for x in pg.neighbors(src) if x not in nodes_already_visited]  # skip already visited nodes
-            #ns = [x for x in pg.neighbors(src)]
-            if len(ns) == 1:
-                nodes_already_visited.add(ns[0])
-                current_score = current_score + \
-                    get_score_continuous_path(pg, ns[0], nodes_already_visited)
-            elif len(ns) > 1:
-                current_score = current_score + decide_path(pg, ns, nodes_already_visited)
-            # Last option: when there are no neighbors, we simply return
-            # current_store
-            return current_score
-
-        # We reverse the provenance graph
-        pg = self._provenance.prov_graph().reverse()
-        nodes_already_visited = set()
-        # Compute recursively the certainty score for every result
+    def _compute_certainty_scores(self, dag=None):
+        """
+        The certainty score of a result is its score plus the highest certainty score of the
+        elements it was derived from, i.e., the score of its best path from an origin. All of
+        them are computed in one pass over the levels of the provenance DAG. The members of a
+        cycle keep their own score, only the highest one is propagated to what derives from it
+        :param dag: the output of _provenance_dag, if already computed
+        :return:
+        """
+        mapping, levels, own, _, node_scores = self._provenance_dag() if dag is None else dag
+        scores = own.copy()
+        # highest certainty score among the components each one derives from, 0 if none
+        derived = np.zeros(len(own))
+        best = np.full(len(own), -np.inf)
+        for src, trg in levels:
+            np.maximum.at(best, trg, scores[src])
+            targets = np.unique(trg)
+            derived[targets] = best[targets]
+            scores[targets] = own[targets] + derived[targets]
         for el in self.data:
-            if el not in nodes_already_visited:
-                score = get_score_continuous_path(pg, el, nodes_already_visited)
-                self._rank_data[el]['certainty_score'] = score
+            self._rank_data[el]['certainty_score'] = node_scores[el] + float(derived[mapping[el]])
 
-    def _compute_coverage_scores(self):
+    def _compute_coverage_scores(self, dag=None):
+        """
+        The coverage score of a result is the fraction of the origins (leafs of the provenance
+        graph) it can be derived from. The set of origins that reach each element is propagated
+        as a row of a bool matrix in one pass over the levels of the provenance DAG
+        :param dag: the output of _provenance_dag, if already computed
+        :return:
+        """
         # Get total number of ORIGIN elements FIXME: (not KW, etc)
         (leafs, _) = self._provenance.get_leafs_and_heads()
         total_number = len(leafs)
 
-        i = 0
-        for origin in leafs:
+        for i, origin in enumerate(leafs):
             # Assign index to original values
             self._origin_values_coverage[origin] = i
-            i += 1
+
+        mapping, levels, _, cyclic, _ = self._provenance_dag() if dag is None else dag
+        # origins in each component, and origins each component is derived from
+        own_origins = np.zeros((len(cyclic), total_number), dtype=bool)
+        for origin, i in self._origin_values_coverage.items():
+            own_origins[mapping[origin], i] = True
+        covered = np.zeros((len(cyclic), total_number), dtype=bool)
+        covered[cyclic] = own_origins[cyclic]  # members derive from each other
+        for src, trg in levels:
+            np.logical_or.at(covered, trg, covered[src] | own_origins[src])
 
         for el in self.data:
-            # initialize coverage set to False
-            coverage_set = bitarray(len(leafs))
-            coverage_set.setall(False)
-            # Get covered elements
-            elements = self.why(el)
-            for element_covered in elements:
-                idx = self._origin_values_coverage[element_covered]
-                coverage_set[idx] = True
-            coverage = float(len(elements)) / float(total_number)
+            coverage_set = covered[mapping[el]]
+            coverage = float(np.count_nonzero(coverage_set)) / total_number if total_number else 0.
             self._rank_data[el]['coverage_score'] = (coverage, coverage_set)
 
     def compute_ranking_scores(self):
 
-        self._compute_certainty_scores()
-        self._compute_coverage_scores()
+        dag = self._provenance_dag()
+        self._compute_certainty_scores(dag)
+        self._compute_coverage_scores(dag)
 
         self._ranked = True
 
@@ -626,8 +714,10 @@ class DRS:
             else:
                 value = (el, 0)  # no certainty score is like 0
             elements.append(value)
-        elements = sorted(elements, key=lambda a: a[1], reverse=True)
+        scores = np.array([score for (el, score) in elements], dtype=float)
+        elements = [elements[i] for i in np.argsort(-scores, kind='mergesort')]
         self._data = [el for (el, score) in elements]  # save data in order
+        self._sorted_nids = None
         self._ranking_criteria = self.RankingCriteria.CERTAINTY
         self._chosen_rank = elements  # store ranked data with scores for debugging/inspection
 
@@ -647,10 +737,12 @@ class DRS:
             if 'coverage_score' in score_dict:
                 value = (el, score_dict['coverage_score'])
             else:
-                value = (el, 0)  # no coverage score is like 0
+                value = (el, (0, None))  # no coverage score is like 0
             elements.append(value)
-        elements = sorted(elements, key=lambda a: a[1][0], reverse=True)
+        scores = np.array([score[0] for (el, score) in elements], dtype=float)
+        elements = [elements[i] for i in np.argsort(-scores, kind='mergesort')]
         self._data = [el for (el, score) in elements]  # save data in order
+        self._sorted_nids = None
         self._ranking_criteria = self.RankingCriteria.COVERAGE
         self._chosen_rank = elements  # store ranked data with scores for debugging/inspection
 
@@ -712,7 +804,7 @@ class DRS:
                     new_coverage_set = new_coverage_set | old_coverage_set
                 group_by_table[x.source_name] = new_coverage_set
             for table, bitset in group_by_table.items():
-                new_score = bitset.count() / bitset.length()
+                new_score = np.count_nonzero(bitset) / len(bitset)
                 value = (table, new_score)
                 ranked_list.append(value)
             ranked_list = sorted(ranked_list, key=lambda a: a[1], reverse=True)
@@ -270,6 +270,105 @@ class TestApiutils(unittest.TestCase):
 
         self.assertTrue(ld == 4)
 
+    def test_lazy_provenance(self):
+        print(self._testMethodName)
+
+        h0 = Hit(10, "dba", "table_c", "v", -1)
+
+        h1 = Hit(0, "dba", "table_a", "a", -1)
+        h2 = Hit(1, "dba", "table_a", "b", -1)
+        h3 = Hit(2, "dba", "table_b", "c", -1)
+        drs1 = DRS([h1, h2], Operation(OP.CONTENT_SIM, params=[h0]))
+        drs2 = DRS([h2, h3], Operation(OP.SCHEMA_SIM, params=[h1]))
+
+        drs = drs1.intersection(drs2)
+        # nothing is built until the provenance is asked for
+        self.assertTrue(drs.get_provenance()._p_graph is None)
+
+        prov_graph = drs.get_provenance().prov_graph()
+        edges = prov_graph.edges(keys=True, data=True)
+        self.assertEqual(len(edges), 4)
+        annotated = sorted((src.nid, trg.nid) for src, trg, key, data in edges if 'AND' in data)
+        self.assertEqual(annotated, [(0, 1), (10, 1)])
+
+        # later operations extend the graph, and the absorbed DRS is not changed
+        drs3 = DRS([h0], Operation(OP.PKFK, params=[h3]))
+        drs2.absorb(drs3)
+        self.assertEqual(len(drs.get_provenance().prov_graph().edges()), 4)
+        drs.absorb(drs2)
+        self.assertEqual(len(drs.get_provenance().prov_graph().edges()), 5)
+
+        # drs2 was merged before it grew: its older graph is built once and kept
+        drs4 = DRS([h3], Operation(OP.ORIGIN))
+        drs4.absorb(drs2)
+        drs5 = DRS([h3], Operation(OP.ORIGIN))
+        drs5.absorb(drs2)
+        drs2.absorb(DRS([h1], Operation(OP.PKFK, params=[h0])))
+        self.assertEqual(len(drs2.get_provenance().prov_graph().edges()), 4)
+        self.assertEqual(len(drs4.get_provenance().prov_graph().edges()), 3)
+        older = dict(drs2.get_provenance()._older)
+        self.assertEqual(len(older), 1)
+        self.assertEqual(len(drs5.get_provenance().prov_graph().edges()), 3)
+        self.assertEqual(drs2.get_provenance()._older, older)
+
+    def test_set_operations_sorted_nids(self):
+        print(self._testMethodName)
+
+        hits = [Hit(i, "dba", "table_" + str(i % 3), "f" + str(i), -1) for i in range(10)]
+        drs1 = DRS([hits[i] for i in [7, 2, 5, 0, 2]], Operation(OP.ORIGIN))
+        drs2 = DRS([hits[i] for i in [5, 9, 0, 4]], Operation(OP.ORIGIN))
+
+        nids, positions = drs1.get_sorted_nids()
+        self.assertEqual(list(nids), [0, 2, 5, 7])
+        self.assertEqual([drs1.data[i].nid for i in positions], [0, 2, 5, 7])
+
+        union = DRS(list(drs1.data), Operation(OP.ORIGIN)).union(drs2)
+        self.assertEqual([x.nid for x in union], [0, 2, 4, 5, 7, 9])
+        intersection = DRS(list(drs1.data), Operation(OP.ORIGIN)).intersection(drs2)
+        self.assertEqual([x.nid for x in intersection], [0, 5])
+        difference = DRS(list(drs1.data), Operation(OP.ORIGIN)).set_difference(drs2)
+        self.assertEqual([x.nid for x in difference], [2, 7])
+
+        # tables 0 and 1 are in both, table 2 only in drs1
+        drs3 = DRS([hits[3], hits[4]], Operation(OP.ORIGIN))
+        drs3.set_table_mode()
+        intersection = DRS(list(drs1.data), Operation(OP.ORIGIN)).intersection(drs3)
+        self.assertEqual([x.nid for x in intersection], [0, 3, 4, 7])
+
+    def test_ranking_scores(self):
+        print(self._testMethodName)
+
+        h1 = Hit(0, "dba", "table_a", "a", 0)
+        h2 = Hit(1, "dba", "table_a", "b", 0)
+        h3 = Hit(2, "dba", "table_b", "c", 0.5)
+        h4 = Hit(3, "dba", "table_b", "d", 0.25)
+        h5 = Hit(4, "dba", "table_c", "e", 0.125)
+        drs = DRS([h1, h2], Operation(OP.ORIGIN))
+        drs.absorb(DRS([h3, h5], Operation(OP.CONTENT_SIM, params=[h1])))
+        drs.absorb(DRS([h3], Operation(OP.CONTENT_SIM, params=[h2])))
+        drs.absorb(DRS([h4], Operation(OP.PKFK, params=[h3])))
+        drs = drs.set_difference(DRS([h1, h2], Operation(OP.ORIGIN)))
+
+        drs.rank_coverage()
+        coverage = [(x.nid, score[0]) for x, score in drs._chosen_rank]
+        self.assertEqual(coverage, [(2, 1.0), (3, 1.0), (4, 0.5)])
+
+        drs.rank_certainty()
+        certainty = [(x.nid, score) for x, score in drs._chosen_rank]
+        self.assertEqual(certainty, [(3, 0.75), (2, 0.5), (4, 0.125)])
+
+        # h2 and h3 derive from each other, each keeps its own score and h4 gets the highest one
+        drs = DRS([h1], Operation(OP.ORIGIN))
+        drs.absorb(DRS([h3], Operation(OP.CONTENT_SIM, params=[h1])))
+        drs.absorb(DRS([h4], Operation(OP.CONTENT_SIM, params=[h3])))
+        drs.absorb(DRS([h3], Operation(OP.CONTENT_SIM, params=[h4])))
+        drs.absorb(DRS([h5], Operation(OP.PKFK, params=[h4])))
+        drs = drs.set_difference(DRS([h1], Operation(OP.ORIGIN)))
+
+        drs.rank_certainty()
+        certainty = [(x.nid, score) for x, score in drs._chosen_rank]
+        self.assertEqual(certainty, [(4, 0.625), (2, 0.5), (3, 0.25)])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -63,6 +63,23 @@ join_overlap_th = 0.4
 # Schema similarity parameters
 max_distance_schema_similarity = 10
 
+# LSA parameters (content-sim text)
+lsa = {
+    # "randomized": randomized SVD fitted and applied in one pass
+    # "incremental": incremental PCA over row batches, for matrices that
+    # do not fit in memory densified
+    "mode": "randomized",
+    "n_components": 1000,  # upper bound on the number of components
+    "n_iter": 5,  # power iterations of the randomized SVD
+    # keep the fewest components that explain this ratio of the variance
+    # (e.g. 0.9), None keeps n_components
+    "explained_variance": None,
+    "batch_size": 5000,  # rows per batch in incremental mode
+    # file to persist the fitted model to, with the digest of its TF-IDF
+    # vocabulary, and reuse it from when the vocabulary matches; None disables
+    "model_file": None
+}
+
 # Serde parameters
 serdepath = "./data"
 signcollectionfile = "sigcolfile.pickle"
@@ -77,6 +94,33 @@ db_location = "mongodb://localhost:27017"
 db_host = 'localhost'
 db_port = '9200'
 
+# Store backend, see modelstore.store.open_store: "elastic" is the cluster at
+# db_host:db_port, "sqlite" the embedded store in the file at sqlite_path
+store = {
+    "backend": "elastic",
+    "sqlite_path": "./data/store.db"
+}
+
+# Profile index reads from the store. More than one slice uses a sliced
+# scroll, which needs Elasticsearch 5+; 1 is a plain scroll (2.x and up)
+profile_scan = {
+    "slices": 1,  # slices read concurrently, one thread each
+    "page_size": 1000  # documents per scroll page
+}
+
+# Sample values of the fields (peek_values)
+samples = {
+    "size": 100,  # values kept per field, captured when the field is profiled
+    "cache_fields": 10000  # fields whose samples are kept in memory
+}
+
+# Text signature extraction from the store
+text_signatures = {
+    "ids_per_request": 500,  # documents per scroll page and mtermvectors request
+    "ids_per_task": 5000,  # documents whose term vectors a worker merges per task
+    "processes": None  # worker processes, None uses all cores
+}
+
 ################
 # Cluster configs
 ################
@@ -1,5 +1,5 @@
-from modelstore.elasticstore import StoreHandler
-from modelstore.elasticstore import KWType
+from modelstore.store import KWType
+from modelstore.store import open_store
 from api.apiutils import Operation
 from api.apiutils import OP
 from api.apiutils import Relation
@@ -114,11 +114,7 @@ class DDAPI:
         :param kws: collection (iterable) of keywords (strings)
         :return: the matches in the internal representation
         """
-        o_drs = DRS([], Operation(OP.NONE))
-        for kw in kws:
-            res_drs = self.keyword_search(kw, max_results=max_results)
-            o_drs = o_drs.absorb(res_drs)
-        return o_drs
+        return self.__keywords_drs(kws, KWType.KW_TEXT, OP.KW_LOOKUP, max_results)
 
     def schema_name_search(self, kw: str, max_results=10) -> DRS:
         """
@@ -138,11 +134,7 @@ class DDAPI:
         :param kws: collection (iterable) of keywords (strings)
         :return: a DRS
         """
-        o_drs = DRS([], Operation(OP.NONE))
-        for kw in kws:
-            res_drs = self.schema_name_search(kw, max_results=max_results)
-            o_drs = o_drs.absorb(res_drs)
-        return o_drs
+        return self.__keywords_drs(kws, KWType.KW_SCHEMA, OP.SCHNAME_LOOKUP, max_results)
 
     def table_name_search(self, kw: str, max_results=10) -> DRS:
         """
@@ -161,9 +153,17 @@ class DDAPI:
         :param kws: collection (iterable) of keywords (strings)
         :return: a DRS
         """
+        return self.__keywords_drs(kws, KWType.KW_TABLE, OP.KW_LOOKUP, max_results)
+
+    def __keywords_drs(self, kws: [str], kw_type: KWType, op: OP, max_results) -> DRS:
+        """
+        Searches all the keywords in one request to the store and absorbs the result of each
+        :return: a DRS with the matches of all the keywords
+        """
+        kws = list(kws)
         o_drs = DRS([], Operation(OP.NONE))
-        for kw in kws:
-            res_drs = self.table_name_search(kw, max_results=max_results)
+        for kw, hits in zip(kws, store_client.search_keywords_many(kws, kw_type, max_results)):
+            res_drs = DRS(hits, Operation(op, params=[kw]))
             o_drs = o_drs.absorb(res_drs)
         return o_drs
 
@@ -355,14 +355,16 @@ class DDAPI:
     TC Primitive API
     """
 
-    def paths_between(self, a: DRS, b: DRS, primitives) -> DRS:
+    def paths_between(self, a: DRS, b: DRS, primitives, max_hops=None, limit=None) -> DRS:
         """
         Is there a transitive relationship between any element in a with any element in b?
         This functions finds the answer constrained on the primitive (singular for now) that is passed
-        as a parameter.
+        as a parameter. All elements of a and b are searched from at once.
         :param a:
         :param b:
         :param primitives:
+        :param max_hops: maximum length of the paths, unbounded if None
+        :param limit: maximum number of connected pairs to return, unbounded if None
         :return:
         """
         assert(a.mode == b.mode)
@@ -370,60 +372,47 @@ class DDAPI:
         o_drs.absorb_provenance(a)
         o_drs.absorb_provenance(b)
         if a.mode == DRSMode.FIELDS:
-            for h1 in a:  # h1 is a Hit
-                for h2 in b:  # h2 is a Hit
-                    if h1 == h2:
-                        return o_drs  # same source and target field
-                    res_drs = self.__network.find_path_hit(h1, h2, primitives)
-                    o_drs = o_drs.absorb(res_drs)
+            res_drs = self.__network.find_paths_hits([x for x in a], [x for x in b], primitives, max_hops, limit)
         elif a.mode == DRSMode.TABLE:
-            for h1 in a:  # h1 is a table: str
-                for h2 in b:  # h2 is a table: str
-                    if h1 == h2:
-                        return o_drs  # same source ant target table
-                    res_drs = self.__network.find_path_table(
-                        h1, h2, primitives, self)
-                    o_drs = o_drs.absorb(res_drs)
+            res_drs = self.__network.find_paths_tables([x for x in a], [x for x in b], primitives, max_hops, limit)
+        o_drs = o_drs.absorb(res_drs)
         return o_drs
 
-    def paths(self, a: DRS, primitives) -> DRS:
+    def paths(self, a: DRS, primitives, max_hops=None, limit=None) -> DRS:
         """
         Is there any transitive relationship between any two elements in a?
         This function finds the answer constrained on the primitive (singular for now) passed as parameter
         :param a:
         :param primitives:
+        :param max_hops: maximum length of the paths, unbounded if None
+        :param limit: maximum number of connected pairs to return, unbounded if None
         :return:
         """
         o_drs = DRS([], Operation(OP.NONE))
         o_drs = o_drs.absorb_provenance(a)
         if a.mode == DRSMode.FIELDS:
-            for h1 in a:  # h1 is a Hit
-                for h2 in a:  # h2 is a Hit
-                    if h1 == h2:
-                        continue
-                    res_drs = self.__network.find_path_hit(h1, h2, primitives)
-                    o_drs = o_drs.absorb(res_drs)
+            res_drs = self.__network.find_paths_hits([x for x in a], None, primitives, max_hops, limit)
         elif a.mode == DRSMode.TABLE:
-            for h1 in a:  # h1 is a table: str
-                for h2 in a:  # h2 is a table: str
-                    res_drs = self.__network.find_path_table(
-                        h1, h2, primitives, self)
-                    o_drs = o_drs.absorb(res_drs)
+            res_drs = self.__network.find_paths_tables([x for x in a], None, primitives, max_hops, limit)
+        o_drs = o_drs.absorb(res_drs)
         return o_drs
 
-    def traverse(self, a: DRS, primitives, max_hops) -> DRS:
+    def traverse(self, a: DRS, primitives, max_hops, max_results_per_hop=None) -> DRS:
+        """
+        Which elements can be reached from the elements in a within max_hops hops?
+        :param a:
+        :param primitives: a primitive or a list of primitives to follow
+        :param max_hops: maximum number of hops
+        :param max_results_per_hop: maximum number of new elements per hop, an int or a list with one per hop
+        :return:
+        """
         o_drs = DRS([], Operation(OP.NONE))
         if a.mode == DRSMode.TABLE:
             print("ERROR: input mode TABLE not supported")
             return []
-        fringe = [x for x in a]
         o_drs.absorb_provenance(a)
-        while max_hops > 0:
-            max_hops = max_hops - 1
-            for h in fringe:
-                hits_drs = self.__network.neighbors_id(h, primitives)
-                o_drs = self.union(o_drs, hits_drs)
-            fringe = [x for x in o_drs]  # grow the initial input
+        hits_drs = self.__network.traverse([x for x in a], primitives, max_hops, max_results_per_hop)
+        o_drs = o_drs.absorb(hits_drs)
         return o_drs
 
     """
@@ -485,6 +474,17 @@ class DDAPI:
 
 class ResultFormatter:
 
+    @staticmethod
+    def add_samples(entries, num_values):
+        """
+        Adds the sample values of all the columns of the entries, read in one lookup
+        """
+        fields = [(entry['filename'], col['colname']) for entry in entries for col in entry['schema']]
+        samples = store_client.peek_values_many(fields, num_values)
+        for entry in entries:
+            for col in entry['schema']:
+                col['samples'] = samples[(entry['filename'], col['colname'])]
+
     @staticmethod
     def format_output_for_webclient(raw_output, consider_col_sel):
         """
@@ -504,8 +504,6 @@ class ResultFormatter:
             for (nid, sn, fn) in all_fields:
                 colrepr = {
                     'colname': fn,
-                    # ['fake1', 'fake2'], p.peek((fname, c), 15),
-                    'samples': store_client.peek_values((sn, fn), 15),
                     'selected': set_selected(fn)
                 }
                 colsrepr.append(colrepr)
@@ -527,6 +525,7 @@ class ResultFormatter:
                          consider_col_sel)
                      }
             entries.append(entry)
+        ResultFormatter.add_samples(entries, 15)
         return entries
 
     @staticmethod
@@ -550,7 +549,6 @@ class ResultFormatter:
             for c in all_cols:
                 colrepr = {
                     'colname': c,
-                    'samples': store_client.peek_values((source_name, c), 15),
                     'selected': set_selected(c)
                 }
                 colsrepr.append(colrepr)
@@ -569,6 +567,7 @@ class ResultFormatter:
                          consider_col_sel)
                      }
             entries.append(entry)
+        ResultFormatter.add_samples(entries, 15)
         return entries
 
 
@@ -580,7 +579,7 @@ class API(DDAPI):
     def init_store(self):
         # create store handler
         global store_client
-        store_client = StoreHandler()
+        store_client = open_store()
 
 if __name__ == '__main__':
     print("Aurum API")
@@ -1,8 +1,14 @@
 import matplotlib.pyplot as plt
+import heapq
+import itertools
 import operator
 import networkx as nx
+import numpy as np
 import os
+import json
+from array import array
 from collections import defaultdict
+from collections.abc import Mapping
 from api.apiutils import DRS
 from api.apiutils import Operation
 from api.apiutils import OP
@@ -11,24 +17,42 @@ from api.apiutils import Relation
 from api.apiutils import compute_field_id
 
 
+# Mapped model format, see serialize_network_mapped
+MODEL_FORMAT = "aurum-fieldnetwork"
+MODEL_VERSION = 1
+MODEL_META_FILE = "model.json"
+
+
 def build_hit(sn, fn):
     nid = compute_field_id(sn, fn)
     return Hit(nid, sn, fn, -1)
 
 
 class FieldNetwork:
-    # The core graph
-    __G = nx.MultiGraph()
-    __id_names = dict()
-    __source_ids = defaultdict(list)
 
     def __init__(self, graph=None, id_names=None, source_ids=None):
+        # The core graph, and the id -> info and source -> ids maps; all per instance
         if graph is None:
-            self.__G = nx.MultiGraph()
-        else:
-            self.__G = graph
-            self.__id_names = id_names
-            self.__source_ids = source_ids
+            graph = nx.MultiGraph()
+        if id_names is None:
+            id_names = dict()
+        if source_ids is None:
+            source_ids = defaultdict(list)
+        self.__G = graph
+        self.__id_names = id_names
+        self.__source_ids = source_ids
+        self.__table_graphs = dict()  # relation -> table graph, see build_table_graph
+
+    @classmethod
+    def from_fields(cls, fields: (int, str, str, str, int, int, str)):
+        """
+        Creates a network with the nodes and the meta schema of the fields, see init_meta_schema
+        :param fields: iterable of (nid, db_name, source_name, field_name, total_values, unique_values, data_type)
+        :return: the new network
+        """
+        network = cls()
+        network.init_meta_schema(fields)
+        return network
 
     def graph_order(self):
         return len(self.__id_names.keys())
@@ -77,6 +101,24 @@ class FieldNetwork:
             return 0  # no cardinality is like card 0
         return card
 
+    def get_cardinality_vector(self):
+        """
+        Returns the list of all nids and the numpy array with the cardinality of each
+        (0 for no cardinality), in the same order
+        """
+        nids = list(self.__id_names.keys())
+        nodes = self.__G.node
+        cardinality = np.array([nodes[nid]['cardinality'] for nid in nids], dtype=float)
+        cardinality[np.isnan(cardinality)] = 0  # no cardinality is like card 0
+        return nids, cardinality
+
+    def get_relation_edges(self, relation):
+        """
+        Returns all edges of the given relation as (src, target, score) tuples, each once
+        """
+        return [(src, target, data['score'])
+                for src, target, key, data in self.__G.edges(keys=True, data=True) if key == relation]
+
     def _get_underlying_repr_graph(self):
         return self.__G
 
@@ -101,13 +143,16 @@ class FieldNetwork:
         :return:
         """
         print("Building schema relation...")
-        for (nid, db_name, sn_name, fn_name, total_values, unique_values, data_type) in fields:
+        fields = list(fields)
+        nids = [None] * len(fields)
+        cardinalities = [None] * len(fields)
+        for i, (nid, db_name, sn_name, fn_name, total_values, unique_values, data_type) in enumerate(fields):
             self.__id_names[nid] = (db_name, sn_name, fn_name, data_type)
             self.__source_ids[sn_name].append(nid)
-            cardinality_ratio = None
+            nids[i] = nid
             if float(total_values) > 0:
-                cardinality_ratio = float(unique_values) / float(total_values)
-            self.add_field(nid, cardinality_ratio)
+                cardinalities[i] = float(unique_values) / float(total_values)
+        self.add_fields_bulk(nids, cardinalities)
         print("Building schema relation...OK")
 
     def add_field(self, nid, cardinality=None):
@@ -120,6 +165,15 @@ class FieldNetwork:
         self.__G.add_node(nid, cardinality=cardinality)
         return nid
 
+    def add_fields_bulk(self, nids, cardinalities):
+        """
+        Creates the graph nodes for many fields at once
+        :param nids: the ids of the nodes
+        :param cardinalities: the cardinality of each node, or None
+        :return:
+        """
+        self.__G.add_nodes_from((nid, {'cardinality': card}) for nid, card in zip(nids, cardinalities))
+
     def add_fields(self, list_of_fields):
         """
         Creates a list of graph nodes from the list of fields and adds them to the graph
@@ -144,6 +198,19 @@ class FieldNetwork:
         """
         score = {'score': score}
         self.__G.add_edge(node_src, node_target, relation, score)
+        self._invalidate_table_graph(relation)
+
+    def add_relations_bulk(self, src, target, relation, scores):
+        """
+        Adds or updates the score of relation for the edges between src[i] and target[i]
+        :param src: the source nodes (sequence or array)
+        :param target: the target nodes
+        :param relation: the type of relation (edge)
+        :param scores: the numerical value of the score of each edge
+        :return:
+        """
+        self.__G.add_edges_from((s, t, relation, {'score': float(score)}) for s, t, score in zip(src, target, scores))
+        self._invalidate_table_graph(relation)
 
     def fields_degree(self, topk):
         degree = nx.degree(self.__G)
@@ -188,230 +255,671 @@ class FieldNetwork:
         if relation == Relation.SCHEMA_SIM:
             return OP.SCHEMA_SIM
 
+    def get_hit(self, nid, score=0):
+        (db_name, source_name, field_name, data_type) = self.__id_names[nid]
+        return Hit(nid, db_name, source_name, field_name, score)
+
+    def neighbors_nids(self, nid, relation: Relation) -> [(str, float)]:
+        """
+        Returns the (nid, score) of the neighbors of nid through relation, without building a DRS
+        """
+        neighbours = self.__G[nid]
+        return [(k, v[relation]['score']) for k, v in neighbours.items() if relation in v]
+
     def neighbors_id(self, hit: Hit, relation: Relation) -> DRS:
         if isinstance(hit, Hit):
             nid = hit.nid
         if isinstance(hit, str):
             nid = hit
-        data = []
-        neighbours = self.__G[nid]
-        for k, v in neighbours.items():
-            if relation in v:
-                score = v[relation]['score']
-                (db_name, source_name, field_name, data_type) = self.__id_names[k]
-                data.append(Hit(k, db_name, source_name, field_name, score))
+        data = [self.get_hit(k, score) for k, score in self.neighbors_nids(nid, relation)]
         op = self.get_op_from_relation(relation)
         o_drs = DRS(data, Operation(op, params=[hit]))
         return o_drs
 
-    def _bidirectional_pred_succ(self, source, target, relation):
+    def _drs_from_edges(self, origins: [Hit], edges) -> DRS:
         """
-        Bidirectional shortest path helper.
-        :returns (pred,succ,w) where
-        :param pred is a dictionary of predecessors from w to the source, and
-        :param succ is a dictionary of successors from w to the target.
+        Builds the DRS of the fields reached from origins, with provenance only for the given edges
+        :param origins: the hits the search started from
+        :param edges: iterable of (parent nid, nid, score, relation), each parent is an origin or reached before
+        :return: a DRS with the reached hits
         """
-        o_drs = DRS([], Operation(OP.NONE))  # Works as a carrier of provenance
-        # does BFS from both source and target and meets in the middle
-        if target == source:
-            return {target: None}, {source: None}, source, o_drs
-
-        # we always have an undirected graph
-        Gpred = self.neighbors_id
-        Gsucc = self.neighbors_id
-
-        # predecesssor and successors in search
-        pred = {source: None}
-        succ = {target: None}
+        o_drs = DRS([], Operation(OP.NONE))
+        provenance = o_drs.get_provenance()
+        provenance.populate_provenance(origins, OP.ORIGIN, None)
+        hits = {h.nid: h for h in origins}
+        reached = dict()
+        for parent, nid, score, relation in edges:
+            hit = self.get_hit(nid, score)
+            provenance.populate_provenance([hit], self.get_op_from_relation(relation), [hits[parent]])
+            hits.setdefault(nid, hit)
+            reached.setdefault(nid, hit)
+        return o_drs.set_data(reached.values())
+
+    def _drs_from_table_paths(self, paths, relation) -> DRS:
+        """
+        Builds the DRS of table paths, see find_paths_tables. The fields of the first and last
+        table of each path are origins; each hop is linked by its best scored witness field pair,
+        and consecutive witnesses in the same table by a TABLE hop
+        :param paths: list of paths, each a list of (table, next table, _) hops
+        :param relation: the relation of the hops
+        :return: a DRS with the fields on the paths
+        """
+        table_graph = self.get_table_graph(relation)
+        o_drs = DRS([], Operation(OP.NONE))
+        provenance = o_drs.get_provenance()
+        op = self.get_op_from_relation(relation)
+        data = set()
+        for path in paths:
+            for table in [path[0][0], path[-1][1]]:
+                hits = self.get_hits_from_table(table)
+                provenance.populate_provenance(hits, OP.ORIGIN, None)
+                data.update(hits)
+            previous = None
+            for table, next_table, _ in path:
+                src, target, score = max(table_graph[table][next_table], key=operator.itemgetter(2))
+                src_hit = self.get_hit(src)
+                if previous is not None and previous != src_hit:
+                    provenance.populate_provenance([src_hit], OP.TABLE, [previous])
+                target_hit = self.get_hit(target, score)
+                provenance.populate_provenance([target_hit], op, [src_hit])
+                data.update([src_hit, target_hit])
+                previous = target_hit
+        return o_drs.set_data(data)
+
+    def _multi_bidirectional_pred_succ(self, sources, targets, neighbors, max_hops=None, limit=None):
+        """
+        Bidirectional BFS that starts from all sources and all targets at once. Every node keeps
+        all the sources (targets) that reach it, each with its own predecessor (successor), and
+        when both searches touch a meeting is recorded for every (source, target) pair they join,
+        the shortest connection of each, until the fringes are exhausted or a bound is reached
+        :param sources: the source nodes
+        :param targets: the target nodes
+        :param neighbors: function of a node that returns its (neighbor, edge data) pairs
+        :param max_hops: maximum length of the paths, unbounded if None
+        :param limit: maximum number of pairs, unbounded if None
+        :returns (pred,succ,meetings) where
+        :param pred is a dictionary of node -> {source: (predecessor, edge data)} towards the sources,
+        :param succ is a dictionary of node -> {target: (successor, edge data)} towards the targets, and
+        :param meetings is a dictionary of (source, target) -> (v, w, edge data), the edge that connects them
+        """
+        pred = {x: {x: None} for x in sources}
+        succ = {x: {x: None} for x in targets}
+        # node -> {origin: hops from the origin}, of each search
+        pred_depth = {x: {x: 0} for x in sources}
+        succ_depth = {x: {x: 0} for x in targets}
+        meetings = dict()
+        lengths = dict()
+
+        def meet(v, w, data, v_sources, w_targets):
+            for source in v_sources:
+                for target in w_targets:
+                    pair = (source, target)
+                    length = pred_depth[v][source] + 1 + succ_depth[w][target]
+                    # a shorter connection may show up later in the same or the next level
+                    if source != target and length < lengths.get(pair, length + 1):
+                        meetings[pair] = (v, w, data)
+                        lengths[pair] = length
+
+        def expand(fringe, reached, depth, other, forward):
+            # fringe is node -> the origins that reached it in the last level, only those move on
+            next_fringe = dict()
+            for v, new in fringe.items():
+                for w, data in neighbors(v):
+                    if w in other:
+                        if forward:
+                            meet(v, w, data, new, other[w])
+                        else:
+                            meet(w, v, data, other[w], new)
+                    w_reached = reached.setdefault(w, dict())
+                    w_depth = depth.setdefault(w, dict())
+                    for origin in new:
+                        if origin not in w_reached:
+                            w_reached[origin] = (v, data)
+                            w_depth[origin] = depth[v][origin] + 1
+                            next_fringe.setdefault(w, []).append(origin)
+            return next_fringe
 
         # initialize fringes, start with forward
-        forward_fringe = [source]
-        reverse_fringe = [target]
-
-        while forward_fringe and reverse_fringe:
-            if len(forward_fringe) <= len(reverse_fringe):
-                this_level = forward_fringe
-                forward_fringe = []
-                for v in this_level:
-                    successors = Gsucc(v, relation)
-                    o_drs = o_drs.absorb(successors)  # Keep provenance
-                    for w in successors:
-                        if w not in pred:
-                            forward_fringe.append(w)
-                            pred[w] = v
-                        if w in succ:
-                            return pred, succ, w, o_drs  # found path
+        forward_fringe = {x: [x] for x in pred}
+        reverse_fringe = {x: [x] for x in succ}
+        hops = 0
+        num_pairs = len(set(sources)) * len(set(targets)) - len(set(sources) & set(targets))
+
+        # an origin that arrives late can still meet the other side, so the search goes on until
+        # the fringes are exhausted, or every pair met and no shorter connection is left: after
+        # hops levels of both sides, all the connections up to hops long have been seen
+        while forward_fringe or reverse_fringe:
+            if max_hops is not None and hops >= max_hops:
+                break
+            if limit is not None and len(meetings) >= limit:
+                break
+            if len(meetings) == num_pairs and hops >= max(lengths.values(), default=0):
+                break
+            hops += 1
+            forward_size = sum(len(new) for new in forward_fringe.values())
+            reverse_size = sum(len(new) for new in reverse_fringe.values())
+            if forward_fringe and (not reverse_fringe or forward_size <= reverse_size):
+                forward_fringe = expand(forward_fringe, pred, pred_depth, succ, True)
             else:
-                this_level = reverse_fringe
-                reverse_fringe = []
-                for v in this_level:
-                    predecessors = Gpred(v, relation)
-                    o_drs = o_drs.absorb(predecessors)
-                    for w in predecessors:
-                        if w not in succ:
-                            succ[w] = v
-                            reverse_fringe.append(w)
-                        if w in pred:
-                            return pred, succ, w, o_drs  # found path
-        return None
-
-    def _bidirectional_pred_succ_with_table_hops(self, source, target, relation, api):
-
-        def get_table_neighbors(hit, relation):
-            direct_neighbors = self.neighbors_id(hit, relation)
-            table_neighbors = api.drs_expand_to_table(direct_neighbors)
-            return [x for x in table_neighbors]
-
-        def deep_explore(candidates, target_group, already_visited, path, max_hops):
-            """
-            Recursively depth-first explore the graph.
-            Returns (boolean, [])
-            """
-
-            local_max_hops = max_hops
-
-            if local_max_hops == 0:
-                return False
-
-            # first check membership
-            for c in candidates:
-                if c in target_group:
-                    path.insert(0, c)
-                    return True
-
-            # if not, then we explore these individually
-            for c in candidates:
-                if c in already_visited:
-                    continue  # next candidate
-                else:
-                    already_visited.append(c)  # add candidate to set of already visited
-
-                next_level_candidates = get_table_neighbors(c, relation)  # get next set of candidates
-                if len(next_level_candidates) == 0:
+                reverse_fringe = expand(reverse_fringe, succ, succ_depth, pred, False)
+        if limit is not None:
+            meetings = dict(list(meetings.items())[:limit])
+        return pred, succ, meetings
+
+    def _multi_source_pred(self, sources, neighbors, max_hops=None, limit=None):
+        """
+        BFS that starts from all sources at once. Every node keeps all the sources that reach it,
+        each with its own predecessor, and the shortest connection of each pair of sources is
+        recorded where their searches touch
+        :param sources: the source nodes
+        :param neighbors: function of a node that returns its (neighbor, edge data) pairs
+        :param max_hops: maximum length of the paths, unbounded if None
+        :param limit: maximum number of pairs, unbounded if None
+        :returns (pred,meetings) where
+        :param pred is a dictionary of node -> {source: (predecessor, edge data)} towards the sources, and
+        :param meetings is a dictionary of (source, source) -> (v, w, edge data), the edge that connects them
+        """
+        pred = {x: {x: None} for x in sources}
+        depth = {x: {x: 0} for x in sources}
+        meetings = dict()
+        lengths = dict()
+
+        fringe = {x: [x] for x in pred}
+        hops = 0
+        num_sources = len(set(sources))
+        num_pairs = num_sources * (num_sources - 1) // 2
+        while fringe:
+            # a meeting while expanding the next level is at least 2 * hops + 1 long
+            if max_hops is not None and 2 * hops + 1 > max_hops:
+                break
+            if limit is not None and len(meetings) >= limit:
+                break
+            # every pair met, and all the connections up to 2 * hops long have been seen
+            if len(meetings) == num_pairs and 2 * hops >= max(lengths.values(), default=0):
+                break
+            level = hops
+            hops += 1
+            next_fringe = dict()
+            for v, new in fringe.items():
+                for w, data in neighbors(v):
+                    w_depth = depth.setdefault(w, dict())
+                    for source in new:
+                        for other, other_depth in w_depth.items():
+                            if other == source:
+                                continue
+                            length = level + 1 + other_depth
+                            if max_hops is not None and length > max_hops:
+                                continue
+                            # pairs are unordered, a shorter connection replaces the one found first
+                            pair = (source, other)
+                            meeting = (v, w, data)
+                            if pair[::-1] in lengths:
+                                pair = pair[::-1]
+                                meeting = (w, v, data)
+                            if length < lengths.get(pair, length + 1):
+                                meetings[pair] = meeting
+                                lengths[pair] = length
+                    w_pred = pred.setdefault(w, dict())
+                    for source in new:
+                        if source not in w_pred:
+                            w_pred[source] = (v, data)
+                            w_depth[source] = level + 1
+                            next_fringe.setdefault(w, []).append(source)
+            fringe = next_fringe
+        if limit is not None:
+            meetings = dict(list(meetings.items())[:limit])
+        return pred, meetings
+
+    def build_table_graph(self, relations=None):
+        """
+        Precomputes the table graph of each relation: two tables are adjacent if any of their
+        fields are, and each adjacency keeps the (src_nid, target_nid, score) field pairs that
+        witness it, oriented from the table to its neighbor. Edges within a table are skipped
+        :param relations: the relations to build, all by default
+        :return:
+        """
+        if relations is None:
+            relations = list(Relation)
+        id_names = self.__id_names
+        for relation in relations:
+            table_graph = defaultdict(lambda: defaultdict(list))
+            for src, target, score in self.get_relation_edges(relation):
+                src_table = id_names[src][1]
+                target_table = id_names[target][1]
+                if src_table == target_table:
                     continue
-                next_max_hops = local_max_hops - 1  # reduce one level depth and go ahead
-                success = deep_explore(next_level_candidates, target_group, already_visited, path, next_max_hops)
-                if success:
-                    path.insert(0, c)
-                    return True
-            return False  # if all nodes were already visited
-
-        # maximum number of hops
-        max_hops = 5
-
-        o_drs = DRS([], Operation(OP.NONE))  # Carrier of provenance
-
-        # TODO: same src == trg, etc
-
-        src_drs = api.drs_from_table(source)
-        trg_drs = api.drs_from_table(target)
-
-        found_paths = []
-        path = []
-        candidates = [x for x in src_drs]
-
-        for c in candidates:
-            success = deep_explore([c], [x for x in trg_drs], [], path, max_hops)
-            if success:
-                found_paths.append(path)
-            path = []
-
-    def real_bidirectional_pred_succ_with_table_hops(self, source, target, relation, api):
-        """
-        Bidirectional shortest path with table hops, i.e. two-relation exploration
-        :returns (pred,succ,w) where
-        :param pred is a dictionary of predecessors from w to the source, and
-        :param succ is a dictionary of successors from w to the target.
-        """
-        def neighbors_with_table_hop(hit, rel) -> DRS:
-            o_drs = DRS([], Operation(OP.NONE))
-
-            hits = self.get_hits_from_table(hit.source_name)
-            table_neighbors_drs = DRS([x for x in hits], Operation(OP.TABLE, params=[hit]))
-
-            o_drs = o_drs.absorb_provenance(table_neighbors_drs)
-            neighbors_with_table = set()
-            for n in table_neighbors_drs:
-                neighbors_of_n = self.neighbors_id(n, rel)
-                o_drs = o_drs.absorb_provenance(neighbors_of_n)
-                for match in neighbors_of_n:
-                    neighbors_with_table.add(match)
-            # just assign data here
-            o_drs = o_drs.set_data(neighbors_with_table)
-            return o_drs
-
-        o_drs = DRS([], Operation(OP.NONE))  # Carrier of provenance
-
-        # does BFS from both source and target and meets in the middle
-        src_drs = api.drs_from_table(source)
-        o_drs = o_drs.absorb(src_drs)
-        trg_drs = api.drs_from_table(target)
-        o_drs = o_drs.absorb(trg_drs)
-        src_drs.set_table_mode()
-        if target in src_drs:  # source and target are in the same table
-            return {x: None for x in trg_drs}, {x: None for x in src_drs}, [x for x in src_drs], o_drs
-        src_drs.set_fields_mode()
-        trg_drs.set_fields_mode()
-
-        # we always have an undirected graph
-        Gpred = neighbors_with_table_hop
-        Gsucc = neighbors_with_table_hop
-
-        # predecessor and successors in search
-        # pred = {source: None}
-        # succ = {target: None}
-        pred = {x: None for x in src_drs}
-        succ = {x: None for x in trg_drs}
+                table_graph[src_table][target_table].append((src, target, score))
+                table_graph[target_table][src_table].append((target, src, score))
+            self.__table_graphs[relation] = {table: dict(neighbors) for table, neighbors in table_graph.items()}
 
-        # initialize fringes, start with forward
-        forward_fringe = [x for x in src_drs]
-        reverse_fringe = [x for x in trg_drs]
-
-        while forward_fringe and reverse_fringe:
-            if len(forward_fringe) <= len(reverse_fringe):
-                this_level = forward_fringe
-                forward_fringe = []
-                for v in this_level:
-                    successors = Gsucc(v, relation)
-                    o_drs = o_drs.absorb(successors)
-                    for w in successors:
-                        if w not in pred:
-                            forward_fringe.append(w)
-                            pred[w] = v
-                        if w in succ:
-                            return pred, succ, w, o_drs  # found path
-            else:
-                this_level = reverse_fringe
-                reverse_fringe = []
-                for v in this_level:
-                    predecessors = Gpred(v, relation)
-                    o_drs = o_drs.absorb(predecessors)
-                    for w in predecessors:
-                        if w not in succ:
-                            succ[w] = v
-                            reverse_fringe.append(w)
-                        if w in pred:
-                            return pred, succ, w, o_drs  # found path
-        return None
+    def get_table_graph(self, relation):
+        """
+        Returns the table graph of relation, table -> {neighbor_table: [witness field pairs]},
+        building it if it was not yet, see build_table_graph
+        """
+        if relation not in self.__table_graphs:
+            self.build_table_graph([relation])
+        return self.__table_graphs[relation]
+
+    def _invalidate_table_graph(self, relation):
+        self.__table_graphs.pop(relation, None)
+
+    def find_paths_hits(self, sources: [Hit], targets: [Hit], relation, max_hops=None, limit=None) -> DRS:
+        """
+        Finds paths through relation between the source and target fields, with one search for
+        all of them, see _multi_bidirectional_pred_succ. The search runs on the raw adjacency;
+        only the paths found get a DRS and provenance
+        :param sources: the source Hits
+        :param targets: the target Hits, None for paths among the sources
+        :param relation: the relation to follow
+        :param max_hops: maximum length of the paths, unbounded if None
+        :param limit: maximum number of (source, target) pairs to connect, unbounded if None
+        :return: a DRS with the fields on the paths
+        """
+        def neighbors(nid):
+            return self.neighbors_nids(nid, relation)
+
+        if targets is None:
+            targets = []
+            pred, meetings = self._multi_source_pred([h.nid for h in sources], neighbors, max_hops, limit)
+            succ = pred
+        else:
+            pred, succ, meetings = self._multi_bidirectional_pred_succ(
+                [h.nid for h in sources], [h.nid for h in targets], neighbors, max_hops, limit)
+        edges = []
+        for pair, meeting in meetings.items():
+            edges.extend((v, w, score, relation) for v, w, score in path_edges(pred, succ, pair, meeting))
+        hits = {h.nid: h for h in itertools.chain(sources, targets)}
+        origins = [hits[source] for source, _ in meetings]
+        o_drs = self._drs_from_edges(origins, edges)
+        return o_drs.set_data(set(origins) | set(o_drs.data))
 
     def find_path_hit(self, source, target, relation):
-        # source and target are Hit
-        results = self._bidirectional_pred_succ(source, target, relation)
-        if results is None:  # check for None result
-            return DRS([], Operation(OP.NONE))
-        pred, succ, w, o_drs = results
+        """
+        Finds a shortest path between the source and target fields through relation
+        :param source: the source Hit
+        :param target: the target Hit
+        :param relation: the relation to follow
+        :return: a DRS with the fields on the path
+        """
+        return self.find_paths_hits([source], [target], relation, limit=1)
 
-        return o_drs
+    def traverse(self, hits: [Hit], relations, max_hops, max_results_per_hop=None) -> DRS:
+        """
+        Breadth first search from hits through relations, up to max_hops hops. Each hop expands
+        only the fields reached in the previous one, and only the edges that first reach each
+        field are kept in the provenance
+        :param hits: the hits to start from
+        :param relations: a relation or a list of relations to follow
+        :param max_hops: maximum number of hops
+        :param max_results_per_hop: maximum number of new fields per hop, an int for all hops or a
+        list with one per hop (None for no maximum); the best scored are kept
+        :return: a DRS with the fields reached
+        """
+        if isinstance(relations, Relation):
+            relations = [relations]
+        if max_results_per_hop is None or isinstance(max_results_per_hop, int):
+            max_results_per_hop = [max_results_per_hop] * max_hops
+
+        visited = {h.nid for h in hits}
+        fringe = list(visited)
+        edges = []
+        for hop in range(max_hops):
+            if not fringe:
+                break
+            reached = dict()  # nid -> (parent nid, nid, score, relation), the first edge that reaches it
+            for v in fringe:
+                for relation in relations:
+                    for w, score in self.neighbors_nids(v, relation):
+                        if w not in visited and w not in reached:
+                            reached[w] = (v, w, score, relation)
+            new_edges = list(reached.values())
+            cap = max_results_per_hop[hop] if hop < len(max_results_per_hop) else None
+            if cap is not None and len(new_edges) > cap:
+                new_edges = heapq.nlargest(cap, new_edges, key=operator.itemgetter(2))
+            edges.extend(new_edges)
+            fringe = [nid for _, nid, _, _ in new_edges]
+            visited.update(fringe)
+        return self._drs_from_edges(hits, edges)
+
+    def find_paths_tables(self, sources: [str], targets: [str], relation, max_hops=None, limit=None) -> DRS:
+        """
+        Finds paths of table hops between the source and target tables, where consecutive tables
+        are linked by relation, with one search over the table graph for all of them
+        :param sources: names of the source tables
+        :param targets: names of the target tables, None for paths among the sources
+        :param relation: the relation that links the tables
+        :param max_hops: maximum number of table hops, unbounded if None
+        :param limit: maximum number of (source, target) pairs to connect, unbounded if None
+        :return: a DRS with the fields on the paths
+        """
+        table_graph = self.get_table_graph(relation)
+
+        def neighbors(table):
+            # witnesses are oriented, they are looked up once the path is known
+            return [(neighbor, None) for neighbor in table_graph.get(table, ())]
+
+        if targets is None:
+            pred, meetings = self._multi_source_pred(sources, neighbors, max_hops, limit)
+            succ = pred
+        else:
+            pred, succ, meetings = self._multi_bidirectional_pred_succ(sources, targets, neighbors, max_hops, limit)
+        paths = [path_edges(pred, succ, pair, meeting) for pair, meeting in meetings.items()]
+        return self._drs_from_table_paths(paths, relation)
 
     def find_path_table(self, source: str, target: str, relation, api):
+        """
+        Finds a shortest path of table hops between the source and target tables. Only the
+        provenance of the path is built: for each hop, the highest scored field pair that witnesses it
+        :param source: name of the source table
+        :param target: name of the target table
+        :param relation: the relation that links the tables
+        :param api: the calling DDAPI
+        :return: a DRS with the fields on the path
+        """
+        return self.find_paths_tables([source], [target], relation, limit=1)
 
-        # source and target are strings with the table name
-        results = self._bidirectional_pred_succ_with_table_hops(source, target, relation, api)
-        if results is None:  # check for None result
-            return DRS([], Operation(OP.NONE))
-        pred, succ, w, o_drs = results
 
-        return o_drs
+def path_edges(pred, succ, pair, meeting):
+    """
+    Returns the path of a meeting of a bidirectional search as (node, next node, edge data) edges
+    :param pred: dictionary of node -> {source: (predecessor, edge data)} towards the sources
+    :param succ: dictionary of node -> {target: (successor, edge data)} towards the targets
+    :param pair: the (source, target) the meeting connects
+    :param meeting: the (v, w, edge data) edge where both searches met
+    :return: the edges from the source to the target
+    """
+    source, target = pair
+    v, w, data = meeting
+    edges = [(v, w, data)]
+    while pred[v][source] is not None:
+        predecessor, edge_data = pred[v][source]
+        edges.insert(0, (predecessor, v, edge_data))
+        v = predecessor
+    while succ[w][target] is not None:
+        successor, edge_data = succ[w][target]
+        edges.append((w, successor, edge_data))
+        w = successor
+    return edges
+
+def build_csr(src, target, scores, num_nodes):
+    """
+    Builds the CSR (indptr, indices, scores) of the edges src[i] -> target[i]; for repeated
+    edges the last one wins
+    """
+    order = np.lexsort((target, src))  # stable, so the latest edge is last
+    src, target, scores = src[order], target[order], scores[order]
+    last = np.ones(len(src), dtype=bool)
+    last[:-1] = (src[1:] != src[:-1]) | (target[1:] != target[:-1])
+    src, target, scores = src[last], target[last], scores[last]
+    indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=num_nodes), out=indptr[1:])
+    return indptr, target.astype(np.int32), scores.astype(np.float32)
+
+
+class SortedIndex(Mapping):
+    """
+    Read-only nid -> position map over a sorted array of nids, looked up by binary search
+    """
+
+    def __init__(self, nids):
+        self.nids = nids
+
+    def __getitem__(self, nid):
+        idx = int(np.searchsorted(self.nids, nid))
+        if idx < len(self.nids) and self.nids[idx] == nid:
+            return idx
+        raise KeyError(nid)
+
+    def __iter__(self):
+        for nid in self.nids:
+            yield str(nid)
+
+    def __len__(self):
+        return len(self.nids)
+
+
+class MappedIdNames(SortedIndex):
+    """
+    Read-only nid -> (db_name, source_name, field_name, data_type) map over arrays
+    """
+
+    def __init__(self, nids, db_names, source_names, field_names, data_types):
+        super().__init__(nids)
+        self.columns = (db_names, source_names, field_names, data_types)
+
+    def __getitem__(self, nid):
+        idx = super().__getitem__(nid)
+        return tuple(str(column[idx]) for column in self.columns)
+
+
+class MappedSourceIds(Mapping):
+    """
+    Read-only source_name -> [nid] map over a sorted array of table names and a CSR of
+    the positions of their fields
+    """
+
+    def __init__(self, nids, table_names, table_indptr, table_fields):
+        self.nids = nids
+        self.tables = SortedIndex(table_names)
+        self.indptr = table_indptr
+        self.fields = table_fields
+
+    def __getitem__(self, source_name):
+        if source_name not in self.tables:
+            return []  # as the defaultdict
+        idx = self.tables[source_name]
+        return [str(self.nids[f]) for f in self.fields[self.indptr[idx]:self.indptr[idx + 1]]]
+
+    def __contains__(self, source_name):
+        return source_name in self.tables
+
+    def __iter__(self):
+        return iter(self.tables)
+
+    def __len__(self):
+        return len(self.tables)
+
+
+class CompactFieldNetwork(FieldNetwork):
+    """
+    FieldNetwork that assigns dense int ids to the fields and keeps one CSR adjacency
+    (indptr, indices, float32 scores) per Relation instead of a networkx MultiGraph.
+    Relations are appended to a buffer that is compacted into the CSR on the next read.
+    Networks loaded from the mapped model format are backed by read-only arrays: new
+    relations can be added among their fields, but no new fields (ValueError).
+    """
+
+    def __init__(self, id_names=None, source_ids=None):
+        if id_names is None:
+            id_names = dict()
+        if source_ids is None:
+            source_ids = defaultdict(list)
+        super().__init__(nx.MultiGraph(), id_names, source_ids)
+        self.__nids = []
+        self.__nid_to_idx = dict()
+        self.__cardinality = array('d')
+        self.__pending = dict()  # relation -> (src, target, score) arrays, both directions
+        self.__csr = dict()  # relation -> (indptr, indices, scores)
+        self.__mapped = False  # fields backed by read-only arrays, see from_arrays
+
+    @classmethod
+    def from_network(cls, network):
+        """
+        Builds a compact copy of network (any FieldNetwork)
+        """
+        compact = cls(dict(network._get_underlying_repr_id_to_field_info()),
+                      defaultdict(list, network._get_underlying_repr_table_to_ids()))
+        nids, cardinality = network.get_cardinality_vector()
+        for nid, card in zip(nids, cardinality):
+            compact.add_field(nid, card)
+        for relation in Relation:
+            edges = network.get_relation_edges(relation)
+            if edges:
+                src, target, scores = zip(*edges)
+                compact.add_relations_bulk(src, target, relation, scores)
+        return compact
+
+    @classmethod
+    def from_arrays(cls, nids, cardinality, info, tables, csr):
+        """
+        Builds a network backed by arrays (e.g. memory-mapped), see deserialize_network_mapped
+        :param nids: sorted array of nids, the position of a nid is its int id
+        :param cardinality: array of cardinalities (nan for none)
+        :param info: arrays of db_name, source_name, field_name and data_type
+        :param tables: sorted array of table names, indptr and positions of their fields
+        :param csr: dict relation -> (indptr, indices, scores)
+        """
+        network = cls(MappedIdNames(nids, *info), MappedSourceIds(nids, *tables))
+        network.__nids = nids
+        network.__nid_to_idx = SortedIndex(nids)
+        network.__cardinality = cardinality
+        network.__csr = dict(csr)
+        network.__mapped = True
+        return network
+
+    def __nid(self, idx):
+        return str(self.__nids[idx])
+
+    def __index_of(self, nid):
+        idx = self.__nid_to_idx.get(nid)
+        if idx is None:
+            self.__check_writable_fields()
+            idx = len(self.__nids)
+            self.__nid_to_idx[nid] = idx
+            self.__nids.append(nid)
+            self.__cardinality.append(np.nan)
+        return idx
+
+    def __check_writable_fields(self):
+        if self.__mapped:
+            raise ValueError("The fields of a network opened from a mapped model are read-only")
+
+    def __compact(self, relation):
+        """
+        Merges the buffered relations into the CSR of relation; for repeated edges the
+        last score added wins, as in add_relation
+        """
+        num_nodes = len(self.__nids)
+        src, target, scores = self.__pending.pop(relation)
+        src = np.array(src, dtype=np.int64)
+        target = np.array(target, dtype=np.int64)
+        scores = np.array(scores, dtype=np.float32)
+        if relation in self.__csr:
+            indptr, indices, old_scores = self.__csr[relation]
+            old_src = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+            src = np.concatenate((old_src, src))
+            target = np.concatenate((indices, target))
+            scores = np.concatenate((old_scores, scores))
+        self.__csr[relation] = build_csr(src, target, scores, num_nodes)
+
+    def __adjacency(self, relation):
+        if relation in self.__pending:
+            self.__compact(relation)
+        return self.__csr.get(relation)
+
+    def __row(self, relation, idx):
+        """
+        Returns the (indices, scores) of the neighbors of idx through relation
+        """
+        csr = self.__adjacency(relation)
+        if csr is None or idx + 1 >= len(csr[0]):
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        indptr, indices, scores = csr
+        start, end = indptr[idx], indptr[idx + 1]
+        return indices[start:end], scores[start:end]
+
+    def get_cardinality_of(self, node_id):
+        card = self.__cardinality[self.__nid_to_idx[node_id]]
+        if np.isnan(card):
+            return 0  # no cardinality is like card 0
+        return card
+
+    def get_cardinality_vector(self):
+        nids = list(self.iterate_ids())
+        cardinality = np.array([self.__cardinality[self.__nid_to_idx[nid]] for nid in nids], dtype=float)
+        cardinality[np.isnan(cardinality)] = 0  # no cardinality is like card 0
+        return nids, cardinality
+
+    def get_relation_edges(self, relation):
+        csr = self.__adjacency(relation)
+        if csr is None:
+            return []
+        indptr, indices, scores = csr
+        src = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        once = src <= indices  # both directions are stored
+        return [(self.__nid(s), self.__nid(t), float(score))
+                for s, t, score in zip(src[once], indices[once], scores[once])]
+
+    def _get_underlying_repr_graph(self):
+        """
+        Builds the equivalent networkx MultiGraph
+        """
+        G = nx.MultiGraph()
+        for idx, card in enumerate(self.__cardinality):
+            G.add_node(self.__nid(idx), cardinality=None if np.isnan(card) else card)
+        for relation in Relation:
+            G.add_edges_from((src, target, relation, {'score': score})
+                             for src, target, score in self.get_relation_edges(relation))
+        return G
+
+    def _visualize_graph(self):
+        nx.draw(self._get_underlying_repr_graph())
+        plt.show()
+
+    def add_field(self, nid, cardinality=None):
+        self.__check_writable_fields()
+        idx = self.__index_of(nid)
+        self.__cardinality[idx] = np.nan if cardinality is None else cardinality
+        return nid
+
+    def add_fields_bulk(self, nids, cardinalities):
+        for nid, card in zip(nids, cardinalities):
+            self.add_field(nid, card)
+
+    def add_fields(self, list_of_fields):
+        nodes = []
+        for nid, sn, fn in list_of_fields:
+            self.__index_of(nid)
+            nodes.append(Hit(nid, sn, fn, -1))
+        return nodes
+
+    def add_relation(self, node_src, node_target, relation, score):
+        self.add_relations_bulk([node_src], [node_target], relation, [score])
+
+    def add_relations_bulk(self, src, target, relation, scores):
+        if relation not in self.__pending:
+            self.__pending[relation] = (array('q'), array('q'), array('f'))
+        pending_src, pending_target, pending_scores = self.__pending[relation]
+        idx_src = [self.__index_of(nid) for nid in src]
+        idx_target = [self.__index_of(nid) for nid in target]
+        # undirected, as the MultiGraph
+        pending_src.extend(idx_src)
+        pending_target.extend(idx_target)
+        pending_src.extend(idx_target)
+        pending_target.extend(idx_src)
+        scores = [float(score) for score in scores]
+        pending_scores.extend(scores)
+        pending_scores.extend(scores)
+        self._invalidate_table_graph(relation)
+
+    def fields_degree(self, topk):
+        degree = np.zeros(len(self.__nids), dtype=np.int64)
+        for relation in Relation:
+            csr = self.__adjacency(relation)
+            if csr is None:
+                continue
+            indptr, indices, _ = csr
+            degree[:len(indptr) - 1] += np.diff(indptr)
+            # self loops count twice, as in networkx
+            src = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+            degree += np.bincount(src[src == indices], minlength=len(degree))
+        top = np.argsort(-degree, kind='mergesort')[:topk]
+        return [(self.__nid(idx), int(degree[idx])) for idx in top]
+
+    def neighbors_nids(self, nid, relation: Relation) -> [(str, float)]:
+        indices, scores = self.__row(relation, self.__nid_to_idx[nid])
+        return [(self.__nid(idx), float(score)) for idx, score in zip(indices, scores)]
 
 
 def serialize_network(network, path):
@@ -434,11 +942,118 @@ def serialize_network(network, path):
     nx.write_gpickle(table_to_ids, path + "table_ids.pickle")
 
 
-def deserialize_network(path):
+def serialize_network_mapped(network, path):
+    """
+    Serialize the meta schema index in the mapped model format: one npy file per array,
+    plus a versioned meta file, so that it can be opened with mmap
+    :param network:
+    :param path:
+    :return:
+    """
+    id_to_field_info = network._get_underlying_repr_id_to_field_info()
+    table_to_ids = network._get_underlying_repr_table_to_ids()
+
+    path = path + '/'  # force separator
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def save(name, a):
+        np.save(path + name + ".npy", a)
+
+    nids, cardinality = network.get_cardinality_vector()
+    nids = np.array(nids, dtype=str)
+    order = np.argsort(nids, kind='mergesort')
+    nids = nids[order]
+    save("nids", nids)
+    save("cardinality", cardinality[order])
+    for i, name in enumerate(["db_names", "source_names", "field_names", "data_types"]):
+        save(name, np.array([id_to_field_info[nid][i] for nid in nids], dtype=str))
+
+    table_names = np.array(sorted(table_to_ids.keys()), dtype=str)
+    table_fields = [np.searchsorted(nids, np.array(table_to_ids[t], dtype=str)) for t in table_names]
+    save("table_names", table_names)
+    save("table_indptr", np.cumsum([0] + [len(f) for f in table_fields]).astype(np.int64))
+    save("table_fields", np.concatenate(table_fields + [np.empty(0, dtype=np.int64)]).astype(np.int64))
+
+    index = SortedIndex(nids)
+    relations = []
+    for relation in Relation:
+        edges = [(index[src], index[target], score) for src, target, score in network.get_relation_edges(relation)
+                 if src in index and target in index]
+        if not edges:
+            continue
+        src, target, scores = (np.array(x) for x in zip(*edges))
+        # both directions, as the graph is undirected
+        indptr, indices, scores = build_csr(np.concatenate((src, target)), np.concatenate((target, src)),
+                                            np.concatenate((scores, scores)), len(nids))
+        save(relation.name + "_indptr", indptr)
+        save(relation.name + "_indices", indices)
+        save(relation.name + "_scores", scores)
+        relations.append(relation.name)
+
+    # written last, a model without it is incomplete
+    with open(path + MODEL_META_FILE, 'w') as f:
+        json.dump({"format": MODEL_FORMAT, "version": MODEL_VERSION, "relations": relations}, f)
+
+
+def deserialize_network_mapped(path):
+    """
+    Opens a model in the mapped model format; arrays are memory-mapped, not read
+    :param path:
+    :return: a CompactFieldNetwork
+    """
+    with open(path + MODEL_META_FILE) as f:
+        meta = json.load(f)
+    if meta.get("format") != MODEL_FORMAT or meta.get("version") != MODEL_VERSION:
+        raise ValueError("Unsupported model format {0} version {1} in {2}".format(
+            meta.get("format"), meta.get("version"), path))
+
+    def load(name):
+        return np.load(path + name + ".npy", mmap_mode='r')
+
+    info = [load(name) for name in ["db_names", "source_names", "field_names", "data_types"]]
+    tables = [load(name) for name in ["table_names", "table_indptr", "table_fields"]]
+    csr = {Relation[name]: (load(name + "_indptr"), load(name + "_indices"), load(name + "_scores"))
+           for name in meta["relations"]}
+    return CompactFieldNetwork.from_arrays(load("nids"), load("cardinality"), info, tables, csr)
+
+
+def mapped_model_is_current(path):
+    """
+    Whether path has a model in the mapped model format that is not older than the pickled
+    one, if any, see serialize_network
+    """
+    meta_file = path + MODEL_META_FILE
+    if not os.path.isfile(meta_file):
+        return False
+    graph_file = path + "graph.pickle"
+    return not os.path.isfile(graph_file) or os.path.getmtime(meta_file) >= os.path.getmtime(graph_file)
+
+
+def deserialize_network(path, compact=False, mapped=None):
+    """
+    Deserialize the meta schema index. Table graphs are built on first use, see get_table_graph
+    :param path:
+    :param compact: whether to return a CompactFieldNetwork
+    :param mapped: whether to read the model in the mapped model format with
+    deserialize_network_mapped, by default when it is there and not older than the pickles.
+    Unless compact, it is then copied into a FieldNetwork
+    :return:
+    """
+    if mapped is None:
+        mapped = mapped_model_is_current(path)
+    if mapped:
+        network = deserialize_network_mapped(path)
+        if not compact:
+            network = FieldNetwork(network._get_underlying_repr_graph(),
+                                   dict(network._get_underlying_repr_id_to_field_info()),
+                                   defaultdict(list, network._get_underlying_repr_table_to_ids()))
+        return network
     G = nx.read_gpickle(path + "graph.pickle")
     id_to_info = nx.read_gpickle(path + "id_info.pickle")
     table_to_ids = nx.read_gpickle(path + "table_ids.pickle")
     network = FieldNetwork(G, id_to_info, table_to_ids)
+    if compact:
+        network = CompactFieldNetwork.from_network(network)
     return network
 
 
@@ -1,5 +1,9 @@
+import hashlib
+import os
+import pickle
 import time
 
+import config as C
 from dataanalysis import dataanalysis as da
 
 from knowledgerepr.fieldnetwork import FieldNetwork
@@ -8,68 +12,150 @@ from nearpy import Engine
 from nearpy.hashes import RandomBinaryProjections
 from nearpy.hashes import RandomDiscretizedProjections
 from nearpy.distances import CosineDistance
+from nearpy.storage import ColumnarMemoryStorage
+from sklearn.decomposition import IncrementalPCA
 from sklearn.decomposition import TruncatedSVD
 
 from sklearn.cluster import DBSCAN
 import numpy as np
+from scipy.sparse import issparse
 
 from collections import defaultdict
 
 rbp = RandomBinaryProjections('default', 30)
 
 
-def create_sim_graph_text(nid_gen, network, text_engine, tfidf, relation, tfidf_is_dense=False):
+def create_sim_graph_text(network, text_engine, relation):
     st = time.time()
-    row_idx = 0
-    for nid in nid_gen:
-        if tfidf_is_dense:
-            dense_row = tfidf[row_idx]
-            array = dense_row
-        else:
-            sparse_row = tfidf.getrow(row_idx)
-            dense_row = sparse_row.todense()
-            array = dense_row.A[0]
-        row_idx += 1
-        N = text_engine.neighbours(array)
-        if len(N) > 1:
-            for n in N:
-                (data, key, value) = n
-                if nid != key:
-                    #print("tsim: {0} <-> {1}".format(nid, key))
-                    network.add_relation(nid, key, relation, value)
+    # one pass over the buckets of the engine, each similar pair comes once,
+    # the pairs of every node with its nearest neighbours as in text_engine.neighbours
+    src, trg, scores = [], [], []
+    for nid, key, value in text_engine.self_join():
+        #print("tsim: {0} <-> {1}".format(nid, key))
+        src.append(nid)
+        trg.append(key)
+        scores.append(value)
+    network.add_relations_bulk(src, trg, relation, scores)
     et = time.time()
     print("Create graph schema: {0}".format(str(et - st)))
 
 
-def index_in_text_engine(nid_gen, tfidf, lsh_projections, tfidf_is_dense=False):
+def index_in_text_engine(nid_gen, tfidf, lsh_projections):
     num_features = tfidf.shape[1]
     print("TF-IDF shape: " + str(tfidf.shape))
+    # sparse (CSR) rows are hashed and scored as they are, dense vectors are
+    # kept in one matrix and scored with a single product
+    storage = None if issparse(tfidf) else ColumnarMemoryStorage()
     text_engine = Engine(num_features,
                          lshashes=[lsh_projections],
-                         distance=CosineDistance())
+                         distance=CosineDistance(),
+                         storage=storage)
 
     st = time.time()
-    row_idx = 0
-    for key in nid_gen:
-        if tfidf_is_dense:
-            dense_row = tfidf[row_idx]
-            array = dense_row
-        else:
-            sparse_row = tfidf.getrow(row_idx)
-            dense_row = sparse_row.todense()
-            array = dense_row.A[0]
-        row_idx += 1
-        text_engine.store_vector(array, key)
+    # tfidf is indexed as a whole matrix (dense or sparse), one row per nid
+    keys = [key for key in nid_gen]
+    text_engine.store_vectors(tfidf, keys)
     et = time.time()
     print("Total index text: " + str((et - st)))
     return text_engine
 
 
-def lsa_dimensionality_reduction(tfidf):
-    svd = TruncatedSVD(n_components=1000, random_state=42)
-    svd.fit(tfidf)
-    new_tfidf_vectors = svd.transform(tfidf)
-    return new_tfidf_vectors
+def lsa_dimensionality_reduction(tfidf, lsa_config=None, vocabulary=None):
+    """
+    Reduces the rows of tfidf to their LSA components, as configured in
+    config.lsa (or lsa_config). Returns a float32 matrix. The model is only
+    persisted and reused when the vocabulary (term -> column of tfidf) is
+    given, and reused only if it was fitted on the same vocabulary.
+    """
+    if lsa_config is None:
+        lsa_config = C.lsa
+    # there cannot be more components than rows or features
+    n_components = max(1, min(lsa_config["n_components"], min(tfidf.shape) - 1))
+    batch_size = max(lsa_config["batch_size"], n_components)
+    model_file = lsa_config["model_file"]
+    if vocabulary is None:
+        model_file = None
+    vocabulary_key = None if model_file is None else vocabulary_hash(vocabulary)
+
+    model = load_lsa_model(model_file, vocabulary_key)
+    if model is not None:
+        vectors = transform_in_batches(model, tfidf, batch_size)
+    else:
+        if lsa_config["mode"] == "incremental":
+            model = IncrementalPCA(n_components=n_components)
+            for start, end in row_batches(tfidf.shape[0], batch_size):
+                model.partial_fit(dense_rows(tfidf, start, end))
+            vectors = transform_in_batches(model, tfidf, batch_size)
+        else:
+            model = TruncatedSVD(n_components=n_components, algorithm="randomized",
+                                 n_iter=lsa_config["n_iter"], random_state=42)
+            vectors = model.fit_transform(tfidf)
+        # a missing or stale model is replaced
+        if model_file is not None:
+            with open(model_file, "wb") as f:
+                pickle.dump({"vocabulary": vocabulary_key, "model": model}, f)
+
+    # adaptive number of components, by explained variance
+    target = lsa_config["explained_variance"]
+    if target is not None:
+        explained = np.cumsum(model.explained_variance_ratio_)
+        k = min(int(np.searchsorted(explained, target)) + 1, len(explained))
+        vectors = vectors[:, :k]
+    return np.ascontiguousarray(vectors, dtype=np.float32)
+
+
+def vocabulary_hash(vocabulary):
+    """
+    Digest of a vocabulary (term -> column), that identifies the terms and their order
+    """
+    terms = sorted(vocabulary, key=vocabulary.get)
+    return hashlib.sha1("\n".join(terms).encode("utf-8")).hexdigest()
+
+
+def load_lsa_model(model_file, vocabulary_key):
+    """
+    Returns the LSA model persisted in model_file, or None if there is none
+    or it was fitted on a different vocabulary
+    """
+    if model_file is None or not os.path.isfile(model_file):
+        return None
+    with open(model_file, "rb") as f:
+        persisted = pickle.load(f)
+    if not isinstance(persisted, dict) or persisted.get("vocabulary") != vocabulary_key:
+        print("Ignoring LSA model in {0}, fitted on a different vocabulary".format(model_file))
+        return None
+    return persisted["model"]
+
+
+def row_batches(num_rows, batch_size):
+    """
+    Yields (start, end) of consecutive row batches; the last batch absorbs
+    the remainder so no batch is smaller than batch_size (unless there are
+    fewer rows than that)
+    """
+    starts = list(range(0, num_rows, batch_size))
+    if len(starts) > 1 and num_rows - starts[-1] < batch_size:
+        starts.pop()
+    for i, start in enumerate(starts):
+        end = starts[i + 1] if i + 1 < len(starts) else num_rows
+        yield start, end
+
+
+def dense_rows(matrix, start, end):
+    rows = matrix[start:end]
+    if issparse(rows):
+        rows = rows.toarray()
+    return rows
+
+
+def transform_in_batches(model, tfidf, batch_size):
+    # only one batch is densified at a time (incremental PCA needs dense rows)
+    densify = isinstance(model, IncrementalPCA)
+    vectors = np.empty((tfidf.shape[0], model.components_.shape[0]), dtype=np.float32)
+    for start, end in row_batches(tfidf.shape[0], batch_size):
+        rows = dense_rows(tfidf, start, end) if densify else tfidf[start:end]
+        vectors[start:end] = model.transform(rows)
+    return vectors
 
 
 def build_schema_sim_relation(network):
@@ -84,8 +170,7 @@ def build_schema_sim_relation(network):
     print("Create docs and TF-IDF: {0}".format(str(et - st)))
     nid_gen = network.iterate_ids()
     text_engine = index_in_text_engine(nid_gen, tfidf, rbp)  # rbp the global variable
-    nid_gen = network.iterate_ids()
-    create_sim_graph_text(nid_gen, network, text_engine, tfidf, Relation.SCHEMA_SIM)
+    create_sim_graph_text(network, text_engine, Relation.SCHEMA_SIM)
 
 
 def build_schema_sim_relation_lsa(network, fields):
@@ -96,13 +181,12 @@ def build_schema_sim_relation_lsa(network, fields):
     tfidf = da.get_tfidf_docs(docs)
 
     print("tfidf shape before LSA: " + str(tfidf.shape))
-    tfidf = lsa_dimensionality_reduction(tfidf)
+    tfidf = lsa_dimensionality_reduction(tfidf, vocabulary=da.vect.vocabulary_)
     print("tfidf shape after LSA: " + str(tfidf.shape))
 
     text_engine = index_in_text_engine(
-        fields, tfidf, rbp, tfidf_is_dense=True)  # rbp the global variable
-    create_sim_graph_text(network, text_engine, fields,
-                          tfidf, Relation.SCHEMA_SIM, tfidf_is_dense=True)
+        fields, tfidf, rbp)  # rbp the global variable
+    create_sim_graph_text(network, text_engine, Relation.SCHEMA_SIM)
 
 
 def build_entity_sim_relation(network, fields, entities):
@@ -116,18 +200,16 @@ def build_entity_sim_relation(network, fields, entities):
         tfidf = da.get_tfidf_docs(docs)
         text_engine = index_in_text_engine(
             fields, tfidf, rbp)  # rbp the global variable
-        create_sim_graph_text(network, text_engine, fields,
-                              tfidf, Relation.ENTITY_SIM)
+        create_sim_graph_text(network, text_engine, Relation.ENTITY_SIM)
 
 
 def build_content_sim_relation_text_lsa(network, signatures):
 
-    def get_nid_gen(signatures):
-        for nid, sig in signatures:
-            yield nid
-
+    # one pass, so signatures can be streamed from the store
+    nids = []
     docs = []
     for nid, e in signatures:
+        nids.append(nid)
         docs.append(' '.join(e))
 
     # this may become redundant if we exploit the store characteristics
@@ -135,16 +217,14 @@ def build_content_sim_relation_text_lsa(network, signatures):
 
     print("TF-IDF shape before LSA: " + str(tfidf.shape))
     st = time.time()
-    tfidf = lsa_dimensionality_reduction(tfidf)
+    tfidf = lsa_dimensionality_reduction(tfidf, vocabulary=da.vect.vocabulary_)
     et = time.time()
     print("TF-IDF shape after LSA: " + str(tfidf.shape))
     print("Time to compute LSA: {0}".format(str(et - st)))
-    lsh_projections = RandomBinaryProjections('default', 10000)
+    lsh_projections = RandomBinaryProjections('default', 10000, packed_keys=True)
     #lsh_projections = RandomDiscretizedProjections('rnddiscretized', 1000, 2)
-    nid_gen = get_nid_gen(signatures)  # to preserve the order nid -> signature
-    text_engine = index_in_text_engine(nid_gen, tfidf, lsh_projections, tfidf_is_dense=True)
-    nid_gen = get_nid_gen(signatures)  # to preserve the order nid -> signature
-    create_sim_graph_text(nid_gen, network, text_engine, tfidf, Relation.CONTENT_SIM, tfidf_is_dense=True)
+    text_engine = index_in_text_engine(iter(nids), tfidf, lsh_projections)
+    create_sim_graph_text(network, text_engine, Relation.CONTENT_SIM)
 
 
 def build_content_sim_relation_text(network, fields, signatures):
@@ -163,86 +243,85 @@ def build_content_sim_relation_text(network, fields, signatures):
     lsh_projections = RandomDiscretizedProjections('rnddiscretized', 1000, 2)
     nid_gen = get_nid_gen(signatures)
     text_engine = index_in_text_engine(nid_gen, tfidf, lsh_projections)
-    nid_gen = get_nid_gen(signatures)
-    create_sim_graph_text(nid_gen, network, text_engine, tfidf, Relation.CONTENT_SIM)
+    create_sim_graph_text(network, text_engine, Relation.CONTENT_SIM)
 
 
-def build_content_sim_relation_num_overlap_distr(network, id_sig):
+def build_content_sim_relation_num_overlap_distr(network, num_signatures):
+    """
+    Connects the numerical fields whose [median - iqr, median + iqr] intervals overlap enough
+    :param num_signatures: (nids, median, iqr, min_value, max_value) with float arrays aligned
+    with the nids, see Store.get_all_fields_num_signature_columns
+    """
 
     def connect(nid1, nid2, score):
         network.add_relation(nid1, nid2, Relation.CONTENT_SIM, score)
 
     overlap = 0.7
 
-    fields = []
-    domains = []
-    stats = []
-    for c_k, (c_median, c_iqr, c_min_v, c_max_v) in id_sig:
-        fields.append(c_k)
-        domain = (c_median + c_iqr) - (c_median - c_iqr)
-        domains.append(domain)
-        extreme_left = c_median - c_iqr
-        extreme_right = c_median + c_iqr
-        #print(str(extreme_left) + " - " + str(domain) + " - " + str(extreme_right))
-        stats.append((extreme_left, extreme_right))
-
-    zipped_and_sorted = sorted(zip(domains, fields, stats), reverse=True)
-    candidate_entries = [(y, x, z[0], z[1]) for (x,y,z) in zipped_and_sorted]
-
-    single_points = []
-
-    for ref in candidate_entries:
-        ref_nid, ref_domain, ref_x_left, ref_x_right = ref
-
+    fields, c_median, c_iqr, _, _ = num_signatures
+    c_median = np.asarray(c_median, dtype=float)
+    c_iqr = np.asarray(c_iqr, dtype=float)
+    domains = (c_median + c_iqr) - (c_median - c_iqr)
+    extreme_left = c_median - c_iqr
+    extreme_right = c_median + c_iqr
+
+    # by decreasing (domain, nid, left, right)
+    order = np.lexsort((extreme_right, extreme_left, np.array(fields, dtype=str), domains))[::-1]
+
+    # Interval index: positions in the fields by decreasing domain
+    # sorted by left and by right extreme. For each reference only the
+    # intervals with an extreme inside the reference are visited.
+    nids = [fields[i] for i in order]
+    domain = domains[order]
+    left = extreme_left[order]
+    right = extreme_right[order]
+
+    single_points = [(nids[i], domain[i], left[i], right[i]) for i in np.flatnonzero(domain == 0)]
+
+    by_left = np.argsort(left, kind="mergesort")
+    by_right = np.argsort(right, kind="mergesort")
+    sorted_left = left[by_left]
+    sorted_right = right[by_right]
+
+    edges_src, edges_trg, edges_score = [], [], []
+    for ref in range(len(nids)):
+        ref_domain = domain[ref]
         if ref_domain == 0:
-            single_points.append(ref)
-
-        info1 = network.get_info_for([ref_nid])
-
-        (nid, db_name, source_name, field_name) = info1[0]
-        #print("")
-        #print("")
-        #print("Checking: " + source_name + " - " + field_name)
-        #print("")
-        #print("")
-
-        for entry in candidate_entries:
-            candidate_nid, candidate_domain, candidate_x_left, candidate_x_right = entry
-
-            if candidate_nid == ref_nid:
-                continue
-
-            if ref_domain == 0:
-                continue
-
-            if float(candidate_domain / ref_domain) <= overlap:
-                # early stop, not even the entire domain would overlap the necessary amount
-                # also non of the subsequent domains would, so just skip the loop
-                break
-
-            if candidate_x_left >= ref_x_left and candidate_x_right <= ref_x_right:
-                if float(candidate_domain / ref_domain) >= overlap:  # has to be as per the break condition above
-                    actual_overlap = float(candidate_domain / ref_domain)
-                    #info2 = network.get_info_for([candidate_nid])
-                    #(nid, db_name, source_name, field_name) = info2[0]
-                    #print(str(source_name) + " - " + str(field_name) + " ov: " + str(actual_overlap))
-                    connect(candidate_nid, ref_nid, actual_overlap)
-            elif candidate_x_left >= ref_x_left and candidate_x_left <= ref_x_right:  # make sure there's overlap
-                domain_overlap = ref_x_right - candidate_x_left
-                if float(domain_overlap / ref_domain) >= overlap:
-                    actual_overlap = float(domain_overlap / ref_domain)
-                    #info2 = network.get_info_for([candidate_nid])
-                    #(nid, db_name, source_name, field_name) = info2[0]
-                    #print(str(source_name) + " - " + str(field_name) + " ov: " + str(actual_overlap))
-                    connect(candidate_nid, ref_nid, actual_overlap)
-            elif candidate_x_right <= ref_x_right and candidate_x_right >= ref_x_left:  # make sure there's overlap
-                domain_overlap = candidate_x_right - ref_x_left
-                if float(domain_overlap / ref_domain) >= overlap:
-                    actual_overlap = float(domain_overlap / ref_domain)
-                    #info2 = network.get_info_for([candidate_nid])
-                    #(nid, db_name, source_name, field_name) = info2[0]
-                    #print(str(source_name) + " - " + str(field_name) + " ov: " + str(actual_overlap))
-                    connect(candidate_nid, ref_nid, actual_overlap)
+            continue
+        ref_x_left = left[ref]
+        ref_x_right = right[ref]
+
+        # candidates starting inside the reference...
+        lo = np.searchsorted(sorted_left, ref_x_left, side="left")
+        hi = np.searchsorted(sorted_left, ref_x_right, side="right")
+        starting_inside = by_left[lo:hi]
+        # ...and candidates starting before it but ending inside it
+        lo = np.searchsorted(sorted_right, ref_x_left, side="left")
+        hi = np.searchsorted(sorted_right, ref_x_right, side="right")
+        ending_inside = by_right[lo:hi]
+        ending_inside = ending_inside[left[ending_inside] < ref_x_left]
+        candidates = np.concatenate((starting_inside, ending_inside))
+        # in order of decreasing domain, as the references
+        candidates = np.sort(candidates)
+        candidates = candidates[candidates != ref]
+        # not even the entire domain would overlap the necessary amount
+        candidates = candidates[domain[candidates] / ref_domain > overlap]
+
+        c_left = left[candidates]
+        c_right = right[candidates]
+        contained = (c_left >= ref_x_left) & (c_right <= ref_x_right)
+        starts_inside = ~contained & (c_left >= ref_x_left)
+        ends_inside = ~contained & ~starts_inside
+        actual_overlap = np.empty(len(candidates))
+        actual_overlap[contained] = domain[candidates[contained]] / ref_domain
+        actual_overlap[starts_inside] = (ref_x_right - c_left[starts_inside]) / ref_domain
+        actual_overlap[ends_inside] = (c_right[ends_inside] - ref_x_left) / ref_domain
+        keep = actual_overlap >= overlap
+        edges_src.extend(nids[candidate] for candidate in candidates[keep])
+        edges_trg.extend([nids[ref]] * int(np.count_nonzero(keep)))
+        edges_score.extend(actual_overlap[keep])
+
+    network.add_relations_bulk(edges_src, edges_trg, Relation.CONTENT_SIM, edges_score)
 
     # Final clustering for single points
 
@@ -371,34 +450,32 @@ def build_content_sim_relation_num(network, id_sig):
     for i in range(len(labels)):
         clusters[labels[i]].append(i)
     # create relations
+    src, trg = [], []
     for k, v in clusters.items():
         if k == -1:
             continue
         for el1 in v:
             for el2 in v:
                 if el1 != el2:
-                    nid1 = fields[el1]
-                    nid2 = fields[el2]
-                    network.add_relation(nid1, nid2, Relation.CONTENT_SIM, 1)
+                    src.append(fields[el1])
+                    trg.append(fields[el2])
+    network.add_relations_bulk(src, trg, Relation.CONTENT_SIM, [1] * len(src))
 
 
 def build_pkfk_relation(network):
-    total_pkfk_relations = 0
-    for n in network.iterate_ids():
-        n_card = network.get_cardinality_of(n)
-        if n_card > 0.7:  # Early check if this is a candidate
-            neighborhood = network.neighbors_id(n, Relation.CONTENT_SIM)
-            for ne in neighborhood:
-                if ne is not n:
-                    ne_card = network.get_cardinality_of(ne.nid)
-                    if n_card > ne_card:
-                        highest_card = n_card
-                    else:
-                        highest_card = ne_card
-                    network.add_relation(n, ne.nid, Relation.PKFK, highest_card)
-                    total_pkfk_relations += 1
-                    #print(str(n) + " -> " + str(ne))
-    print("Total number PKFK: {0}".format(str(total_pkfk_relations)))
+    nids, cardinality = network.get_cardinality_vector()
+    position = {nid: i for i, nid in enumerate(nids)}
+    content_sim = network.get_relation_edges(Relation.CONTENT_SIM)
+    src = [src for src, _, _ in content_sim]
+    trg = [trg for _, trg, _ in content_sim]
+    src_card = cardinality[[position[nid] for nid in src]]
+    trg_card = cardinality[[position[nid] for nid in trg]]
+    # a content-sim edge is a PKFK candidate if either side has high cardinality
+    highest_card = np.maximum(src_card, trg_card)
+    candidates = np.nonzero(highest_card > 0.7)[0]
+    network.add_relations_bulk([src[i] for i in candidates], [trg[i] for i in candidates], Relation.PKFK,
+                               highest_card[candidates])
+    print("Total number PKFK: {0}".format(str(len(candidates))))
 
 
 if __name__ == "__main__":
@@ -41,9 +41,8 @@ def generate_network_with(num_nodes=10, num_nodes_per_table=2, num_schema_sim=5,
 
 
     # Skeleton, columns and tables
-    fn = FieldNetwork()
     node_g = node_generator()
-    fn.init_meta_schema(node_g)
+    fn = FieldNetwork.from_fields(node_g)
 
     # num schema sim
     gen_schema_sim = gen_pairs_relation(0, num_schema_sim)
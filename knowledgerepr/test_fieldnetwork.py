@@ -0,0 +1,319 @@
+import os
+import tempfile
+import unittest
+from api.apiutils import Relation
+from ddapi import DDAPI
+from knowledgerepr import fieldnetwork
+from knowledgerepr.fieldnetwork import FieldNetwork
+from knowledgerepr.fieldnetwork import CompactFieldNetwork
+
+
+def fields(num_fields):
+    for i in range(num_fields):
+        nid = str(100 + i)
+        yield (nid, "db", "table_" + str(i % 4), "field_" + str(i), 10, i % 11, "N")
+
+
+def relations():
+    return [("100", "101", Relation.CONTENT_SIM, 0.5),
+            ("101", "102", Relation.CONTENT_SIM, 0.25),
+            ("102", "100", Relation.CONTENT_SIM, 0.75),
+            ("101", "100", Relation.CONTENT_SIM, 0.125),  # update of 100 - 101
+            ("103", "103", Relation.CONTENT_SIM, 1.0),
+            ("100", "104", Relation.SCHEMA_SIM, 0.5),
+            ("100", "101", Relation.PKFK, 0.9)]
+
+
+def neighbors(network, nid, relation):
+    # scores are float32 in the compact network
+    return sorted((h.nid, h.source_name, h.field_name, round(h.score, 5)) for h in network.neighbors_id(nid, relation))
+
+
+class TestFieldNetwork(unittest.TestCase):
+
+    def test_instances_do_not_share_state(self):
+        print(self._testMethodName)
+
+        network1 = FieldNetwork.from_fields(fields(8))
+        network2 = FieldNetwork()
+        self.assertEqual(network1.graph_order(), 8)
+        self.assertEqual(network2.graph_order(), 0)
+        self.assertEqual(network2.get_number_tables(), 0)
+        self.assertEqual(len(network2._get_underlying_repr_graph()), 0)
+
+    def test_add_relations_bulk(self):
+        print(self._testMethodName)
+
+        network1 = FieldNetwork.from_fields(fields(8))
+        network2 = FieldNetwork.from_fields(fields(8))
+        for src, target, relation, score in relations():
+            network1.add_relation(src, target, relation, score)
+        for relation in Relation:
+            edges = [(s, t, score) for s, t, r, score in relations() if r == relation]
+            if edges:
+                src, target, scores = zip(*edges)
+                network2.add_relations_bulk(src, target, relation, scores)
+        for nid in network1.iterate_ids():
+            self.assertEqual(network1.get_cardinality_of(nid), network2.get_cardinality_of(nid))
+            for relation in Relation:
+                self.assertEqual(neighbors(network1, nid, relation), neighbors(network2, nid, relation))
+
+    def test_find_path_table(self):
+        print(self._testMethodName)
+
+        # table_0 - table_1 - table_2 - table_3, hopping to another field within table_1 and table_2
+        network = FieldNetwork.from_fields(fields(8))
+        network.add_relations_bulk(["100", "105", "106"], ["101", "106", "103"], Relation.CONTENT_SIM, [0.5, 0.5, 0.5])
+        network.add_relation("101", "102", Relation.CONTENT_SIM, 0.25)  # weaker witness of table_1 - table_2
+        network.add_relation("102", "106", Relation.CONTENT_SIM, 1.0)  # within table_2, not a hop
+        api = DDAPI(network)
+
+        self.assertEqual(sorted(network.get_table_graph(Relation.CONTENT_SIM)["table_1"]), ["table_0", "table_2"])
+        self.assertEqual(sorted(network.get_table_graph(Relation.CONTENT_SIM)["table_1"]["table_2"]),
+                         [("101", "102", 0.25), ("105", "106", 0.5)])
+
+        path = network.find_path_table("table_0", "table_3", Relation.CONTENT_SIM, api)
+        self.assertEqual(sorted(h.nid for h in path), ["100", "101", "103", "104", "105", "106", "107"])
+        self.assertEqual(network.find_path_table("table_0", "table_3", Relation.PKFK, api).size(), 0)
+
+        # the table graph follows new relations
+        network.add_relation("104", "107", Relation.PKFK, 0.5)
+        path = network.find_path_table("table_0", "table_3", Relation.PKFK, api)
+        self.assertEqual(sorted(h.nid for h in path), ["100", "103", "104", "107"])
+
+    def test_find_path_hit_and_traverse(self):
+        print(self._testMethodName)
+
+        # chain 100 - 101 - 102 - 106, plus branches off it
+        network = FieldNetwork.from_fields(fields(8))
+        network.add_relations_bulk(["100", "101", "102", "100", "101"], ["101", "102", "106", "104", "105"],
+                                   Relation.CONTENT_SIM, [0.5, 0.25, 0.75, 1.0, 1.0])
+        for n in [network, CompactFieldNetwork.from_network(network)]:
+            source = n.get_hit("100")
+            path = n.find_path_hit(source, n.get_hit("106"), Relation.CONTENT_SIM)
+            self.assertEqual(sorted(h.nid for h in path), ["100", "101", "102", "106"])
+            self.assertEqual([[h.nid for h in p] for p in path.paths()], [["100", "101", "102", "106"]])
+            self.assertEqual(n.find_path_hit(source, n.get_hit("107"), Relation.CONTENT_SIM).size(), 0)
+
+            reached = n.traverse([source], Relation.CONTENT_SIM, 2)
+            self.assertEqual(sorted(h.nid for h in reached), ["101", "102", "104", "105"])
+            self.assertEqual(sorted((h.nid, h.score) for h in reached if h.nid in ["101", "102"]),
+                             [("101", 0.5), ("102", 0.25)])
+
+        network.add_relation("102", "103", Relation.PKFK, 0.5)
+        reached = network.traverse([source], [Relation.CONTENT_SIM, Relation.PKFK], 3)
+        self.assertEqual(sorted(h.nid for h in reached), ["101", "102", "103", "104", "105", "106"])
+        reached = network.traverse([source], [Relation.CONTENT_SIM, Relation.PKFK], 3, max_results_per_hop=1)
+        self.assertEqual(sorted(h.nid for h in reached), ["104"])  # 104 is a dead end
+        reached = network.traverse([source], [Relation.CONTENT_SIM, Relation.PKFK], 3, max_results_per_hop=[1, 2])
+        self.assertEqual(sorted(h.nid for h in reached), ["104"])
+        reached = network.traverse([source], Relation.CONTENT_SIM, 2, max_results_per_hop=[None, 1])
+        self.assertEqual(sorted(h.nid for h in reached), ["101", "104", "105"])
+
+    def test_find_paths_hits(self):
+        print(self._testMethodName)
+
+        # 100 - 101 - 102 - 106 and 104 - 105 - 107
+        network = FieldNetwork.from_fields(fields(8))
+        network.add_relations_bulk(["100", "101", "102", "104", "105"], ["101", "102", "106", "105", "107"],
+                                   Relation.CONTENT_SIM, [0.5, 0.25, 0.75, 1.0, 1.0])
+        sources = [network.get_hit("100"), network.get_hit("104")]
+        targets = [network.get_hit("106"), network.get_hit("107")]
+
+        paths = network.find_paths_hits(sources, targets, Relation.CONTENT_SIM)
+        self.assertEqual(sorted(h.nid for h in paths), ["100", "101", "102", "104", "105", "106", "107"])
+        self.assertEqual(sorted([h.nid for h in p] for p in paths.paths()),
+                         [["100", "101", "102", "106"], ["104", "105", "107"]])
+
+        paths = network.find_paths_hits(sources, targets, Relation.CONTENT_SIM, max_hops=2)
+        self.assertEqual(sorted(h.nid for h in paths), ["104", "105", "107"])
+        paths = network.find_paths_hits(sources, targets, Relation.CONTENT_SIM, limit=1)
+        self.assertEqual(len(paths.paths()), 1)
+
+        # all pairs within one set
+        paths = network.find_paths_hits(sources + targets, None, Relation.CONTENT_SIM)
+        self.assertEqual(sorted(h.nid for h in paths), ["100", "101", "102", "104", "105", "106", "107"])
+        self.assertEqual(len(paths.paths()), 2)
+        paths = network.find_paths_hits(sources + targets, None, Relation.CONTENT_SIM, max_hops=2)
+        self.assertEqual(sorted(h.nid for h in paths), ["104", "105", "107"])
+
+    def test_find_paths_hits_shared_nodes(self):
+        print(self._testMethodName)
+
+        # sources 100, 101 and 102 share the hub 103
+        network = FieldNetwork.from_fields(fields(8))
+        network.add_relations_bulk(["100", "101", "102"], ["103", "103", "103"],
+                                   Relation.CONTENT_SIM, [0.5, 0.5, 0.5])
+        def neighbors(nid):
+            return network.neighbors_nids(nid, Relation.CONTENT_SIM)
+
+        pred, meetings = network._multi_source_pred(["100", "101", "102"], neighbors)
+        self.assertEqual(sorted(sorted(pair) for pair in meetings),
+                         [["100", "101"], ["100", "102"], ["101", "102"]])
+        for pair, meeting in meetings.items():
+            path = fieldnetwork.path_edges(pred, pred, pair, meeting)
+            self.assertEqual([(v, w) for v, w, _ in path], [(pair[0], "103"), ("103", pair[1])])
+        sources = [network.get_hit(nid) for nid in ["100", "101", "102"]]
+        paths = network.find_paths_hits(sources, None, Relation.CONTENT_SIM)
+        self.assertEqual(sorted(h.nid for h in paths), ["100", "101", "102", "103"])
+        pred, meetings = network._multi_source_pred(["100", "101", "102"], neighbors, limit=2)
+        self.assertEqual(len(meetings), 2)
+
+        # sources 100 and 101 converge on 102, then 102 - 103 - 104
+        network = FieldNetwork.from_fields(fields(8))
+        network.add_relations_bulk(["100", "101", "102", "103"], ["102", "102", "103", "104"],
+                                   Relation.CONTENT_SIM, [0.5, 0.5, 0.5, 0.5])
+        sources = [network.get_hit("100"), network.get_hit("101")]
+        targets = [network.get_hit(nid) for nid in ["104", "105", "106"]]
+        paths = network.find_paths_hits(sources, targets, Relation.CONTENT_SIM)
+        expected = set()
+        for source in sources:
+            for target in targets:
+                expected.update(h.nid for h in network.find_path_hit(source, target, Relation.CONTENT_SIM))
+        self.assertEqual(sorted(h.nid for h in paths), ["100", "101", "102", "103", "104"])
+        self.assertEqual(set(h.nid for h in paths), expected)
+        self.assertEqual(sorted([h.nid for h in p] for p in paths.paths()),
+                         [["100", "102", "103", "104"], ["101", "102", "103", "104"]])
+
+    def test_find_paths_hits_stops_early(self):
+        print(self._testMethodName)
+
+        # a chain 100 - 101 - ... - 299, the searches stop once every pair has its shortest path
+        network = FieldNetwork.from_fields(fields(200))
+        chain = [str(100 + i) for i in range(200)]
+        network.add_relations_bulk(chain[:-1], chain[1:], Relation.CONTENT_SIM, [0.5] * 199)
+        expanded = []
+
+        def neighbors(nid):
+            expanded.append(nid)
+            return network.neighbors_nids(nid, Relation.CONTENT_SIM)
+
+        pred, succ, meetings = network._multi_bidirectional_pred_succ(["100"], ["101"], neighbors)
+        self.assertEqual(list(meetings), [("100", "101")])
+        self.assertEqual(len(expanded), 1)
+
+        del expanded[:]
+        pred, succ, meetings = network._multi_bidirectional_pred_succ(["150", "160"], ["155"], neighbors)
+        self.assertEqual(sorted(meetings), [("150", "155"), ("160", "155")])
+        self.assertLessEqual(len(expanded), 20)
+
+        del expanded[:]
+        pred, meetings = network._multi_source_pred(["150", "151", "153"], neighbors)
+        self.assertEqual(len(meetings), 3)
+        self.assertLessEqual(len(expanded), 20)
+        for pair, meeting in meetings.items():
+            path = fieldnetwork.path_edges(pred, pred, pair, meeting)
+            self.assertEqual(len(path), abs(int(pair[0]) - int(pair[1])))
+
+
+class TestCompactFieldNetwork(unittest.TestCase):
+
+    def setUp(self):
+        self.network = FieldNetwork.from_fields(fields(8))
+        self.compact = CompactFieldNetwork()
+        self.compact.init_meta_schema(fields(8))
+        for src, target, relation, score in relations():
+            self.network.add_relation(src, target, relation, score)
+            self.compact.add_relation(src, target, relation, score)
+
+    def test_neighbors(self):
+        print(self._testMethodName)
+
+        for nid in self.network.iterate_ids():
+            for relation in Relation:
+                self.assertEqual(neighbors(self.network, nid, relation),
+                                 neighbors(self.compact, nid, relation))
+
+    def test_neighbors_after_more_relations(self):
+        print(self._testMethodName)
+
+        self.compact.neighbors_id("100", Relation.CONTENT_SIM)  # compacts
+        self.network.add_relation("100", "105", Relation.CONTENT_SIM, 0.5)
+        self.compact.add_relation("100", "105", Relation.CONTENT_SIM, 0.5)
+        self.assertEqual(neighbors(self.network, "100", Relation.CONTENT_SIM),
+                         neighbors(self.compact, "100", Relation.CONTENT_SIM))
+
+    def test_fields_degree_and_cardinality(self):
+        print(self._testMethodName)
+
+        self.assertEqual(sorted(self.network.fields_degree(8)), sorted(self.compact.fields_degree(8)))
+        for nid in self.network.iterate_ids():
+            self.assertEqual(self.network.get_cardinality_of(nid), self.compact.get_cardinality_of(nid))
+
+    def test_from_network(self):
+        print(self._testMethodName)
+
+        compact = CompactFieldNetwork.from_network(self.network)
+        self.assertEqual(list(self.network.iterate_ids()), list(compact.iterate_ids()))
+        for relation in Relation:
+            self.assertEqual(sorted(map(frozenset, ((s, t) for s, t, _ in self.network.get_relation_edges(relation)))),
+                             sorted(map(frozenset, ((s, t) for s, t, _ in compact.get_relation_edges(relation)))))
+            for nid in self.network.iterate_ids():
+                self.assertEqual(neighbors(self.network, nid, relation), neighbors(compact, nid, relation))
+
+
+class TestMappedModelFormat(unittest.TestCase):
+
+    def setUp(self):
+        self.network = FieldNetwork.from_fields(fields(8))
+        for src, target, relation, score in relations():
+            self.network.add_relation(src, target, relation, score)
+
+    def test_roundtrip(self):
+        print(self._testMethodName)
+
+        with tempfile.TemporaryDirectory() as path:
+            path = path + "/"
+            fieldnetwork.serialize_network_mapped(self.network, path)
+            self.assertTrue(os.path.isfile(path + fieldnetwork.MODEL_META_FILE))
+            mapped = fieldnetwork.deserialize_network(path, compact=True)
+            self.assertTrue(isinstance(mapped, CompactFieldNetwork))
+
+            self.assertEqual(sorted(self.network.iterate_ids()), list(mapped.iterate_ids()))
+            self.assertEqual(self.network.graph_order(), mapped.graph_order())
+            self.assertEqual(self.network.get_number_tables(), mapped.get_number_tables())
+            self.assertEqual(self.network.get_info_for(["100", "105"]), mapped.get_info_for(["100", "105"]))
+            self.assertEqual(self.network.get_hits_from_table("table_1"), mapped.get_hits_from_table("table_1"))
+            self.assertEqual(mapped.get_fields_of_source("missing"), [])
+            for nid in self.network.iterate_ids():
+                self.assertEqual(self.network.get_cardinality_of(nid), mapped.get_cardinality_of(nid))
+                for relation in Relation:
+                    self.assertEqual(neighbors(self.network, nid, relation),
+                                     neighbors(mapped, nid, relation))
+
+            # relations can still be added among the fields
+            mapped.add_relation("104", "105", Relation.CONTENT_SIM, 0.5)
+            self.assertEqual([h.nid for h in mapped.neighbors_id("105", Relation.CONTENT_SIM)], ["104"])
+            # but not new fields
+            with self.assertRaises(ValueError):
+                mapped.add_relation("104", "200", Relation.CONTENT_SIM, 0.5)
+            with self.assertRaises(ValueError):
+                mapped.add_field("200")
+
+    def test_format_choice(self):
+        print(self._testMethodName)
+
+        with tempfile.TemporaryDirectory() as path:
+            path = path + "/"
+            fieldnetwork.serialize_network(self.network, path)
+            fieldnetwork.serialize_network_mapped(self.network, path)
+            # not compact, the mapped model is copied into a FieldNetwork
+            network = fieldnetwork.deserialize_network(path)
+            self.assertEqual(type(network), FieldNetwork)
+            self.assertEqual(neighbors(network, "100", Relation.PKFK), neighbors(self.network, "100", Relation.PKFK))
+            self.assertTrue(isinstance(fieldnetwork.deserialize_network(path, compact=True), CompactFieldNetwork))
+
+            # newer pickles win over a stale mapped model
+            self.network.add_relation("104", "105", Relation.CONTENT_SIM, 0.5)
+            fieldnetwork.serialize_network(self.network, path)
+            meta_time = os.path.getmtime(path + fieldnetwork.MODEL_META_FILE)
+            os.utime(path + "graph.pickle", (meta_time + 10, meta_time + 10))
+            self.assertFalse(fieldnetwork.mapped_model_is_current(path))
+            network = fieldnetwork.deserialize_network(path, compact=True)
+            self.assertEqual([h.nid for h in network.neighbors_id("105", Relation.CONTENT_SIM)], ["104"])
+            stale = fieldnetwork.deserialize_network(path, compact=True, mapped=True)
+            self.assertEqual([h.nid for h in stale.neighbors_id("105", Relation.CONTENT_SIM)], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,21 +1,22 @@
-import re
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from itertools import groupby
+import numpy as np
 from elasticsearch import Elasticsearch
 
-from enum import Enum
 from collections import defaultdict
+from collections import deque
+from operator import itemgetter
 
 from api.apiutils import Hit
+from modelstore.store import KWType
+from modelstore.store import Store
+from modelstore.store import filter_term_vector_by_frequency
 import config as c
 
 
-class KWType(Enum):
-    KW_TEXT = 0
-    KW_SCHEMA = 1
-    KW_ENTITIES = 2
-    KW_TABLE = 3
-
-
-class StoreHandler:
+class StoreHandler(Store):
 
     # Store client
     client = None
@@ -25,101 +26,123 @@ class StoreHandler:
             Uses the configuration file to create a connection to the store
             :return:
             """
+        super().__init__()
         global client
         client = Elasticsearch([{'host': c.db_host, 'port': c.db_port}])
 
     def close(self):
         print("TODO")
 
+    def scan_profile(self, columns, query=None):
+        """
+        Reads the given attributes of the documents in the profile index with a sliced scroll,
+        the slices are read concurrently and decoded into one column per attribute
+        :param columns: dict of attribute -> numpy dtype of its column, None keeps the values in a list
+        :param query: the query that selects the documents, all of them by default
+        :return: (ids, dict of attribute -> column), the columns aligned with ids
+        """
+        slices = c.profile_scan["slices"]
+        filter_path = ['_scroll_id', 'hits.hits._id'] + ['hits.hits._source.' + attr for attr in columns]
+        body = {"query": query if query is not None else {"match_all": {}},
+                "_source": list(columns), "sort": ["_doc"]}
+
+        def read_slice(slice_id):
+            slice_body = dict(body)
+            if slices > 1:
+                slice_body["slice"] = {"id": slice_id, "max": slices}
+            ids = []
+            values = {attr: [] for attr in columns}
+            res = client.search(index='profile', body=slice_body, scroll="10m",
+                                size=c.profile_scan["page_size"], filter_path=filter_path)
+            scroll_id = res['_scroll_id']
+            hits = res.get('hits', {}).get('hits', [])
+            while hits:
+                for h in hits:
+                    ids.append(h['_id'])
+                    source = h['_source']
+                    for attr, column in values.items():
+                        column.append(source[attr])
+                res = client.scroll(scroll="5m", scroll_id=scroll_id, filter_path=filter_path)
+                scroll_id = res['_scroll_id']  # update the scroll_id
+                hits = res.get('hits', {}).get('hits', [])
+            client.clear_scroll(scroll_id=scroll_id)
+            return ids, values
+
+        with ThreadPoolExecutor(max_workers=slices) as executor:
+            parts = list(executor.map(read_slice, range(slices)))
+        ids = list(chain.from_iterable(part_ids for part_ids, _ in parts))
+        result = dict()
+        for attr, dtype in columns.items():
+            values = list(chain.from_iterable(part[attr] for _, part in parts))
+            result[attr] = values if dtype is None else np.array(values, dtype=dtype)
+        return ids, result
+
     def get_all_fields(self):
         """
-        Reads all fields, described as (id, source_name, field_name) from the store.
-        :return: a list of all fields with the form (id, source_name, field_name)
+        Reads all fields, described as (id, db_name, source_name, field_name, total_values,
+        unique_values, data_type) from the store, see scan_profile
+        :return: a generator of all fields with that form
         """
-        body = {"query": {"match_all": {}}}
-        res = client.search(index='profile', body=body, scroll="10m",
-                            filter_path=['_scroll_id',
-                                         'hits.hits._id',
-                                         'hits.total',
-                                         'hits.hits._source.dbName',
-                                         'hits.hits._source.sourceName',
-                                         'hits.hits._source.columnName',
-                                         'hits.hits._source.totalValues',
-                                         'hits.hits._source.uniqueValues',
-                                         'hits.hits._source.dataType']
-                            )
-        scroll_id = res['_scroll_id']
-        remaining = res['hits']['total']
-        while remaining > 0:
-            hits = res['hits']['hits']
-            for h in hits:
-                id_source_and_file_name = (h['_id'], h['_source']['dbName'], h['_source']['sourceName'],
-                                           h['_source']['columnName'], h['_source']['totalValues'],
-                                           h['_source']['uniqueValues'], h['_source']['dataType'])
-                yield id_source_and_file_name
-                remaining -= 1
-            res = client.scroll(scroll="5m", scroll_id=scroll_id,
-                                filter_path=['_scroll_id',
-                                             'hits.hits._id',
-                                             'hits.hits._source.dbName',
-                                             'hits.hits._source.sourceName',
-                                             'hits.hits._source.columnName',
-                                             'hits.hits._source.totalValues',
-                                             'hits.hits._source.uniqueValues',
-                                             'hits.hits._source.dataType']
-                                )
-            scroll_id = res['_scroll_id']  # update the scroll_id
-        client.clear_scroll(scroll_id=scroll_id)
+        ids, columns = self.scan_profile({'dbName': None, 'sourceName': None, 'columnName': None,
+                                          'totalValues': np.int64, 'uniqueValues': np.int64,
+                                          'dataType': None})
+        yield from zip(ids, columns['dbName'], columns['sourceName'], columns['columnName'],
+                       columns['totalValues'].tolist(), columns['uniqueValues'].tolist(),
+                       columns['dataType'])
 
     def get_all_fields_with(self, attrs):
-        # FIXME: this function was not updated after 2 refactoring processes.
         """
-        Reads all fields, described as (id, source_name, field_name) from the store.
-        :return: a list of all fields with the form (id, source_name, field_name)
+        Reads all fields, described as (id, source_name, field_name, attr...) from the store.
+        :return: a generator of all fields with the form (id, source_name, field_name, attr...)
         """
-        template = 'hits.hits._source.'
-        filter_path = ['_scroll_id',
-                       'hits.hits._id',
-                       'hits.total',
-                       'hits.hits._source.dbName',
-                       'hits.hits._source.sourceName',
-                       'hits.hits._source.columnName']
+        columns = {'sourceName': None, 'columnName': None}
         for attr in attrs:
-            new_filter_path = template + attr
-            filter_path.append(new_filter_path)
+            columns[attr] = None
+        ids, columns = self.scan_profile(columns)
+        yield from zip(ids, columns['sourceName'], columns['columnName'], *[columns[attr] for attr in attrs])
 
-        body = {"query": {"match_all": {}}}
-        res = client.search(index='profile', body=body, scroll="10m",
-                            filter_path=filter_path
-                            )
-        scroll_id = res['_scroll_id']
-        remaining = res['hits']['total']
-        while remaining > 0:
-            hits = res['hits']['hits']
-            for h in hits:
-                toret = []
-                toret.append(h['_id'])
-                toret.append(h['_source']['sourceName'])
-                toret.append(h['_source']['columnName'])
-                for attr in attrs:
-                    toret.append(h['_source'][attr])
-                tuple_result = tuple(toret)
-                yield tuple_result
-                remaining -= 1
-            res = client.scroll(scroll="5m", scroll_id=scroll_id,
-                                filter_path=filter_path
-                                )
-            scroll_id = res['_scroll_id']  # update the scroll_id
-        client.clear_scroll(scroll_id=scroll_id)
+    def get_all_fields_of_source(self, source_name):
+        """
+        Reads the fields of a source (table), see scan_profile
+        :param source_name: the name of the source
+        :return: a list of (id, source_name, field_name)
+        """
+        ids, columns = self.scan_profile({'sourceName': None, 'columnName': None},
+                                         {"match_phrase": {"sourceName": source_name}})
+        # the match is on the analyzed name, only the exact source is kept
+        return [(nid, sn, fn) for nid, sn, fn in zip(ids, columns['sourceName'], columns['columnName'])
+                if sn == source_name]
 
-    def peek_values(self, field, num_values):
+    def read_samples(self, fields):
         """
-        Reads sample values for the given field
-        :param field: The field from which to read values
-        :param num_values: The number of values to read
-        :return: A list with the sample values read for field
+        Reads the samples of the given fields from the documents the profiler indexed in 'text',
+        config.samples["size"] at most per field, all in a single multi-search request
+        :param fields: list of (source_name, field_name)
+        :return: dict of field -> list of values, for the fields with documents in 'text'
         """
-        print("TODO")
+        fields = list(fields)
+        body = []
+        for source_name, field_name in fields:
+            body.append({"index": "text"})
+            body.append({"size": c.samples["size"],
+                         "query": {"bool": {"filter": [{"match_phrase": {"sourceName": source_name}},
+                                                       {"match_phrase": {"columnName": field_name}}]}}})
+        res = client.msearch(body=body,
+                             filter_path=['responses.error', 'responses.hits.total',
+                                          'responses.hits.hits._source.text',
+                                          'responses.hits.hits._source.sourceName',
+                                          'responses.hits.hits._source.columnName'])
+        samples = dict()
+        for field, response in zip(fields, res['responses']):
+            if 'error' in response:
+                raise RuntimeError("Sample lookup for {0} failed: {1}".format(field, response['error']))
+            if response['hits']['total'] > 0:
+                # the match is on the analyzed names, only the documents of the exact field are kept
+                values = [h['_source']['text'] for h in response['hits']['hits']
+                          if (h['_source']['sourceName'], h['_source']['columnName']) == field]
+                if values:
+                    samples[field] = values
+        return samples
 
     def search_keywords(self, keywords, elasticfieldname, max_hits=15):
         """
@@ -128,38 +151,41 @@ class StoreHandler:
         :param elasticfieldname: what is the field in the store where to apply the query
         :return: the list of documents that contain the keywords
         """
-        index = None
-        query_body = None
-        filter_path = ['hits.hits._source.id',
-                       'hits.hits._score',
-                       'hits.total',
-                       'hits.hits._source.dbName',
-                       'hits.hits._source.sourceName',
-                       'hits.hits._source.columnName']
-        if elasticfieldname == KWType.KW_TEXT:
-            index = "text"
-            query_body = {"from": 0, "size": max_hits,
-                          "query": {"match": {"text": keywords}}}
-        elif elasticfieldname == KWType.KW_SCHEMA:
-            index = "profile"
-            query_body = {"from": 0, "size": max_hits,
-                          "query": {"match": {"columnName": keywords}}}
-        elif elasticfieldname == KWType.KW_ENTITIES:
-            index = "profile"
-            query_body = {"from": 0, "size": max_hits,
-                          "query": {"match": {"entities": keywords}}}
-        elif elasticfieldname == KWType.KW_TABLE:
-            index = "profile"
-            query_body = {"from": 0, "size": max_hits,
-                          "query": {"match": {"sourceName": keywords}}}
+        index, query_body = keyword_query(keywords, elasticfieldname, max_hits)
         res = client.search(index=index, body=query_body,
-                            filter_path=filter_path)
+                            filter_path=keyword_filter_path)
         if res['hits']['total'] == 0:
             return []
         for el in res['hits']['hits']:
-            data = Hit(el['_source']['id'], el['_source']['dbName'], el['_source']['sourceName'],
-                       el['_source']['columnName'], el['_score'])
-            yield data
+            yield hit_from_source(el)
+
+    def search_keywords_many(self, kws, elasticfieldname, max_hits=15):
+        """
+        Performs one search query per keyword on elastic_field_name, all of them sent in a
+        single multi-search request
+        :param kws: the keywords to match, one query each
+        :param elasticfieldname: what is the field in the store where to apply the queries
+        :return: a list with the list of matching documents of each keyword, in the order of kws
+        """
+        kws = list(kws)
+        if len(kws) == 0:
+            return []
+        body = []
+        for kw in kws:
+            index, query_body = keyword_query(kw, elasticfieldname, max_hits)
+            body.append({"index": index})
+            body.append(query_body)
+        res = client.msearch(body=body,
+                             filter_path=['responses.error'] + ['responses.' + path for path in keyword_filter_path])
+        results = []
+        for kw, response in zip(kws, res['responses']):
+            if 'error' in response:
+                raise RuntimeError("Keyword search for {0} failed: {1}".format(kw, response['error']))
+            if response['hits']['total'] == 0:
+                results.append([])
+            else:
+                results.append([hit_from_source(el) for el in response['hits']['hits']])
+        return results
 
     def get_all_fields_entities(self):
         """
@@ -203,99 +229,174 @@ class StoreHandler:
             scroll_id = res['_scroll_id']  # update the scroll_id
         client.clear_scroll(scroll_id=scroll_id)
 
-    def get_all_fields_text_signatures(self, network):
-
-        def partition_ids(ids, partition_size=50):
-            for i in range(0, len(ids), partition_size):
-                yield ids[i:i + partition_size]
-
-        def filter_term_vector_by_frequency(term_dict):
-            # FIXME: add filter by term length
-            filtered = []
-            for k, v in term_dict.items():
-                if len(k) > 3:
-                    if v > 3:
-                        try:
-                            float(k)
-                            continue
-                        except ValueError:
-                            matches = re.findall('[0-9]', k)
-                            if len(matches) == 0:
-                                filtered.append(k)
-            return filtered
-
-        text_signatures = []
-        total = 0
-        for nid in network.iterate_ids_text():
-            total += 1
-            if total % 100 == 0:
-                print("text_sig: " + str(total))
-            # We retrieve all documents indexed with the same id in 'text'
-            docs = self.get_all_docs_from_text_with_idx_id(nid)
-            ids = [x for x in docs]
-            # partition ids so that they fit in one http request
-            ids_partitions = partition_ids(ids)
-            all_terms = defaultdict(int)
-            for partition in ids_partitions:
-                # We get the term vectors for each group of those documents
-                # , body=term_body)
-                ans = client.mtermvectors(
-                    index='text', ids=partition, doc_type='column')
-                # We merge them somehow
-                found_docs = ans['docs']
-                for doc in found_docs:
-                    term_vectors = doc['term_vectors']
-                    if 'text' in term_vectors:
-                        # terms = list(term_vectors['text']['terms'].keys())
-                        terms_and_freq = term_vectors['text']['terms']
-                        for term, freq_dict in terms_and_freq.items():
-                            # we don't care about the value
-                            all_terms[term] = all_terms[
-                                                  term] + freq_dict['term_freq']
-            filtered_term_vector = filter_term_vector_by_frequency(all_terms)
-            if len(filtered_term_vector) > 0:
-                data = (nid, filtered_term_vector)
-                text_signatures.append(data)
-        return text_signatures
-
-    def get_all_fields_num_signatures(self):
+    def get_all_text_doc_ids(self):
         """
-        Retrieves numerical fields and signatures from the store
-        :return: (fields, numsignatures)
+        Reads the ids of all documents in the text index, with one scroll over the whole index
+        sorted by field, so the documents of each field come one after another
+        :return: a generator of (doc_id, field_id)
         """
-        query_body = {
-            "query": {"bool": {"filter": [{"term": {"dataType": "N"}}]}}}
-        res = client.search(index='profile', body=query_body, scroll="10m",
+        body = {"query": {"match_all": {}}, "_source": ["id"], "sort": [{"id": "asc"}]}
+        res = client.search(index='text', body=body, scroll="10m",
+                            size=c.text_signatures["ids_per_request"],
                             filter_path=['_scroll_id',
                                          'hits.hits._id',
                                          'hits.total',
-                                         'hits.hits._source.median',
-                                         'hits.hits._source.iqr',
-                                         'hits.hits._source.minValue',
-                                         'hits.hits._source.maxValue']
+                                         'hits.hits._source.id']
                             )
         scroll_id = res['_scroll_id']
         remaining = res['hits']['total']
-
-        id_sig = []
         while remaining > 0:
             hits = res['hits']['hits']
             for h in hits:
-                data = (h['_id'], (h['_source']['median'], h['_source']['iqr'],
-                                   h['_source']['minValue'], h['_source']['maxValue']))
-                id_sig.append(data)
+                yield h['_id'], str(h['_source']['id'])
                 remaining -= 1
             res = client.scroll(scroll="5m", scroll_id=scroll_id,
                                 filter_path=['_scroll_id',
                                              'hits.hits._id',
-                                             'hits.hits._source.median',
-                                             'hits.hits._source.iqr',
-                                             'hits.hits._source.minValue',
-                                             'hits.hits._source.maxValue']
+                                             'hits.hits._source.id']
                                 )
             scroll_id = res['_scroll_id']  # update the scroll_id
         client.clear_scroll(scroll_id=scroll_id)
-        return id_sig
+
+    def get_all_fields_text_signatures(self, network):
+        """
+        Reads the text signatures of all the text fields in network. The ids of the documents
+        are read in one scroll over the text index, and each batch of complete fields is sent
+        as it is read to a pool of worker processes, that read, merge and filter their term
+        vectors. Only a few batches are in flight at any time
+        :return: a generator of (nid, terms), for the fields with some term left after filtering
+        """
+        # this may run in a forked process, which needs its own connection
+        init_worker_client()
+        text_nids = set(network.iterate_ids_text())
+
+        def tasks():
+            task = []
+            size = 0
+            # the ids come sorted by field, so a field is complete once the next one starts
+            for nid, docs in groupby(self.get_all_text_doc_ids(), key=itemgetter(1)):
+                if nid not in text_nids:
+                    continue
+                doc_ids = [doc_id for doc_id, _ in docs]
+                task.append((nid, doc_ids))
+                size += len(doc_ids)
+                if size >= c.text_signatures["ids_per_task"]:
+                    yield task
+                    task = []
+                    size = 0
+            if task:
+                yield task
+
+        def results(pool, processes):
+            pending = deque()
+            for task in tasks():
+                pending.append(pool.apply_async(text_signatures_of, (task,)))
+                if len(pending) >= 2 * processes:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+
+        processes = c.text_signatures["processes"] or multiprocessing.cpu_count()
+        total = 0
+        with multiprocessing.Pool(processes, initializer=init_worker_client) as pool:
+            for signatures in results(pool, processes):
+                for data in signatures:
+                    total += 1
+                    if total % 100 == 0:
+                        print("text_sig: " + str(total))
+                    yield data
+
+    def get_all_fields_num_signature_columns(self):
+        """
+        Retrieves numerical fields and signatures from the store, decoded straight into
+        columns by scan_profile
+        :return: (ids, median, iqr, min_value, max_value), a list of ids and float arrays aligned with it
+        """
+        query = {"bool": {"filter": [{"term": {"dataType": "N"}}]}}
+        ids, columns = self.scan_profile({'median': float, 'iqr': float,
+                                          'minValue': float, 'maxValue': float}, query)
+        return ids, columns['median'], columns['iqr'], columns['minValue'], columns['maxValue']
+
+
+keyword_filter_path = ['hits.hits._source.id',
+                       'hits.hits._score',
+                       'hits.total',
+                       'hits.hits._source.dbName',
+                       'hits.hits._source.sourceName',
+                       'hits.hits._source.columnName']
+
+
+def keyword_query(keywords, elasticfieldname, max_hits):
+    """
+    Builds the search on elastic_field_name that matches the provided keywords
+    :return: (index, query_body)
+    """
+    index = None
+    query_body = None
+    if elasticfieldname == KWType.KW_TEXT:
+        index = "text"
+        query_body = {"from": 0, "size": max_hits,
+                      "query": {"match": {"text": keywords}}}
+    elif elasticfieldname == KWType.KW_SCHEMA:
+        index = "profile"
+        query_body = {"from": 0, "size": max_hits,
+                      "query": {"match": {"columnName": keywords}}}
+    elif elasticfieldname == KWType.KW_ENTITIES:
+        index = "profile"
+        query_body = {"from": 0, "size": max_hits,
+                      "query": {"match": {"entities": keywords}}}
+    elif elasticfieldname == KWType.KW_TABLE:
+        index = "profile"
+        query_body = {"from": 0, "size": max_hits,
+                      "query": {"match": {"sourceName": keywords}}}
+    return index, query_body
+
+
+def hit_from_source(el):
+    return Hit(el['_source']['id'], el['_source']['dbName'], el['_source']['sourceName'],
+               el['_source']['columnName'], el['_score'])
+
+
+def init_worker_client():
+    """
+    Gives a worker process its own connection to the store
+    """
+    global client
+    client = Elasticsearch([{'host': c.db_host, 'port': c.db_port}])
+
+
+def partition_ids(ids, partition_size):
+    for i in range(0, len(ids), partition_size):
+        yield ids[i:i + partition_size]
+
+
+def text_signatures_of(fields):
+    """
+    Reads the term vectors of the documents of fields, many per request, and merges them per field
+    :param fields: list of (nid, ids of the documents of the field in the text index)
+    :return: list of (nid, terms) for the fields with some term left after filtering
+    """
+    ids = [doc_id for _, doc_ids in fields for doc_id in doc_ids]
+    doc_terms = dict()
+    for partition in partition_ids(ids, c.text_signatures["ids_per_request"]):
+        # only the term frequencies are needed
+        ans = client.mtermvectors(index='text', ids=partition, doc_type='column', fields='text',
+                                  positions=False, offsets=False, field_statistics=False)
+        for doc in ans['docs']:
+            term_vectors = doc.get('term_vectors', {})
+            if 'text' in term_vectors:
+                doc_terms[doc['_id']] = term_vectors['text']['terms']
+
+    signatures = []
+    for nid, doc_ids in fields:
+        all_terms = defaultdict(int)
+        for doc_id in doc_ids:
+            for term, freq_dict in doc_terms.get(doc_id, {}).items():
+                all_terms[term] += freq_dict['term_freq']
+        filtered_term_vector = filter_term_vector_by_frequency(all_terms)
+        if len(filtered_term_vector) > 0:
+            signatures.append((nid, filtered_term_vector))
+    return signatures
 
 
 if __name__ == "__main__":
@@ -366,32 +467,4 @@ if __name__ == "__main__":
                                     )
                 scroll_id = res['_scroll_id']  # update the scroll_id
             client.clear_scroll(scroll_id=scroll_id)
-
-
-        def get_all_fields_of_source(self, source_name):
-            body = {"query": {"match": {"sourceName": source_name}}}
-            res = client.search(index='profile', body=body, scroll="10m",
-                                filter_path=['_scroll_id',
-                                             'hits.hits._id',
-                                             'hits.total',
-                                             'hits.hits._source.sourceName',
-                                             'hits.hits._source.columnName']
-                                )
-            scroll_id = res['_scroll_id']
-            remaining = res['hits']['total']
-            while remaining > 0:
-                hits = res['hits']['hits']
-                for h in hits:
-                    hit = Hit(h['_id'], h['_source']['sourceName'],
-                              h['_source']['columnName'], -1)
-                    yield hit
-                    remaining -= 1
-                res = client.scroll(scroll="3m", scroll_id=scroll_id,
-                                    filter_path=['_scroll_id',
-                                                 'hits.hits._id',
-                                                 'hits.hits._source.sourceName',
-                                                 'hits.hits._source.columnName']
-                                    )
-                scroll_id = res['_scroll_id']  # update the scroll_id
-            client.clear_scroll(scroll_id=scroll_id)
         """
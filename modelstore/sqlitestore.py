@@ -0,0 +1,181 @@
+import csv
+import os
+import random
+import re
+import sqlite3
+from itertools import groupby
+
+import numpy as np
+
+from api.apiutils import Hit
+from api.apiutils import compute_field_id
+from modelstore.store import KWType
+from modelstore.store import Store
+from modelstore.store import filter_term_vector_by_frequency
+from modelstore.store import reservoir_sample
+import config as c
+
+
+schema = [
+    """CREATE TABLE IF NOT EXISTS profile (
+        id TEXT PRIMARY KEY, dbName TEXT, sourceName TEXT, columnName TEXT, dataType TEXT,
+        totalValues INTEGER, uniqueValues INTEGER,
+        median REAL, iqr REAL, minValue REAL, maxValue REAL)""",
+    "CREATE INDEX IF NOT EXISTS profile_source ON profile (sourceName, columnName)",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS profile_fts USING fts5(id UNINDEXED, columnName, sourceName, entities)",
+    # one document per value of the text fields
+    "CREATE TABLE IF NOT EXISTS text (doc INTEGER PRIMARY KEY, id TEXT, text TEXT)",
+    "CREATE INDEX IF NOT EXISTS text_id ON text (id)",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS text_fts USING fts5(text, content='text', content_rowid='doc')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS text_terms USING fts5vocab(text_fts, instance)",
+    # sample values of every field, see peek_values
+    "CREATE TABLE IF NOT EXISTS sample (id TEXT, position INTEGER, value TEXT, PRIMARY KEY (id, position))"
+]
+
+# KWType -> column of profile_fts the keywords are matched against
+profile_columns = {
+    KWType.KW_SCHEMA: "columnName",
+    KWType.KW_ENTITIES: "entities",
+    KWType.KW_TABLE: "sourceName"
+}
+
+
+class SQLiteStore(Store):
+    """
+    Embedded store in one SQLite file, with FTS5 full-text indexes for the keyword searches
+    and the text signatures. Fields are profiled when they are added, see add_table
+    """
+
+    def __init__(self, path=":memory:"):
+        super().__init__()
+        self.conn = sqlite3.connect(path)
+        for statement in schema:
+            self.conn.execute(statement)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def add_field(self, db_name, source_name, field_name, values, entities=()):
+        """
+        Profiles the values of a field and adds it to the store. Fields whose (non empty) values
+        are all numbers are numerical, the others are text and their values are indexed
+        :return: the id of the field
+        """
+        nid = compute_field_id(db_name, source_name, field_name)
+        values = [v for v in values if v is not None and str(v).strip() != ""]
+        numbers = None
+        try:
+            numbers = np.array([float(v) for v in values], dtype=float)
+        except ValueError:
+            pass
+        median = iqr = min_value = max_value = None
+        if numbers is not None and len(numbers) > 0:
+            data_type = "N"
+            q1, median, q3 = np.percentile(numbers, [25, 50, 75]).tolist()
+            iqr = q3 - q1
+            min_value = float(numbers.min())
+            max_value = float(numbers.max())
+        else:
+            data_type = "T"
+        self.conn.execute("INSERT INTO profile VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                          (nid, db_name, source_name, field_name, data_type,
+                           len(values), len(set(values)), median, iqr, min_value, max_value))
+        self.conn.execute("INSERT INTO profile_fts VALUES (?, ?, ?, ?)",
+                          (nid, field_name, source_name, " ".join(entities)))
+        self.sample_cache.invalidate((source_name, field_name))
+        sample = reservoir_sample(values, c.samples["size"], random.Random(nid))
+        self.conn.executemany("INSERT INTO sample VALUES (?, ?, ?)",
+                              [(nid, position, str(value)) for position, value in enumerate(sample)])
+        if data_type == "T":
+            for value in values:
+                doc = self.conn.execute("INSERT INTO text (id, text) VALUES (?, ?)", (nid, str(value))).lastrowid
+                self.conn.execute("INSERT INTO text_fts (rowid, text) VALUES (?, ?)", (doc, str(value)))
+        return nid
+
+    def add_table(self, db_name, source_name, columns):
+        """
+        Adds all the fields of a table
+        :param columns: dict of field name -> values
+        :return: the ids of the fields
+        """
+        nids = [self.add_field(db_name, source_name, field_name, values) for field_name, values in columns.items()]
+        self.conn.commit()
+        return nids
+
+    def add_csv(self, path, db_name):
+        """
+        Adds the table in a CSV file with a header, named after the file
+        :return: the ids of the fields
+        """
+        with open(path, newline='') as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            columns = [[] for _ in header]
+            for row in reader:
+                for column, value in zip(columns, row):
+                    column.append(value)
+        return self.add_table(db_name, os.path.basename(path), dict(zip(header, columns)))
+
+    def get_all_fields(self):
+        cursor = self.conn.execute("SELECT id, dbName, sourceName, columnName, totalValues, uniqueValues, dataType "
+                                   "FROM profile")
+        yield from cursor
+
+    def get_all_fields_of_source(self, source_name):
+        return self.conn.execute("SELECT id, sourceName, columnName FROM profile WHERE sourceName = ?",
+                                 (source_name,)).fetchall()
+
+    def search_keywords(self, keywords, elasticfieldname, max_hits=15):
+        # any of the terms of keywords, like a match query
+        terms = re.findall(r'\w+', keywords)
+        if len(terms) == 0:
+            return []
+        query = "(" + " OR ".join('"' + term + '"' for term in terms) + ")"
+        if elasticfieldname == KWType.KW_TEXT:
+            # scores of the matching values of each field added up, the bm25 rank is lower for better matches
+            rows = self.conn.execute(
+                "SELECT p.id, p.dbName, p.sourceName, p.columnName, -SUM(m.score) AS score FROM "
+                "(SELECT rowid, rank AS score FROM text_fts WHERE text_fts MATCH ?) m "
+                "JOIN text t ON t.doc = m.rowid JOIN profile p ON p.id = t.id "
+                "GROUP BY p.id ORDER BY score DESC LIMIT ?", (query, max_hits))
+        else:
+            rows = self.conn.execute(
+                "SELECT p.id, p.dbName, p.sourceName, p.columnName, -m.score AS score FROM "
+                "(SELECT id, rank AS score FROM profile_fts WHERE profile_fts MATCH ?) m "
+                "JOIN profile p ON p.id = m.id ORDER BY score DESC LIMIT ?",
+                (profile_columns[elasticfieldname] + " : " + query, max_hits))
+        return [Hit(nid, db_name, source_name, field_name, score)
+                for nid, db_name, source_name, field_name, score in rows]
+
+    def get_all_fields_text_signatures(self, network):
+        text_nids = set(network.iterate_ids_text())
+        rows = self.conn.execute("SELECT t.id, v.term, COUNT(*) FROM text_terms v JOIN text t ON t.doc = v.doc "
+                                 "GROUP BY t.id, v.term ORDER BY t.id")
+        for nid, terms in groupby(rows, key=lambda row: row[0]):
+            if nid not in text_nids:
+                continue
+            filtered_term_vector = filter_term_vector_by_frequency({term: freq for _, term, freq in terms})
+            if len(filtered_term_vector) > 0:
+                yield nid, filtered_term_vector
+
+    def get_all_fields_num_signature_columns(self):
+        rows = self.conn.execute("SELECT id, median, iqr, minValue, maxValue FROM profile "
+                                 "WHERE dataType = 'N'").fetchall()
+        nids = [row[0] for row in rows]
+        stats = np.array([row[1:] for row in rows], dtype=float).reshape(-1, 4)
+        return nids, stats[:, 0], stats[:, 1], stats[:, 2], stats[:, 3]
+
+    def read_samples(self, fields):
+        samples = {field: [] for field in fields}
+        fields = list(samples)
+        # in chunks, to stay under the limit of variables of a statement
+        for i in range(0, len(fields), 400):
+            chunk = fields[i:i + 400]
+            rows = self.conn.execute(
+                "SELECT p.sourceName, p.columnName, s.value FROM profile p JOIN sample s ON s.id = p.id "
+                "WHERE (p.sourceName, p.columnName) IN (VALUES " + ", ".join(["(?, ?)"] * len(chunk)) + ") "
+                "ORDER BY p.sourceName, p.columnName, s.position", [name for field in chunk for name in field])
+            for source_name, field_name, value in rows:
+                samples[(source_name, field_name)].append(value)
+        return samples
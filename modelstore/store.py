@@ -0,0 +1,192 @@
+import re
+from collections import OrderedDict
+from enum import Enum
+
+import config as c
+
+
+class KWType(Enum):
+    KW_TEXT = 0
+    KW_SCHEMA = 1
+    KW_ENTITIES = 2
+    KW_TABLE = 3
+
+
+class SampleCache:
+    """
+    LRU cache of the sample values of at most max_fields fields
+    """
+
+    def __init__(self, max_fields):
+        self.max_fields = max_fields
+        self.samples = OrderedDict()
+
+    def get(self, field):
+        values = self.samples.get(field)
+        if values is not None:
+            self.samples.move_to_end(field)
+        return values
+
+    def put(self, field, values):
+        self.samples[field] = values
+        self.samples.move_to_end(field)
+        while len(self.samples) > self.max_fields:
+            self.samples.popitem(last=False)
+
+    def invalidate(self, field):
+        self.samples.pop(field, None)
+
+
+class Store(object):
+    """
+    Interface of the stores that hold the profiles and the text of the fields
+    """
+
+    def __init__(self):
+        self.sample_cache = SampleCache(c.samples["cache_fields"])
+
+    def close(self):
+        pass
+
+    def get_all_fields(self):
+        """
+        Reads all fields from the store
+        :return: an iterable of (id, db_name, source_name, field_name, total_values, unique_values, data_type)
+        """
+        raise NotImplementedError
+
+    def get_all_fields_of_source(self, source_name):
+        """
+        Reads the fields of a source (table)
+        :param source_name: the name of the source
+        :return: an iterable of (id, source_name, field_name)
+        """
+        raise NotImplementedError
+
+    def search_keywords(self, keywords, elasticfieldname, max_hits=15):
+        """
+        Performs a search query on elastic_field_name to match the provided keywords
+        :param keywords: the keywords to match
+        :param elasticfieldname: the KWType that says where to apply the query
+        :return: an iterable of the Hits that match the keywords
+        """
+        raise NotImplementedError
+
+    def search_keywords_many(self, kws, elasticfieldname, max_hits=15):
+        """
+        Performs one search query per keyword on elastic_field_name
+        :return: a list with the list of matching Hits of each keyword, in the order of kws
+        """
+        return [list(self.search_keywords(kw, elasticfieldname, max_hits)) for kw in kws]
+
+    def get_all_fields_text_signatures(self, network):
+        """
+        Reads the text signatures of all the text fields in network
+        :return: an iterable of (nid, terms), for the fields with some term left after filtering
+        """
+        raise NotImplementedError
+
+    def get_all_fields_num_signatures(self):
+        """
+        Retrieves numerical fields and signatures from the store, one tuple per field,
+        see get_all_fields_num_signature_columns
+        :return: list of (id, (median, iqr, min_value, max_value))
+        """
+        nids, median, iqr, min_value, max_value = self.get_all_fields_num_signature_columns()
+        return list(zip(nids, zip(median.tolist(), iqr.tolist(), min_value.tolist(), max_value.tolist())))
+
+    def get_all_fields_num_signature_columns(self):
+        """
+        Retrieves numerical fields and signatures from the store, as columns
+        :return: (ids, median, iqr, min_value, max_value), a list of ids and float arrays aligned with it
+        """
+        raise NotImplementedError
+
+    def peek_values(self, field, num_values):
+        """
+        Reads sample values for the given field
+        :param field: (source_name, field_name) of the field from which to read values
+        :param num_values: The number of values to read
+        :return: A list with the sample values read for field
+        """
+        return self.peek_values_many([field], num_values)[field]
+
+    def peek_values_many(self, fields, num_values):
+        """
+        Reads sample values for all the given fields, the samples not cached are read in one lookup
+        :param fields: list of (source_name, field_name)
+        :param num_values: The number of values to read per field
+        :return: dict of field -> list with the sample values read for it
+        """
+        samples = dict()
+        missing = []
+        for field in fields:
+            values = self.sample_cache.get(field)
+            if values is None:
+                missing.append(field)
+            else:
+                samples[field] = values
+        if missing:
+            read = self.read_samples(missing)
+            for field in missing:
+                samples[field] = read.get(field, [])
+                self.sample_cache.put(field, samples[field])
+        return {field: samples[field][:num_values] for field in fields}
+
+    def read_samples(self, fields):
+        """
+        Reads the samples (up to config.samples["size"] values) kept for the given fields
+        :param fields: list of (source_name, field_name)
+        :return: dict of field -> list of values, fields without samples may be left out
+        """
+        raise NotImplementedError
+
+
+def filter_term_vector_by_frequency(term_dict):
+    # FIXME: add filter by term length
+    filtered = []
+    for k, v in term_dict.items():
+        if len(k) > 3:
+            if v > 3:
+                try:
+                    float(k)
+                    continue
+                except ValueError:
+                    matches = re.findall('[0-9]', k)
+                    if len(matches) == 0:
+                        filtered.append(k)
+    return filtered
+
+
+def reservoir_sample(values, size, rng):
+    """
+    Uniform sample of size values of an iterable, read once
+    :param rng: the random.Random to draw with
+    :return: list with the sample, in the order the values were read while they fit
+    """
+    sample = []
+    for i, value in enumerate(values):
+        if i < size:
+            sample.append(value)
+        else:
+            j = rng.randint(0, i)
+            if j < size:
+                sample[j] = value
+    return sample
+
+
+def open_store(backend=None):
+    """
+    Opens the store configured in config.store
+    :param backend: "elastic" or "sqlite", config.store["backend"] by default
+    :return: the Store
+    """
+    if backend is None:
+        backend = c.store["backend"]
+    if backend == "elastic":
+        from modelstore.elasticstore import StoreHandler
+        return StoreHandler()
+    elif backend == "sqlite":
+        from modelstore.sqlitestore import SQLiteStore
+        return SQLiteStore(c.store["sqlite_path"])
+    raise ValueError("Unknown store backend: " + str(backend))
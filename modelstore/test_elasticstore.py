@@ -0,0 +1,83 @@
+import unittest
+from modelstore import elasticstore
+from modelstore.elasticstore import StoreHandler
+from modelstore.store import KWType
+
+
+def response(*names):
+    return {"hits": {"total": len(names),
+                     "hits": [{"_score": 1.0, "_source": {"id": name, "dbName": "db", "sourceName": "table",
+                                                          "columnName": name}} for name in names]}}
+
+
+class MultiSearchClient:
+    """
+    Answers a multi-search with the given responses, and records the request bodies
+    """
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests = []
+
+    def msearch(self, body, filter_path=None):
+        self.requests.append(body)
+        return {"responses": self.responses}
+
+
+class TestStoreHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.client = getattr(elasticstore, "client", None)
+        # no connection is opened, the module client is replaced by the fake
+        self.store = StoreHandler.__new__(StoreHandler)
+
+    def tearDown(self):
+        elasticstore.client = self.client
+
+    def test_search_keywords_many(self):
+        print(self._testMethodName)
+
+        client = MultiSearchClient([response("salary", "salary_2"), {"hits": {"total": 0}}, response("city")])
+        elasticstore.client = client
+        results = self.store.search_keywords_many(["salary", "nothing", "city"], KWType.KW_SCHEMA, max_hits=5)
+        self.assertEqual(len(client.requests), 1)
+        # one header and one query per keyword, in order
+        queries = client.requests[0][1::2]
+        self.assertEqual([q["query"]["match"]["columnName"] for q in queries], ["salary", "nothing", "city"])
+        self.assertEqual([[h.field_name for h in hits] for hits in results], [["salary", "salary_2"], [], ["city"]])
+        self.assertEqual(self.store.search_keywords_many([], KWType.KW_SCHEMA), [])
+
+    def test_search_keywords_many_error(self):
+        print(self._testMethodName)
+
+        elasticstore.client = MultiSearchClient([response("salary"), {"error": {"type": "index_not_found"}}])
+        with self.assertRaises(RuntimeError) as ctx:
+            self.store.search_keywords_many(["salary", "city"], KWType.KW_TEXT)
+        self.assertIn("city", str(ctx.exception))
+
+    def test_read_samples(self):
+        print(self._testMethodName)
+
+        def sample(source_name, field_name, text):
+            return {"_source": {"sourceName": source_name, "columnName": field_name, "text": text}}
+
+        client = MultiSearchClient([{"hits": {"total": 3, "hits": [sample("table", "city", "boston"),
+                                                                   sample("table", "city code", "617"),
+                                                                   sample("table", "city", "austin")]}},
+                                    {"hits": {"total": 1, "hits": [sample("table_2", "name", "mary")]}},
+                                    {"hits": {"total": 0}}])
+        elasticstore.client = client
+        fields = [("table", "city"), ("table", "name"), ("table", "salary")]
+        samples = self.store.read_samples(fields)
+        self.assertEqual(len(client.requests), 1)
+        self.assertEqual(len(client.requests[0]), 2 * len(fields))
+        # only the values of the exact field are kept, fields left without values are left out
+        self.assertEqual(samples, {("table", "city"): ["boston", "austin"]})
+
+        elasticstore.client = MultiSearchClient([{"error": {"type": "index_not_found"}}])
+        with self.assertRaises(RuntimeError):
+            self.store.read_samples([("table", "city")])
+
+
+if __name__ == "__main__":
+    unittest.main()
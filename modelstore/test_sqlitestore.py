@@ -0,0 +1,153 @@
+import os
+import tempfile
+import unittest
+import config as c
+from knowledgerepr.fieldnetwork import FieldNetwork
+from modelstore.store import KWType
+from modelstore.store import SampleCache
+from modelstore.sqlitestore import SQLiteStore
+
+
+def employees():
+    return {"employee_name": ["alice smith", "bob smith", "carol jones", "dave smith", "erin smith"] * 2,
+            "salary": [10, 20, 30, 40, 50, 60, 70, 80, 90, 100],
+            "city": ["boston", "boston", "cambridge", "boston", "boston", "", None, "somerville", "boston", "boston"]}
+
+
+class TestSQLiteStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store = SQLiteStore()
+        self.store.add_table("db", "employees", employees())
+        self.store.add_table("db", "offices", {"office_city": ["cambridge", "boston"], "floors": [3, 5]})
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_get_all_fields(self):
+        print(self._testMethodName)
+
+        fields = {(sn, fn): (total, unique, data_type)
+                  for _, db, sn, fn, total, unique, data_type in self.store.get_all_fields()}
+        self.assertEqual(len(fields), 5)
+        self.assertEqual(fields[("employees", "salary")], (10, 10, "N"))
+        # empty values are not counted
+        self.assertEqual(fields[("employees", "city")], (8, 3, "T"))
+
+        signatures = dict(self.store.get_all_fields_num_signatures())
+        self.assertEqual(len(signatures), 2)
+        nid = [nid for nid, _, sn, fn, _, _, _ in self.store.get_all_fields() if fn == "salary"][0]
+        self.assertEqual(signatures[nid], (55.0, 45.0, 10.0, 100.0))
+        nids, median, iqr, min_value, max_value = self.store.get_all_fields_num_signature_columns()
+        self.assertEqual(sorted(nids), sorted(signatures))
+        i = nids.index(nid)
+        self.assertEqual((median[i], iqr[i], min_value[i], max_value[i]), (55.0, 45.0, 10.0, 100.0))
+
+    def test_get_all_fields_of_source(self):
+        print(self._testMethodName)
+
+        fields = self.store.get_all_fields_of_source("offices")
+        self.assertEqual(sorted((sn, fn) for _, sn, fn in fields), [("offices", "floors"), ("offices", "office_city")])
+        nids = {nid for nid, _, sn, _, _, _, _ in self.store.get_all_fields() if sn == "offices"}
+        self.assertEqual({nid for nid, _, _ in fields}, nids)
+        self.assertEqual(list(self.store.get_all_fields_of_source("nothing")), [])
+
+    def test_search_keywords(self):
+        print(self._testMethodName)
+
+        hits = list(self.store.search_keywords("boston", KWType.KW_TEXT))
+        self.assertEqual(sorted(h.field_name for h in hits), ["city", "office_city"])
+        # more matching values score higher
+        self.assertEqual(hits[0].field_name, "city")
+
+        hits = list(self.store.search_keywords("city", KWType.KW_SCHEMA))
+        self.assertEqual(sorted(h.field_name for h in hits), ["city", "office_city"])
+        hits = list(self.store.search_keywords("offices", KWType.KW_TABLE, max_hits=1))
+        self.assertEqual(len(hits), 1)
+        self.assertEqual(hits[0].source_name, "offices")
+        self.assertEqual(list(self.store.search_keywords("", KWType.KW_TEXT)), [])
+
+        many = self.store.search_keywords_many(["salary", "floors", "nothing"], KWType.KW_SCHEMA)
+        self.assertEqual([[h.field_name for h in hits] for hits in many], [["salary"], ["floors"], []])
+
+    def test_text_signatures(self):
+        print(self._testMethodName)
+
+        network = FieldNetwork.from_fields(self.store.get_all_fields())
+        signatures = {network.get_info_for([nid])[0][3]: sorted(terms)
+                      for nid, terms in self.store.get_all_fields_text_signatures(network)}
+        # terms that appear more than 3 times, longer than 3 characters
+        self.assertEqual(signatures, {"employee_name": ["smith"], "city": ["boston"]})
+
+    def test_peek_values(self):
+        print(self._testMethodName)
+
+        self.assertEqual(self.store.peek_values(("offices", "office_city"), 15), ["cambridge", "boston"])
+        self.assertEqual(len(self.store.peek_values(("employees", "employee_name"), 3)), 3)
+        self.assertEqual(self.store.peek_values(("offices", "floors"), 15), ["3", "5"])
+        self.assertEqual(self.store.peek_values(("offices", "nothing"), 15), [])
+        self.store.add_table("db", "offices", {"nothing": ["empty"]})
+        self.assertEqual(self.store.peek_values(("offices", "nothing"), 15), ["empty"])
+
+        # the sample of a large field is bounded, and a subset of its values
+        self.store.add_table("db", "large", {"value": list(range(1000))})
+        sample = self.store.peek_values(("large", "value"), 1000)
+        self.assertEqual(len(sample), c.samples["size"])
+        self.assertEqual(len(set(sample)), c.samples["size"])
+        self.assertTrue(set(sample) <= set(str(v) for v in range(1000)))
+        self.assertNotEqual(sample, [str(v) for v in range(c.samples["size"])])
+
+    def test_peek_values_many(self):
+        print(self._testMethodName)
+
+        reads = []
+        read_samples = self.store.read_samples
+
+        def counted_read_samples(fields):
+            reads.append(list(fields))
+            return read_samples(fields)
+        self.store.read_samples = counted_read_samples
+
+        fields = [("employees", "city"), ("offices", "office_city"), ("employees", "salary")]
+        samples = self.store.peek_values_many(fields, 2)
+        self.assertEqual(samples, {("employees", "city"): ["boston", "boston"],
+                                   ("offices", "office_city"): ["cambridge", "boston"],
+                                   ("employees", "salary"): ["10", "20"]})
+        self.assertEqual(len(reads), 1)
+        # cached samples are not read again
+        self.store.peek_values_many(fields + [("offices", "floors")], 15)
+        self.assertEqual(reads[1], [("offices", "floors")])
+        self.store.peek_values(("employees", "city"), 15)
+        self.assertEqual(len(reads), 2)
+
+    def test_sample_cache(self):
+        print(self._testMethodName)
+
+        cache = SampleCache(2)
+        cache.put("a", [1])
+        cache.put("b", [2])
+        cache.get("a")
+        cache.put("c", [3])
+        # b was the least recently used
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), [1])
+        self.assertEqual(cache.get("c"), [3])
+
+    def test_add_csv(self):
+        print(self._testMethodName)
+
+        with tempfile.TemporaryDirectory() as path:
+            csv_file = os.path.join(path, "rooms.csv")
+            with open(csv_file, "w") as f:
+                f.write("room,capacity\nkiva,12\nstar,30\n")
+            store = SQLiteStore(os.path.join(path, "store.db"))
+            store.add_csv(csv_file, "db")
+            store.close()
+            store = SQLiteStore(os.path.join(path, "store.db"))
+            fields = sorted((sn, fn, data_type) for _, _, sn, fn, _, _, data_type in store.get_all_fields())
+            self.assertEqual(fields, [("rooms.csv", "capacity", "N"), ("rooms.csv", "room", "T")])
+            store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -38,3 +38,16 @@ class CosineDistance(Distance):
             x = x.toarray().ravel()
             y = y.toarray().ravel()
         return 1.0 - numpy.dot(x, y)
+
+    def distances(self, xs, y):
+        """
+        Computes distance measure between each row of matrix xs and vector y.
+        Returns numpy array of floats.
+        """
+        if scipy.sparse.issparse(y):
+            if scipy.sparse.issparse(xs):
+                # Sparse-sparse product, only the result is densified
+                y = y.T if y.shape[0] == 1 else y
+                return 1.0 - numpy.ravel(xs.dot(y).toarray())
+            y = y.toarray()
+        return 1.0 - numpy.ravel(xs.dot(numpy.ravel(y)))
@@ -20,6 +20,8 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+import numpy
+
 
 class Distance(object):
     """ Interface for distance functions. """
@@ -29,3 +31,12 @@ class Distance(object):
         Computes distance measure between vectors x and y. Returns float.
         """
         raise NotImplementedError
+
+    def distances(self, xs, y):
+        """
+        Computes distance measure between each row of matrix xs and vector y.
+        Returns numpy array of floats. Implementations override this to
+        compute all distances with one numpy call.
+        """
+        return numpy.array([self.distance(xs[row], y)
+                            for row in range(xs.shape[0])], dtype=float)
@@ -37,3 +37,25 @@ class EuclideanDistance(Distance):
             return numpy.linalg.norm((x - y).toarray().ravel())
         else:
             return numpy.linalg.norm(x - y)
+
+    def distances(self, xs, y):
+        """
+        Computes distance measure between each row of matrix xs and vector y.
+        Returns numpy array of floats.
+        """
+        if scipy.sparse.issparse(xs):
+            # |x - y|^2 = |x|^2 - 2 x.y + |y|^2 keeps xs (and y) sparse
+            if scipy.sparse.issparse(y):
+                y = y.T if y.shape[0] == 1 else y
+                products = xs.dot(y).toarray()
+                y_square = y.multiply(y).sum()
+            else:
+                y = numpy.ravel(y)
+                products = xs.dot(y)
+                y_square = numpy.dot(y, y)
+            squares = (numpy.ravel(xs.multiply(xs).sum(axis=1)) -
+                       2.0 * numpy.ravel(products) + y_square)
+            return numpy.sqrt(numpy.maximum(squares, 0.0))
+        if scipy.sparse.issparse(y):
+            y = y.toarray()
+        return numpy.linalg.norm(xs - numpy.ravel(y), axis=1)
@@ -37,3 +37,20 @@ class ManhattanDistance(Distance):
             return numpy.sum(numpy.absolute((x - y).toarray().ravel()))
         else:
             return numpy.sum(numpy.absolute(x - y))
+
+    def distances(self, xs, y):
+        """
+        Computes the Manhattan distance between each row of matrix xs and
+        vector y. Returns numpy array of floats.
+        """
+        if scipy.sparse.issparse(xs):
+            if not scipy.sparse.issparse(y):
+                y = scipy.sparse.csr_matrix(numpy.ravel(y))
+            elif y.shape[0] > 1:
+                y = y.T
+            # repeat y as many times as xs has rows, all kept sparse
+            ys = scipy.sparse.csr_matrix(numpy.ones((xs.shape[0], 1))).dot(y)
+            return numpy.ravel(abs(xs - ys).sum(axis=1))
+        if scipy.sparse.issparse(y):
+            y = y.toarray()
+        return numpy.sum(numpy.absolute(xs - numpy.ravel(y)), axis=1)
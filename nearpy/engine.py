@@ -23,6 +23,7 @@
 import json
 
 import numpy as np
+import scipy.sparse
 
 from nearpy.hashes import RandomBinaryProjections
 from nearpy.hashes import PCABinaryProjections
@@ -30,8 +31,8 @@ from nearpy.hashes import RandomBinaryProjectionTree
 from nearpy.filters import NearestFilter, UniqueFilter
 from nearpy.distances import EuclideanDistance
 from nearpy.distances import CosineDistance
-from nearpy.storage import MemoryStorage
-from nearpy.utils.utils import unitvec
+from nearpy.storage import MemoryStorage, ColumnarMemoryStorage
+from nearpy.utils.utils import unitvec, unitvecs, stack_vectors
 
 
 class Engine(object):
@@ -81,6 +82,8 @@ class Engine(object):
         if storage is None:
             storage = MemoryStorage()
         self.storage = storage
+        # Columnar storage keeps candidates as row indices into one matrix
+        self._columnar = isinstance(storage, ColumnarMemoryStorage)
 
         # Initialize all hashes for the data space dimension.
         for lshash in self.lshashes:
@@ -94,6 +97,12 @@ class Engine(object):
         """
         # We will store the normalized vector (used during retrieval)
         nv = unitvec(v)
+        if self._columnar:
+            row = self.storage.add_vector(nv, data)
+            for lshash in self.lshashes:
+                for bucket_key in lshash.hash_vector(v):
+                    self.storage.store_row(lshash.hash_name, bucket_key, row)
+            return
         # Store vector in each bucket of all hashes
         for lshash in self.lshashes:
             for bucket_key in lshash.hash_vector(v):
@@ -101,6 +110,33 @@ class Engine(object):
                 self.storage.store_vector(lshash.hash_name, bucket_key,
                                           nv, data)
 
+    def store_vectors(self, vs, data):
+        """
+        Hashes every row of matrix vs (dense or scipy.sparse) and stores it in
+        all matching buckets in the storage. Each hash projects the whole
+        matrix at once. The data argument is a sequence with one
+        JSON-serializable element per row.
+        """
+        # We will store the normalized rows (used during retrieval)
+        nvs = unitvecs(vs)
+        if self._columnar:
+            rows = self.storage.add_vectors(nvs, data)
+            for lshash in self.lshashes:
+                keys_per_row = lshash.hash_vectors(vs)
+                for row, bucket_keys in zip(rows, keys_per_row):
+                    for bucket_key in bucket_keys:
+                        self.storage.store_row(lshash.hash_name, bucket_key,
+                                               row)
+            return
+        rows = [nvs[row] for row in range(nvs.shape[0])]
+        # Store rows in each bucket of all hashes
+        for lshash in self.lshashes:
+            keys_per_row = lshash.hash_vectors(vs)
+            for nv, x_data, bucket_keys in zip(rows, data, keys_per_row):
+                for bucket_key in bucket_keys:
+                    self.storage.store_vector(lshash.hash_name, bucket_key,
+                                              nv, x_data)
+
     def candidate_count(self, v):
         """
         Returns candidate count for nearest neighbour search for specified vector.
@@ -129,28 +165,192 @@ class Engine(object):
         # Collect candidates from all buckets from all hashes
         candidates = self._get_candidates(v)
         # print 'Candidate count is %d' % len(candidates)
+        return self._process_candidates(v, candidates)
+
+    def neighbours_batch(self, vs):
+        """
+        Same as neighbours, for every row of matrix vs (dense or
+        scipy.sparse). Each hash projects the whole matrix at once. Returns a
+        list with the result list of each row, in row order.
+        """
+        if scipy.sparse.issparse(vs):
+            vs = vs.tocsr()
+        keys_per_hash = [lshash.hash_vectors(vs, querying=True)
+                         for lshash in self.lshashes]
+        results = []
+        for row in range(vs.shape[0]):
+            row_keys = [(lshash, keys[row]) for lshash, keys
+                        in zip(self.lshashes, keys_per_hash)]
+            candidates = self._get_bucket_contents(row_keys)
+            results.append(self._process_candidates(vs[row], candidates))
+        return results
+
+    def self_join(self, threshold=None):
+        """
+        Finds the pairs of stored vectors that share a bucket, walking each
+        bucket of each hash once instead of querying every stored vector.
+        If the vector filters start with a NearestFilter (the default), each
+        vector is only paired with its N nearest among the vectors it shares
+        a bucket with, itself included, as neighbours would for it. Yields
+        (data1, data2, distance) tuples, each pair only once even if it
+        shares several buckets. If threshold is set, only pairs with a
+        distance not greater than it are yielded. Without a distance
+        implementation, distance is None, threshold is ignored and all the
+        pairs are yielded.
+        """
+        nearest_filter = None
+        if self.distance and self.vector_filters and \
+                isinstance(self.vector_filters[0], NearestFilter):
+            nearest_filter = self.vector_filters[0]
+        if nearest_filter is not None:
+            # data -> {data: distance} of its N nearest so far
+            nearest = dict()
+            for vectors, data in self._buckets():
+                for i in range(len(data)):
+                    dists = self.distance.distances(vectors, vectors[i])
+                    self._merge_nearest(nearest, nearest_filter, data[i],
+                                        [(data[j], dists[j]) for j in
+                                         nearest_filter.nearest_indices(dists)])
+            pairs = ((x_data, y_data, distance)
+                     for x_data, neighbours in nearest.items()
+                     for y_data, distance in neighbours.items())
+        else:
+            pairs = self._bucket_pairs()
+        seen = set()
+        for x_data, y_data, distance in pairs:
+            if x_data == y_data:
+                continue
+            if threshold is not None and distance is not None and \
+                    distance > threshold:
+                continue
+            pair = frozenset((x_data, y_data))
+            if pair not in seen:
+                seen.add(pair)
+                yield x_data, y_data, distance
+
+    def _bucket_pairs(self):
+        """
+        Yields (data1, data2, distance) for every pair of vectors in the
+        same bucket, distance is None without a distance implementation
+        """
+        for vectors, data in self._buckets():
+            for i in range(len(data) - 1):
+                if self.distance:
+                    dists = self.distance.distances(vectors[i + 1:],
+                                                    vectors[i])
+                else:
+                    dists = [None] * (len(data) - i - 1)
+                for j, distance in enumerate(dists, i + 1):
+                    yield data[i], data[j], distance
+
+    def _buckets(self):
+        """
+        Yields (stacked vectors, data list) of every bucket of every hash
+        with more than one vector
+        """
+        for lshash in self.lshashes:
+            for bucket_key in self.storage.get_all_bucket_keys(
+                    lshash.hash_name):
+                if self._columnar:
+                    rows = self.storage.get_bucket_rows(lshash.hash_name,
+                                                        bucket_key)
+                    vectors = self.storage.get_vectors(rows)
+                    data = self.storage.get_data(rows)
+                else:
+                    bucket_content = self.storage.get_bucket(lshash.hash_name,
+                                                             bucket_key)
+                    vectors = [x[0] for x in bucket_content]
+                    data = [x[1] for x in bucket_content]
+                if len(data) < 2:
+                    continue
+                yield stack_vectors(vectors), data
 
-        # Apply fetch vector filters if specified and return filtered list
+    @staticmethod
+    def _merge_nearest(nearest, nearest_filter, x_data, candidates):
+        """
+        Adds the (data, distance) candidates of one bucket to the nearest
+        vectors of x_data, keeping the N nearest. The first occurrence of a
+        data wins, as with the UniqueFilter.
+        """
+        neighbours = nearest.setdefault(x_data, dict())
+        for y_data, distance in candidates:
+            neighbours.setdefault(y_data, distance)
+        if len(neighbours) > nearest_filter.N:
+            keys = list(neighbours)
+            dists = [neighbours[key] for key in keys]
+            nearest[x_data] = {keys[k]: dists[k] for k in
+                               nearest_filter.nearest_indices(dists)}
+
+    def _process_candidates(self, v, candidates):
+        """
+        Applies the (optional) fetch filters, distance and vector filters
+        to the candidates of vector v. Candidates are kept as vectors and a
+        data list: duplicates are dropped by data key, all distances are
+        computed with one call over the stacked vectors and a leading
+        NearestFilter picks its N indices before result tuples are built.
+        """
+        if self._columnar:
+            # Rows found in several buckets are the same stored vector
+            rows = np.unique(candidates)
+            vectors = self.storage.get_vectors(rows)
+            data = self.storage.get_data(rows)
+        else:
+            vectors = [x[0] for x in candidates]
+            data = [x[1] for x in candidates]
+
+        # Apply fetch vector filters if specified
         if self.fetch_vector_filters:
-            candidates = self._apply_filter(
-                self.fetch_vector_filters, candidates)
+            if all(isinstance(fetch_vector_filter, UniqueFilter) for
+                   fetch_vector_filter in self.fetch_vector_filters):
+                indices = self.fetch_vector_filters[0].unique_indices(data)
+                if isinstance(vectors, list):
+                    vectors = [vectors[i] for i in indices]
+                else:
+                    vectors = vectors[indices]
+                data = [data[i] for i in indices]
+            else:
+                candidates = self._apply_filter(self.fetch_vector_filters,
+                                                list(zip(vectors, data)))
+                vectors = [x[0] for x in candidates]
+                data = [x[1] for x in candidates]
 
+        vector_filters = self.vector_filters
         # Apply distance implementation if specified
-        if self.distance:
-            candidates = self._append_distances(v, self.distance, candidates)
+        if self.distance and data:
+            dists = self._distances(v, vectors)
+            indices = range(len(data))
+            if vector_filters and isinstance(vector_filters[0],
+                                             NearestFilter):
+                indices = vector_filters[0].nearest_indices(dists)
+                vector_filters = vector_filters[1:]
+            candidates = [(vectors[i], data[i], dists[i]) for i in indices]
+        else:
+            candidates = list(zip(vectors, data))
 
         # Apply vector filters if specified and return filtered list
-        if self.vector_filters:
-            candidates = self._apply_filter(self.vector_filters, candidates)
-
-        # If there is no vector filter, just return list of candidates
-        return candidates
+        return self._apply_filter(vector_filters, candidates)
 
     def _get_candidates(self, v):
         """ Collect candidates from all buckets from all hashes """
+        keys_per_hash = [(lshash, lshash.hash_vector(v, querying=True))
+                         for lshash in self.lshashes]
+        return self._get_bucket_contents(keys_per_hash)
+
+    def _get_bucket_contents(self, keys_per_hash):
+        """
+        Collect the content of the buckets given as (lshash, bucket_keys)
+        pairs. For columnar storage this is an array of row indices.
+        """
+        if self._columnar:
+            rows = [self.storage.get_bucket_rows(lshash.hash_name, bucket_key)
+                    for lshash, bucket_keys in keys_per_hash
+                    for bucket_key in bucket_keys]
+            if not rows:
+                return np.empty(0, dtype=np.int64)
+            return np.concatenate(rows)
         candidates = []
-        for lshash in self.lshashes:
-            for bucket_key in lshash.hash_vector(v, querying=True):
+        for lshash, bucket_keys in keys_per_hash:
+            for bucket_key in bucket_keys:
                 bucket_content = self.storage.get_bucket(lshash.hash_name,
                                                          bucket_key)
                 #print 'Bucket %s size %d' % (bucket_key, len(bucket_content))
@@ -168,15 +368,11 @@ class Engine(object):
         else:
             return candidates
 
-    def _append_distances(self, v, distance, candidates):
-        """ Apply distance implementation if specified """
-        if distance:
-            # Normalize vector (stored vectors are normalized)
-            nv = unitvec(v)
-            candidates = [(x[0], x[1], self.distance.distance(x[0], nv)) for x
-                          in candidates]
-
-        return candidates
+    def _distances(self, v, vectors):
+        """ Distances of vector v to all vectors, with one call """
+        # Normalize vector (stored vectors are normalized)
+        nv = unitvec(v)
+        return self.distance.distances(stack_vectors(vectors), nv)
 
     def clean_all_buckets(self):
         """ Clears buckets in storage (removes all vectors and their data). """
@@ -20,6 +20,8 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+import numpy
+
 from nearpy.filters.vectorfilter import VectorFilter
 
 
@@ -41,8 +43,22 @@ class NearestFilter(VectorFilter):
         try:
             # Return filtered (vector, data, distance )tuple list. Will fail
             # if input is list of (vector, data) tuples.
-            sorted_list = sorted(input_list, key=lambda x: x[2])
-            return sorted_list[:self.N]
+            distances = [x[2] for x in input_list]
         except:
             # Otherwise just return input list
             return input_list
+        return [input_list[i] for i in self.nearest_indices(distances)]
+
+    def nearest_indices(self, distances):
+        """
+        Returns the indices of the N smallest distances, nearest first. Only
+        those N are sorted, the rest is split off with a partition.
+        """
+        distances = numpy.asarray(distances, dtype=float)
+        if self.N <= 0:
+            return numpy.empty(0, dtype=int)
+        if len(distances) > self.N:
+            indices = numpy.argpartition(distances, self.N - 1)[:self.N]
+        else:
+            indices = numpy.arange(len(distances))
+        return indices[numpy.argsort(distances[indices], kind='mergesort')]
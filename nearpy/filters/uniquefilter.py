@@ -46,7 +46,15 @@ class UniqueFilter(VectorFilter):
         """
         Returns subset of specified input list.
         """
+        indices = self.unique_indices([v[1] for v in input_list])
+        return [input_list[i] for i in indices]
+
+    def unique_indices(self, data):
+        """
+        Returns the index of the last element for each distinct data key, in
+        order of first appearance.
+        """
         unique_dict = {}
-        for v in input_list:
-            unique_dict[v[1]] = v
+        for index, key in enumerate(data):
+            unique_dict[key] = index
         return list(unique_dict.values())
@@ -20,6 +20,8 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+import scipy.sparse
+
 
 class LSHash(object):
     """ Interface for locality-sensitive hashes. """
@@ -44,6 +46,20 @@ class LSHash(object):
         """
         raise NotImplementedError
 
+    def hash_vectors(self, vs, querying=False):
+        """
+        Hashes every row of matrix vs (dense or scipy.sparse) and returns a
+        list with the list of bucket keys of each row. This default
+        implementation hashes the rows one by one, hashes that can project
+        all rows at once should override it.
+        """
+        if scipy.sparse.issparse(vs):
+            vs = vs.tocsr()
+            return [self.hash_vector(vs[row].T, querying)
+                    for row in range(vs.shape[0])]
+        return [self.hash_vector(vs[row], querying)
+                for row in range(vs.shape[0])]
+
     def get_config(self):
         """
         Returns pickle-serializable configuration struct for storage.
@@ -142,6 +142,10 @@ class HashPermutationMapper(LSHash):
         if not (isinstance(child_hash, PCABinaryProjections) or isinstance(child_hash, RandomBinaryProjections) or isinstance(child_hash, RandomBinaryProjectionTree)):
             raise ValueError('Child hashes must generate binary keys')
 
+        # Permuted keys are built flipping characters of string keys
+        if getattr(child_hash, 'packed_keys', False):
+            raise ValueError('Child hashes must generate string keys')
+
         # Add both hash and config to array of child hashes. Also we are going to
         # accumulate used bucket keys for every hash in order to build the
         # permuted index
@@ -90,7 +90,8 @@ class HashPermutations(LSHash):
                         lshash.hash_name, bucket_key)
                     # Add them to result, but prefix with hash name
                     for n in neighbour_keys:
-                        bucket_keys.append(lshash.hash_name + '_' + n)
+                        bucket_keys.append(
+                            self._prefix_key(lshash.hash_name, n))
 
         else:
             # If we are indexing (storing) just use child hashes without
@@ -103,11 +104,21 @@ class HashPermutations(LSHash):
                     # Register bucket key in child hash dict
                     child_hash['bucket_keys'][bucket_key] = bucket_key
                     # Append bucket key to result prefixed with child hash name
-                    bucket_keys.append(lshash.hash_name + '_' + bucket_key)
+                    bucket_keys.append(
+                        self._prefix_key(lshash.hash_name, bucket_key))
 
         # Return all the bucket keys
         return bucket_keys
 
+    def _prefix_key(self, hash_name, bucket_key):
+        """
+        Prefixes the bucket key of a child hash with its name. Packed bytes
+        keys get a bytes prefix.
+        """
+        if isinstance(bucket_key, bytes):
+            return hash_name.encode('utf-8') + b'_' + bucket_key
+        return hash_name + '_' + bucket_key
+
     def get_config(self):
         """
         Returns pickle-serializable configuration struct for storage.
@@ -74,6 +74,9 @@ class PermutedIndex:
     In the step 4, after we find the position of permuted query key in the list,
     it's better to return more neighbours around that place as candidates.
     The parameter beam_size specifies how many neighbours in the sorted list will be returned.
+
+    Bucket keys can be '0'/'1' strings or, for hashes with packed_keys, bytes holding the bits
+    packed into little-endian uint64 words. Neighbour keys are returned in the same form.
     """
 
     def __init__(
@@ -88,6 +91,7 @@ class PermutedIndex:
         self.beam_size = beam_size
         self.lshash = lshash
         self.projection_count = self.lshash.projection_count
+        self.packed_keys = getattr(self.lshash, 'packed_keys', False)
         self.num_neighbour = num_neighbour
 
         # add permutations
@@ -99,7 +103,7 @@ class PermutedIndex:
         # convert current buckets to an array of bitarray
         original_keys = []
         for key in buckets:
-            ba = bitarray(key)
+            ba = self.key_to_bitarray(key)
             original_keys.append(ba)
 
         # build permutation lists
@@ -118,6 +122,28 @@ class PermutedIndex:
             permuted_list = sorted(permuted_list)
             self.permuted_lists.append(permuted_list)
 
+    def key_to_bitarray(self, bucket_key):
+        """
+        Converts a bucket key (binary string or packed bytes) into a bitarray
+        """
+        if isinstance(bucket_key, bytes):
+            ba = bitarray(endian='little')
+            ba.frombytes(bucket_key)
+            # Drop the padding of the last uint64 word
+            del ba[self.projection_count:]
+            return ba
+        return bitarray(bucket_key)
+
+    def bitarray_to_key(self, ba):
+        """
+        Converts a bitarray back into the bucket key form of the hash
+        """
+        if self.packed_keys:
+            padded = ba.copy()
+            padded.extend([False] * ((-len(padded)) % 64))
+            return padded.tobytes()
+        return ba.to01()
+
     def hamming_distance(self, a, b):
         return int((a ^ b).count())
 
@@ -132,7 +158,7 @@ class PermutedIndex:
         otherwise we could use brute-force to get the neighbours
         """
         # convert query_key into bitarray
-        query_key = bitarray(bucket_key)
+        query_key = self.key_to_bitarray(bucket_key)
 
         topk = set()
         for i in xrange(len(self.permutes)):
@@ -146,5 +172,5 @@ class PermutedIndex:
         # qurey key
         topk = sorted(topk, key=lambda x: self.hamming_distance(x, query_key))
         # return the top k items
-        topk_bin = [x.to01() for x in topk[:k]]
+        topk_bin = [self.bitarray_to_key(x) for x in topk[:k]]
         return topk_bin
@@ -25,6 +25,7 @@ import scipy
 import scipy.sparse
 
 from nearpy.hashes.lshash import LSHash
+from nearpy.utils.utils import pack_bits, project_sparse
 
 
 class RandomBinaryProjections(LSHash):
@@ -34,23 +35,30 @@ class RandomBinaryProjections(LSHash):
     divides the data set by each hyperplane and generates a binary
     hash value in string form, which is being used as a bucket key
     for storage.
+
+    With packed_keys the binary hash value is instead packed into uint64
+    words and the bucket key is the bytes of those words, which is 64 times
+    smaller than the string form (useful with thousands of projections).
     """
 
-    def __init__(self, hash_name, projection_count, rand_seed=None):
+    def __init__(self, hash_name, projection_count, rand_seed=None,
+                 packed_keys=False):
         """
         Creates projection_count random vectors, that are used for projections
         thus working as normals of random hyperplanes. Each random vector /
         hyperplane will result in one bit of hash.
 
         So if you for example decide to use projection_count=10, the bucket
-        keys will have 10 digits and will look like '1010110011'.
+        keys will have 10 digits and will look like '1010110011'. If
+        packed_keys is True they will be 8 bytes long instead (one uint64
+        word per 64 projections).
         """
         super(RandomBinaryProjections, self).__init__(hash_name)
         self.projection_count = projection_count
+        self.packed_keys = packed_keys
         self.dim = None
         self.normals = None
         self.rand = numpy.random.RandomState(rand_seed)
-        self.normals_csr = None
 
     def reset(self, dim):
         """ Resets / Initializes the hash for the specified dimension. """
@@ -63,21 +71,40 @@ class RandomBinaryProjections(LSHash):
         Hashes the vector and returns the binary bucket key as string.
         """
         if scipy.sparse.issparse(v):
-            # If vector is sparse, make sure we have the CSR representation
-            # of the projection matrix
-            if self.normals_csr == None:
-                self.normals_csr = scipy.sparse.csr_matrix(self.normals)
-            # Make sure that we are using CSR format for multiplication
-            if not scipy.sparse.isspmatrix_csr(v):
-                v = scipy.sparse.csr_matrix(v)
-            # Project vector onto all hyperplane normals
-            projection = self.normals_csr.dot(v)
+            # Project sparse vector onto all hyperplane normals, without
+            # densifying it
+            projection = project_sparse(self.normals, v)
         else:
             # Project vector onto all hyperplane normals
             projection = numpy.dot(self.normals, v)
         # Return binary key
+        if self.packed_keys:
+            return self._keys_from_projection(
+                numpy.asarray(projection).reshape(1, -1))
         return [''.join(['1' if x > 0.0 else '0' for x in projection])]
 
+    def hash_vectors(self, vs, querying=False):
+        """
+        Hashes every row of matrix vs with one projection of the whole
+        matrix and returns the list with the binary bucket key of each row.
+        """
+        # Project all rows onto all hyperplane normals at once. For sparse
+        # matrices this is a sparse-dense product, the result is dense.
+        projection = numpy.asarray(vs.dot(self.normals.T))
+        return [[key] for key in self._keys_from_projection(projection)]
+
+    def _keys_from_projection(self, projection):
+        """
+        Returns the bucket key of every row of a (rows x projection_count)
+        projection.
+        """
+        bits = projection > 0.0
+        if self.packed_keys:
+            return [row.tobytes() for row in pack_bits(bits)]
+        # One ASCII '0'/'1' byte per projection and row
+        digits = bits.astype(numpy.uint8) + ord('0')
+        return [row.tobytes().decode('ascii') for row in digits]
+
     def get_config(self):
         """
         Returns pickle-serializable configuration struct for storage.
@@ -87,6 +114,7 @@ class RandomBinaryProjections(LSHash):
             'hash_name': self.hash_name,
             'dim': self.dim,
             'projection_count': self.projection_count,
+            'packed_keys': self.packed_keys,
             'normals': self.normals
         }
 
@@ -97,4 +125,5 @@ class RandomBinaryProjections(LSHash):
         self.hash_name = config['hash_name']
         self.dim = config['dim']
         self.projection_count = config['projection_count']
+        self.packed_keys = config.get('packed_keys', False)
         self.normals = config['normals']
@@ -25,6 +25,7 @@ import scipy
 import scipy.sparse
 
 from nearpy.hashes.lshash import LSHash
+from nearpy.utils.utils import project_sparse
 
 
 class RandomBinaryProjectionTreeNode(object):
@@ -151,7 +152,6 @@ class RandomBinaryProjectionTree(LSHash):
         self.dim = None
         self.normals = None
         self.rand = numpy.random.RandomState(rand_seed)
-        self.normals_csr = None
         self.tree_root = None
         self.minimum_result_size = minimum_result_size
 
@@ -167,15 +167,9 @@ class RandomBinaryProjectionTree(LSHash):
         Hashes the vector and returns the binary bucket key as string.
         """
         if scipy.sparse.issparse(v):
-            # If vector is sparse, make sure we have the CSR representation
-            # of the projection matrix
-            if self.normals_csr == None:
-                self.normals_csr = scipy.sparse.csr_matrix(self.normals)
-            # Make sure that we are using CSR format for multiplication
-            if not scipy.sparse.isspmatrix_csr(v):
-                v = scipy.sparse.csr_matrix(v)
-            # Project vector onto all hyperplane normals
-            projection = self.normals_csr.dot(v)
+            # Project sparse vector onto all hyperplane normals, without
+            # densifying it
+            projection = project_sparse(self.normals, v)
         else:
             # Project vector onto all hyperplane normals
             projection = numpy.dot(self.normals, v)
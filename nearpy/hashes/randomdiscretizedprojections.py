@@ -25,6 +25,7 @@ import scipy
 import scipy.sparse
 
 from nearpy.hashes.lshash import LSHash
+from nearpy.utils.utils import project_sparse
 
 
 class RandomDiscretizedProjections(LSHash):
@@ -48,7 +49,6 @@ class RandomDiscretizedProjections(LSHash):
         self.normals = None
         self.bin_width = bin_width
         self.rand = numpy.random.RandomState(rand_seed)
-        self.normals_csr = None
 
     def reset(self, dim):
         """ Resets / Initializes the hash for the specified dimension. """
@@ -61,16 +61,10 @@ class RandomDiscretizedProjections(LSHash):
         Hashes the vector and returns the binary bucket key as string.
         """
         if scipy.sparse.issparse(v):
-            # If vector is sparse, make sure we have the CSR representation
-            # of the projection matrix
-            if self.normals_csr == None:
-                self.normals_csr = scipy.sparse.csr_matrix(self.normals)
-            # Make sure that we are using CSR format for multiplication
-            if not scipy.sparse.isspmatrix_csr(v):
-                v = scipy.sparse.csr_matrix(v)
-            # Project vector onto all hyperplane normals
-            projection = (self.normals_csr.dot(
-                v) / self.bin_width).floor().toarray()
+            # Project sparse vector onto all hyperplane normals, without
+            # densifying it
+            projection = project_sparse(self.normals, v)
+            projection = numpy.floor(projection / self.bin_width)
         else:
             # Project vector onto all hyperplane normals
             projection = numpy.dot(self.normals, v)
@@ -78,6 +72,17 @@ class RandomDiscretizedProjections(LSHash):
         # Return key
         return ['_'.join([str(int(x)) for x in projection])]
 
+    def hash_vectors(self, vs, querying=False):
+        """
+        Hashes every row of matrix vs with one projection of the whole
+        matrix and returns the list with the bucket key of each row.
+        """
+        # Project all rows onto all random vectors at once
+        projection = numpy.asarray(vs.dot(self.normals.T))
+        projection = numpy.floor(projection / self.bin_width).astype(int)
+        return [['_'.join([str(x) for x in row])]
+                for row in projection.tolist()]
+
     def get_config(self):
         """
         Returns pickle-serializable configuration struct for storage.
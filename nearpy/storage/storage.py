@@ -36,6 +36,12 @@ class Storage(object):
         """
         raise NotImplementedError
 
+    def get_all_bucket_keys(self, hash_name):
+        """
+        Returns list of the keys of all buckets of specified hash.
+        """
+        raise NotImplementedError
+
     def clean_buckets(self, hash_name):
         """
         Removes all buckets and their content.
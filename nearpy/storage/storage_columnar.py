@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2013 Ole Krause-Sparmann
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from array import array
+
+import numpy
+import scipy.sparse
+
+from nearpy.storage.storage import Storage
+
+
+class ColumnarMemoryStorage(Storage):
+    """
+    Memory storage that keeps all vectors as the rows of one contiguous
+    float32 matrix and each bucket as an array of int row indices into it.
+
+    Vectors are stored once with add_vector(s) and then referenced from any
+    number of buckets with store_row, so a vector hashed into many buckets is
+    not copied. The engine uses the row indices to score all candidates of a
+    query with one matrix-vector product. Meant for dense vectors, sparse
+    ones are densified.
+    """
+
+    def __init__(self, initial_capacity=1024):
+        self.vectors = None
+        self.data = []
+        self.count = 0
+        self.initial_capacity = initial_capacity
+        self.buckets = {}
+        self.hash_configs = {}
+
+    def _reserve(self, dim, num_rows):
+        """
+        Makes room for num_rows more rows, doubling the matrix when full.
+        """
+        if self.vectors is None:
+            capacity = max(self.initial_capacity, num_rows)
+            self.vectors = numpy.empty((capacity, dim), dtype=numpy.float32)
+        elif self.vectors.shape[1] != dim:
+            raise ValueError('Vectors of dimension %d cannot be stored with '
+                             'vectors of dimension %d' %
+                             (dim, self.vectors.shape[1]))
+        elif self.count + num_rows > self.vectors.shape[0]:
+            capacity = max(2 * self.vectors.shape[0], self.count + num_rows)
+            vectors = numpy.empty((capacity, dim), dtype=numpy.float32)
+            vectors[:self.count] = self.vectors[:self.count]
+            self.vectors = vectors
+
+    def add_vector(self, v, data):
+        """
+        Appends vector v and its data as a new row, returns the row index.
+        """
+        if scipy.sparse.issparse(v):
+            v = v.toarray()
+        v = numpy.ravel(v)
+        self._reserve(v.shape[0], 1)
+        self.vectors[self.count] = v
+        self.data.append(data)
+        self.count += 1
+        return self.count - 1
+
+    def add_vectors(self, vs, data):
+        """
+        Appends the rows of matrix vs and their data (one element per row),
+        returns the array of new row indices.
+        """
+        if scipy.sparse.issparse(vs):
+            vs = vs.toarray()
+        vs = numpy.asarray(vs)
+        num_rows = vs.shape[0]
+        self._reserve(vs.shape[1], num_rows)
+        self.vectors[self.count:self.count + num_rows] = vs
+        self.data.extend(data)
+        self.count += num_rows
+        return numpy.arange(self.count - num_rows, self.count)
+
+    def store_row(self, hash_name, bucket_key, row):
+        """
+        Adds an already stored row to the bucket with specified key.
+        """
+        if not hash_name in self.buckets:
+            self.buckets[hash_name] = {}
+
+        if not bucket_key in self.buckets[hash_name]:
+            self.buckets[hash_name][bucket_key] = array('q')
+        self.buckets[hash_name][bucket_key].append(row)
+
+    def store_vector(self, hash_name, bucket_key, v, data):
+        """
+        Stores vector and JSON-serializable data in bucket with specified key.
+        """
+        self.store_row(hash_name, bucket_key, self.add_vector(v, data))
+
+    def get_bucket_rows(self, hash_name, bucket_key):
+        """
+        Returns bucket content as an array of row indices.
+        """
+        if hash_name in self.buckets:
+            if bucket_key in self.buckets[hash_name]:
+                return numpy.array(self.buckets[hash_name][bucket_key],
+                                   dtype=numpy.int64)
+        return numpy.empty(0, dtype=numpy.int64)
+
+    def get_vectors(self, rows):
+        """
+        Returns the (len(rows) x dim) matrix with the vectors of the rows.
+        """
+        return self.vectors[rows]
+
+    def get_data(self, rows):
+        """
+        Returns the list with the data of the rows.
+        """
+        return [self.data[row] for row in rows]
+
+    def get_bucket(self, hash_name, bucket_key):
+        """
+        Returns bucket content as list of tuples (vector, data).
+        """
+        rows = self.get_bucket_rows(hash_name, bucket_key)
+        return [(self.vectors[row], self.data[row]) for row in rows]
+
+    def get_all_bucket_keys(self, hash_name):
+        """
+        Returns list of the keys of all buckets of specified hash.
+        """
+        return list(self.buckets.get(hash_name, {}).keys())
+
+    def clean_buckets(self, hash_name):
+        """
+        Removes all buckets and their content for specified hash. Rows stay
+        in the matrix.
+        """
+        self.buckets[hash_name] = {}
+
+    def clean_all_buckets(self):
+        """
+        Removes all buckets from all hashes and all stored rows.
+        """
+        self.buckets = {}
+        self.vectors = None
+        self.data = []
+        self.count = 0
+
+    def store_hash_configuration(self, lshash):
+        """
+        Stores hash configuration
+        """
+        self.hash_configs[lshash.hash_name] = lshash.get_config()
+
+    def load_hash_configuration(self, hash_name):
+        """
+        Loads and returns hash configuration
+        """
+        return self.hash_configs.get(hash_name)
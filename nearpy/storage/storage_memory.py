@@ -58,6 +58,12 @@ class MemoryStorage(Storage):
                 return self.buckets[hash_name][bucket_key]
         return []
 
+    def get_all_bucket_keys(self, hash_name):
+        """
+        Returns list of the keys of all buckets of specified hash.
+        """
+        return list(self.buckets.get(hash_name, {}).keys())
+
     def clean_buckets(self, hash_name):
         """
         Removes all buckets and their content for specified hash.
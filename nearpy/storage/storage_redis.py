@@ -27,6 +27,7 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+import binascii
 import redis
 import json
 import numpy
@@ -46,11 +47,20 @@ class RedisStorage(Storage):
         """ Uses specified redis object for storage. """
         self.redis_object = redis_object
 
+    def _redis_key(self, hash_name, bucket_key):
+        """
+        Returns the redis key of a bucket. Packed (bytes) bucket keys are
+        hex encoded.
+        """
+        if isinstance(bucket_key, bytes):
+            bucket_key = binascii.hexlify(bucket_key).decode('ascii')
+        return 'nearpy_%s_%s' % (hash_name, bucket_key)
+
     def store_vector(self, hash_name, bucket_key, v, data):
         """
         Stores vector and JSON-serializable data in bucket with specified key.
         """
-        redis_key = 'nearpy_%s_%s' % (hash_name, bucket_key)
+        redis_key = self._redis_key(hash_name, bucket_key)
 
         val_dict = {}
 
@@ -90,7 +100,7 @@ class RedisStorage(Storage):
         """
         Returns bucket content as list of tuples (vector, data).
         """
-        redis_key = 'nearpy_%s_%s' % (hash_name, bucket_key)
+        redis_key = self._redis_key(hash_name, bucket_key)
         items = self.redis_object.lrange(redis_key, 0, -1)
         results = []
         for item_str in items:
@@ -131,6 +141,19 @@ class RedisStorage(Storage):
 
         return results
 
+    def get_all_bucket_keys(self, hash_name):
+        """
+        Returns list of the keys of all buckets of specified hash. Packed
+        bucket keys are returned hex encoded, get_bucket accepts them so.
+        """
+        prefix = 'nearpy_%s_' % hash_name
+        bucket_keys = []
+        for redis_key in self.redis_object.keys(pattern=prefix + '*'):
+            if isinstance(redis_key, bytes):
+                redis_key = redis_key.decode('utf-8')
+            bucket_keys.append(redis_key[len(prefix):])
+        return bucket_keys
+
     def clean_buckets(self, hash_name):
         """
         Removes all buckets and their content for specified hash.
@@ -76,6 +76,22 @@ def check_distance_triangle_inequality(test_obj, distance):
 
         test_obj.assertTrue(d_xy <= d_xz + d_yz)
 
+
+def check_distances_match_distance(test_obj, distance):
+    xs = numpy.random.randn(20, 10)
+    y = numpy.random.randn(10)
+    expected = [distance.distance(xs[k], y) for k in range(20)]
+    result = distance.distances(xs, y)
+    for k in range(20):
+        test_obj.assertAlmostEqual(result[k], expected[k], delta=0.0000001)
+
+    xs = scipy.sparse.rand(20, 30, density=0.3, format='csr')
+    y = scipy.sparse.rand(30, 1, density=0.3)
+    expected = [distance.distance(xs[k].T, y) for k in range(20)]
+    result = distance.distances(xs, y)
+    for k in range(20):
+        test_obj.assertAlmostEqual(result[k], expected[k], delta=0.0000001)
+
 ########################################################################
 
 
@@ -90,6 +106,9 @@ class TestEuclideanDistance(unittest.TestCase):
     def test_symmetry(self):
         check_distance_symmetry(self, self.euclidean)
 
+    def test_distances(self):
+        check_distances_match_distance(self, self.euclidean)
+
 
 class TestCosineDistance(unittest.TestCase):
 
@@ -99,6 +118,9 @@ class TestCosineDistance(unittest.TestCase):
     def test_symmetry(self):
         check_distance_symmetry(self, self.cosine)
 
+    def test_distances(self):
+        check_distances_match_distance(self, self.cosine)
+
 
 class TestManhattanDistance(unittest.TestCase):
 
@@ -111,5 +133,8 @@ class TestManhattanDistance(unittest.TestCase):
     def test_symmetry(self):
         check_distance_symmetry(self, self.manhattan)
 
+    def test_distances(self):
+        check_distances_match_distance(self, self.manhattan)
+
 if __name__ == '__main__':
     unittest.main()
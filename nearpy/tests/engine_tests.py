@@ -25,6 +25,8 @@ import scipy
 import unittest
 
 from nearpy import Engine
+from nearpy.hashes import RandomBinaryProjections
+from nearpy.storage import ColumnarMemoryStorage
 from nearpy.utils.utils import unitvec
 
 
@@ -75,5 +77,108 @@ class TestEngine(unittest.TestCase):
             self.assertEqual(y_data, x_data)
             self.assertAlmostEqual(y_distance, 0.0, delta=delta)
 
+    def test_retrieval_batch(self):
+        xs = numpy.random.randn(50, 1000)
+        xs_data = ['data_%d' % k for k in range(50)]
+        self.engine.store_vectors(xs, xs_data)
+        results = self.engine.neighbours_batch(xs)
+        self.assertEqual(len(results), 50)
+        for k in range(50):
+            self.assertEqual(results[k], self.engine.neighbours(xs[k]))
+            nearest = results[k][0]
+            self.assertEqual(nearest[1], xs_data[k])
+            self.assertAlmostEqual(nearest[2], 0.0, delta=0.000000001)
+
+    def test_retrieval_batch_sparse(self):
+        xs = scipy.sparse.rand(50, 1000, density=0.05, format='csr')
+        xs_data = ['data_%d' % k for k in range(50)]
+        self.engine.store_vectors(xs, xs_data)
+        results = self.engine.neighbours_batch(xs)
+        self.assertEqual(len(results), 50)
+        for k in range(50):
+            nearest = results[k][0]
+            self.assertEqual(nearest[1], xs_data[k])
+            self.assertAlmostEqual(nearest[2], 0.0, delta=0.000000001)
+
+    def test_retrieval_columnar(self):
+        engine = Engine(1000, storage=ColumnarMemoryStorage())
+        xs = numpy.random.randn(50, 1000)
+        xs_data = ['data_%d' % k for k in range(50)]
+        engine.store_vectors(xs[:25], xs_data[:25])
+        for k in range(25, 50):
+            engine.store_vector(xs[k], xs_data[k])
+        for k in range(50):
+            n = engine.neighbours(xs[k])
+            self.assertEqual(n[0][1], xs_data[k])
+            self.assertAlmostEqual(n[0][2], 0.0, delta=0.00001)
+            self.assertTrue(numpy.allclose(n[0][0], unitvec(xs[k]),
+                                           atol=0.00001))
+        results = engine.neighbours_batch(xs)
+        self.assertEqual([r[0][1] for r in results], xs_data)
+
+    def test_self_join(self):
+        engine = Engine(100, lshashes=[RandomBinaryProjections('rbp1', 4),
+                                       RandomBinaryProjections('rbp2', 4)])
+        xs = numpy.random.randn(30, 100)
+        xs[1] = xs[0] * 2.0
+        for k in range(30):
+            engine.store_vector(xs[k], 'data_%d' % k)
+        pairs = list(engine.self_join())
+        keys = [frozenset((a, b)) for a, b, _ in pairs]
+        self.assertEqual(len(keys), len(set(keys)))
+        self.assertIn(frozenset(('data_0', 'data_1')), keys)
+        close = list(engine.self_join(threshold=0.0001))
+        self.assertEqual([frozenset((a, b)) for a, b, _ in close],
+                         [frozenset(('data_0', 'data_1'))])
+        self.assertAlmostEqual(close[0][2], 0.0, delta=0.0001)
+
+    def test_self_join_columnar(self):
+        engine = Engine(100, storage=ColumnarMemoryStorage())
+        xs = numpy.random.randn(30, 100)
+        xs[1] = xs[0] * 2.0
+        engine.store_vectors(xs, ['data_%d' % k for k in range(30)])
+        close = list(engine.self_join(threshold=0.0001))
+        self.assertEqual([frozenset((a, b)) for a, b, _ in close],
+                         [frozenset(('data_0', 'data_1'))])
+
+    def test_self_join_sparse(self):
+        xs = scipy.sparse.rand(30, 1000, density=0.05, format='lil')
+        xs[1] = xs[0] * 2.0
+        self.engine.store_vectors(xs.tocsr(), ['data_%d' % k for k in range(30)])
+        close = list(self.engine.self_join(threshold=0.0001))
+        self.assertEqual([frozenset((a, b)) for a, b, _ in close],
+                         [frozenset(('data_0', 'data_1'))])
+
+    def test_self_join_nearest(self):
+        # the same pairs as a neighbours query per vector, N nearest each
+        xs = numpy.random.randn(200, 20)
+        xs_data = ['data_%d' % k for k in range(200)]
+        for lshashes, storage in [([RandomBinaryProjections('rbp1', 3)], None),
+                                  ([RandomBinaryProjections('rbp1', 3),
+                                    RandomBinaryProjections('rbp2', 3)], None),
+                                  ([RandomBinaryProjections('rbp1', 3)],
+                                   ColumnarMemoryStorage())]:
+            engine = Engine(20, lshashes=lshashes, storage=storage)
+            engine.store_vectors(xs, xs_data)
+            expected = dict()
+            for k in range(200):
+                for _, x_data, distance in engine.neighbours(xs[k]):
+                    if x_data != xs_data[k]:
+                        expected[frozenset((xs_data[k], x_data))] = distance
+            pairs = {frozenset((a, b)): d for a, b, d in engine.self_join()}
+            self.assertEqual(set(pairs), set(expected))
+            for pair, distance in pairs.items():
+                self.assertAlmostEqual(distance, expected[pair], delta=0.00001)
+
+        # without a NearestFilter every pair in a bucket is kept
+        engine = Engine(20, lshashes=[RandomBinaryProjections('rbp1', 3)],
+                        vector_filters=[])
+        engine.store_vectors(xs, xs_data)
+        expected = set(frozenset((xs_data[k], x_data)) for k in range(200)
+                       for _, x_data, _ in engine.neighbours(xs[k])
+                       if x_data != xs_data[k])
+        self.assertEqual(set(frozenset((a, b)) for a, b, _ in engine.self_join()),
+                         expected)
+
 if __name__ == '__main__':
     unittest.main()
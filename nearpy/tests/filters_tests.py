@@ -59,6 +59,13 @@ class TestVectorFilters(unittest.TestCase):
         self.assertIn(self.V[2], result)
         self.assertIn(self.V[3], result)
 
+    def test_nearest_order(self):
+        result = self.nearest_filter.filter_vectors(self.V)
+        self.assertEqual([x[1] for x in result],
+                         ['data5', 'data1', 'data2', 'data3', 'data4'])
+        self.assertEqual(list(NearestFilter(20).nearest_indices([0.3, 0.1])),
+                         [1, 0])
+
     def test_unique(self):
         W = self.V
         W.append((numpy.array([7]), 'data8', 2.8))
@@ -63,6 +63,49 @@ class TestRandomBinaryProjections(unittest.TestCase):
         for k in range(100):
             self.assertEqual(first_hash, self.rbp.hash_vector(x)[0])
 
+    def test_hash_vectors(self):
+        xs = numpy.random.randn(20, 100)
+        hs = self.rbp.hash_vectors(xs)
+        self.assertEqual(len(hs), 20)
+        for k in range(20):
+            self.assertEqual(hs[k], self.rbp.hash_vector(xs[k]))
+
+    def test_hash_vectors_sparse(self):
+        xs = scipy.sparse.rand(20, 100, density=0.1, format='csr')
+        hs = self.rbp.hash_vectors(xs)
+        dense_hs = self.rbp.hash_vectors(xs.toarray())
+        self.assertEqual(hs, dense_hs)
+        for k in range(20):
+            self.assertEqual(hs[k], self.rbp.hash_vector(xs[k]))
+            self.assertEqual(hs[k], self.rbp.hash_vector(xs[k].T))
+
+    def test_hash_format_packed(self):
+        rbp = RandomBinaryProjections('testHash', 130, packed_keys=True)
+        rbp.reset(100)
+        x = numpy.random.randn(100)
+        h = rbp.hash_vector(x)
+        self.assertEqual(len(h), 1)
+        self.assertEqual(type(h[0]), bytes)
+        # 130 bits need three uint64 words
+        self.assertEqual(len(h[0]), 24)
+        words = numpy.frombuffer(h[0], dtype=numpy.uint64)
+        self.assertEqual(len(words), 3)
+        # Same bits as the string key
+        rbp.packed_keys = False
+        bits = rbp.hash_vector(x)[0]
+        unpacked = numpy.unpackbits(words.view(numpy.uint8),
+                                    bitorder='little')
+        self.assertEqual(''.join([str(b) for b in unpacked[:130]]), bits)
+        self.assertEqual(unpacked[130:].sum(), 0)
+
+    def test_hash_vectors_packed(self):
+        rbp = RandomBinaryProjections('testHash', 70, packed_keys=True)
+        rbp.reset(100)
+        xs = numpy.random.randn(20, 100)
+        hs = rbp.hash_vectors(xs)
+        for k in range(20):
+            self.assertEqual(hs[k], rbp.hash_vector(xs[k]))
+
 
 class TestRandomDiscretizedProjections(unittest.TestCase):
 
@@ -92,6 +135,13 @@ class TestRandomDiscretizedProjections(unittest.TestCase):
         for k in range(100):
             self.assertEqual(first_hash, self.rbp.hash_vector(x)[0])
 
+    def test_hash_vectors(self):
+        xs = numpy.random.randn(20, 100)
+        hs = self.rbp.hash_vectors(xs)
+        self.assertEqual(len(hs), 20)
+        for k in range(20):
+            self.assertEqual(hs[k], self.rbp.hash_vector(xs[k]))
+
 
 class TestPCABinaryProjections(unittest.TestCase):
 
@@ -82,5 +82,33 @@ class TestPermutation(unittest.TestCase):
 
         self.assertLess(permuted_dists[0], dists[0])
 
+    def test_runnable_packed_keys(self):
+        permutations = HashPermutations('permut')
+        rbp = RandomBinaryProjections('rbp1', 4, rand_seed=19,
+                                      packed_keys=True)
+        rbp_conf = {'num_permutation': 50,
+                    'beam_size': 10, 'num_neighbour': 100}
+        permutations.add_child_hash(rbp, rbp_conf)
+        engine_perm = Engine(
+            200, lshashes=[permutations], distance=CosineDistance())
+
+        for i in xrange(1000):
+            v = numpy.random.randn(200)
+            engine_perm.store_vector(v, i)
+        permutations.build_permuted_index()
+
+        query = numpy.random.randn(200)
+        results = engine_perm.neighbours(query)
+        self.assertEqual(len(results), 10)
+
+        # Neighbour keys come back packed, like the stored ones
+        key = rbp.hash_vector(query)[0]
+        neighbour_keys = permutations.permutation.get_neighbour_keys(
+            'rbp1', key)
+        self.assertTrue(len(neighbour_keys) > 0)
+        for neighbour_key in neighbour_keys:
+            self.assertEqual(type(neighbour_key), bytes)
+            self.assertEqual(len(neighbour_key), 8)
+
 if __name__ == '__main__':
     unittest.main()
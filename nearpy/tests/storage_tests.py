@@ -26,7 +26,8 @@ import unittest
 
 from mockredis import MockRedis as Redis
 
-from nearpy.storage import MemoryStorage, RedisStorage
+from nearpy.storage import MemoryStorage, RedisStorage, \
+    ColumnarMemoryStorage
 
 
 class TestStorage(unittest.TestCase):
@@ -53,9 +54,39 @@ class TestStorage(unittest.TestCase):
         self.assertEqual(len(y_data), len(x_data))
         for k in range(3):
             self.assertEqual(y_data[k], x_data[k])
+        self.assertEqual(self.memory.get_all_bucket_keys('testHash'),
+                         [bucket_key])
         self.memory.clean_all_buckets()
         self.assertEqual(self.memory.get_bucket('testHash', bucket_key), [])
 
+    def test_memory_storage_packed_key(self):
+        x = numpy.random.randn(100, 1)
+        bucket_key = numpy.array([3, 2 ** 63], dtype=numpy.uint64).tobytes()
+        self.memory.store_vector('testHash', bucket_key, x, 'data')
+        X = self.memory.get_bucket('testHash', bucket_key)
+        self.assertEqual(len(X), 1)
+        self.assertEqual(X[0][1], 'data')
+        self.assertEqual(self.memory.get_bucket('testHash', b'other'), [])
+
+    def test_columnar_memory_storage(self):
+        storage = ColumnarMemoryStorage(initial_capacity=2)
+        X = numpy.random.randn(5, 20)
+        rows = storage.add_vectors(X, ['a', 'b', 'c', 'd', 'e'])
+        self.assertEqual(list(rows), [0, 1, 2, 3, 4])
+        for row in rows[:3]:
+            storage.store_row('testHash', 'key', row)
+        storage.store_vector('testHash', 'key', X[0], 'f')
+        self.assertEqual(list(storage.get_bucket_rows('testHash', 'key')),
+                         [0, 1, 2, 5])
+        self.assertEqual(storage.get_data([1, 5]), ['b', 'f'])
+        self.assertTrue(numpy.allclose(storage.get_vectors([3, 4]), X[3:5]))
+        self.assertEqual(storage.get_vectors([0]).dtype, numpy.float32)
+        bucket = storage.get_bucket('testHash', 'key')
+        self.assertEqual([data for _, data in bucket], ['a', 'b', 'c', 'f'])
+        self.assertEqual(len(storage.get_bucket_rows('testHash', 'other')), 0)
+        storage.clean_all_buckets()
+        self.assertEqual(storage.get_bucket('testHash', 'key'), [])
+
     def test_redis_storage(self):
         self.redis_storage.clean_all_buckets()
         x = numpy.random.randn(100, 1)
@@ -23,6 +23,7 @@
 import sys
 import numpy
 import scipy
+import scipy.sparse
 
 
 def numpy_array_from_list_or_numpy_array(vectors):
@@ -65,6 +66,62 @@ def unitvec(vec):
             return vec
 
 
+def project_sparse(normals, vec):
+    """
+    Projects scipy.sparse vector vec (row or column) onto the rows of dense
+    matrix normals and returns the 1d numpy array of projections. This is a
+    sparse-dense product, only the non-zero entries of vec are touched.
+    """
+    if vec.shape[0] > 1:
+        vec = vec.T
+    return numpy.asarray(scipy.sparse.csr_matrix(vec).dot(normals.T)).ravel()
+
+
+def stack_vectors(vecs):
+    """
+    Returns a matrix with the vectors as rows. Argument may be a list of
+    numpy vectors or of scipy.sparse row/column vectors, or already such a
+    matrix (returned as is).
+    """
+    if not isinstance(vecs, list):
+        return vecs
+    if scipy.sparse.issparse(vecs[0]):
+        return scipy.sparse.vstack(
+            [vec.T if vec.shape[0] > 1 else vec for vec in vecs]).tocsr()
+    return numpy.vstack([numpy.ravel(vec) for vec in vecs])
+
+
+def unitvecs(vecs):
+    """
+    Scale every row of a matrix (dense or scipy.sparse) to unit length. Zero
+    rows are returned unchanged.
+    """
+    if scipy.sparse.issparse(vecs):
+        vecs = vecs.tocsr()
+        veclens = numpy.sqrt(numpy.asarray(
+            vecs.multiply(vecs).sum(axis=1)).ravel())
+        veclens[veclens == 0.0] = 1.0
+        return scipy.sparse.diags(1.0 / veclens).dot(vecs).tocsr()
+
+    vecs = numpy.asarray(vecs, dtype=float)
+    veclens = numpy.linalg.norm(vecs, axis=1)
+    veclens[veclens == 0.0] = 1.0
+    return vecs / veclens[:, numpy.newaxis]
+
+
+def pack_bits(bits):
+    """
+    Packs every row of a boolean matrix into little-endian uint64 words
+    (numpy.packbits, padded to whole 64 bit words). Returns a
+    (rows x words) uint64 matrix.
+    """
+    packed = numpy.packbits(bits, axis=1, bitorder='little')
+    padding = (-packed.shape[1]) % 8
+    if padding > 0:
+        packed = numpy.pad(packed, ((0, 0), (0, padding)), 'constant')
+    return numpy.ascontiguousarray(packed).view(numpy.uint64)
+
+
 def perform_pca(A):
     """
     Computes eigenvalues and eigenvectors of covariance matrix of A.
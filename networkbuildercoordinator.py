@@ -1,63 +1,172 @@
-from modelstore.elasticstore import StoreHandler
+from modelstore.store import open_store
 from knowledgerepr import fieldnetwork
 from knowledgerepr import networkbuilder
 from knowledgerepr.networkbuilder import FieldNetwork
 
+from collections import namedtuple
+import multiprocessing
+import queue
+import resource
 import sys
 import time
+import traceback
 
 
-def main(output_path=None):
+# A relation-building stage: build(network) adds relations to the network, once all the
+# stages named in depends have been merged into it
+Stage = namedtuple('Stage', ['name', 'build', 'depends'])
+
+
+class EdgeRecorder:
+    """
+    Stands in for the FieldNetwork while a stage runs: reads go to the network, added
+    relations are recorded as (src, target, relation, score) to be merged later
+    """
+
+    def __init__(self, network):
+        self.network = network
+        self.edges = []
+
+    def __getattr__(self, name):
+        return getattr(self.network, name)
+
+    def add_relation(self, node_src, node_target, relation, score):
+        self.edges.append((node_src, node_target, relation, score))
+
+    def add_relations_bulk(self, src, target, relation, scores):
+        self.edges.extend((s, t, relation, score) for s, t, score in zip(src, target, scores))
+
+
+def peak_memory():
+    """
+    Peak resident set size of this process, in KB. A forked process starts with a peak
+    inherited from its parent at the time of the fork
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_stage(stage, network, results):
+    """
+    Runs stage in a worker process and puts (name, edges, wall time, added peak memory, error)
+    in the results queue. The added peak memory is how much the stage raised the peak it
+    inherited from the parent, 0 if it stayed under it
+    """
+    st = time.time()
+    start_peak = peak_memory()
+    try:
+        recorder = EdgeRecorder(network)
+        stage.build(recorder)
+        results.put((stage.name, recorder.edges, time.time() - st, peak_memory() - start_peak, None))
+    except Exception:
+        results.put((stage.name, None, time.time() - st, peak_memory() - start_peak, traceback.format_exc()))
+
+
+def next_result(results, running):
+    while True:
+        try:
+            return results.get(timeout=1)
+        except queue.Empty:
+            for name, process in running.items():
+                if not process.is_alive() and process.exitcode != 0:
+                    raise RuntimeError("Stage {0} died with exit code {1}".format(name, process.exitcode))
+
+
+def stop_stages(running):
+    """
+    Terminates the processes of the stages still running and waits for them
+    """
+    for process in running.values():
+        process.terminate()
+    for process in running.values():
+        process.join()
+    running.clear()
+
+
+def merge_edges(network, edges):
+    relations = []
+    for _, _, relation, _ in edges:
+        if relation not in relations:
+            relations.append(relation)
+    for relation in relations:
+        src, target, scores = zip(*[(s, t, score) for s, t, r, score in edges if r == relation])
+        network.add_relations_bulk(src, target, relation, scores)
+
+
+def run_stages(network, stages, processes=None):
+    """
+    Runs the stages as a DAG: every stage whose dependencies are merged runs in its own
+    forked process (at most processes at a time, all cores by default), its edges are
+    merged into the network when it finishes. If a stage fails, the others are stopped.
+    :return: dict of stage name -> (wall time in seconds, added peak memory in KB, see run_stage)
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    ctx = multiprocessing.get_context("fork")
+    results = ctx.Queue()
+    pending = list(stages)
+    running = dict()
+    stats = dict()
+    try:
+        while pending or running:
+            ready = [stage for stage in pending if all(d in stats for d in stage.depends)]
+            for stage in ready[:processes - len(running)]:
+                pending.remove(stage)
+                process = ctx.Process(target=run_stage, args=(stage, network, results))
+                process.start()
+                running[stage.name] = process
+            if not running:
+                raise ValueError("Stages with unsatisfiable dependencies: " +
+                                 str([stage.name for stage in pending]))
+            name, edges, wall_time, peak_mem, error = next_result(results, running)
+            running.pop(name).join()
+            if error is not None:
+                raise RuntimeError("Stage {0} failed:\n{1}".format(name, error))
+            st = time.time()
+            merge_edges(network, edges)
+            et = time.time()
+            stats[name] = (wall_time, peak_mem)
+            print("Total {0}: {1} (merge {2}), added peak memory: {3} KB".format(
+                name, str(wall_time), str(et - st), str(peak_mem)))
+    except BaseException:
+        stop_stages(running)
+        raise
+    return stats
+
+
+def main(output_path=None, processes=None):
     start_all = time.time()
-    network = FieldNetwork()
-    store = StoreHandler()
+    store = open_store()
 
     # Get all fields from store
     fields_gen = store.get_all_fields()
 
     # Network skeleton and hierarchical relations (table - field), etc
     start_schema = time.time()
-    network.init_meta_schema(fields_gen)
+    network = FieldNetwork.from_fields(fields_gen)
     end_schema = time.time()
-    print("Total skeleton: {0}".format(str(end_schema - start_schema)))
+    print("Total skeleton: {0}, peak memory: {1} KB".format(str(end_schema - start_schema), str(peak_memory())))
 
-    # Schema_sim relation
-    start_schema_sim = time.time()
-    networkbuilder.build_schema_sim_relation(network)
-    end_schema_sim = time.time()
-    print("Total schema-sim: {0}".format(str(end_schema_sim - start_schema_sim)))
+    # Text signatures are streamed from the store into the stage that consumes them,
+    # the generator only starts reading in the process of that stage
+    text_signatures = store.get_all_fields_text_signatures(network)
+    num_signatures = store.get_all_fields_num_signature_columns()
 
     # Entity_sim relation
-    start_entity_sim = time.time()
     #fields, entities = store.get_all_fields_entities()
-    #networkbuilder.build_entity_sim_relation(network, fields, entities)
-    end_entity_sim = time.time()
-    print("Total entity-sim: {0}".format(str(end_entity_sim - start_entity_sim)))
-
-    # Content_sim text relation
-    start_text_sig_sim = time.time()
-    st = time.time()
-    text_signatures = store.get_all_fields_text_signatures(network)
-    et = time.time()
-    print("Time to extract signatures from store: {0}".format(str(et - st)))
-
-    networkbuilder.build_content_sim_relation_text_lsa(network, text_signatures)
-    end_text_sig_sim = time.time()
-    print("Total text-sig-sim: {0}".format(str(end_text_sig_sim - start_text_sig_sim)))
-
-    # Content_sim num relation
-    start_num_sig_sim = time.time()
-    id_sig = store.get_all_fields_num_signatures()
-    #networkbuilder.build_content_sim_relation_num(network, id_sig)
-    networkbuilder.build_content_sim_relation_num_overlap_distr(network, id_sig)
-    end_num_sig_sim = time.time()
-    print("Total num-sig-sim: {0}".format(str(end_num_sig_sim - start_num_sig_sim)))
-
-    # Primary Key / Foreign key relation
-    start_pkfk = time.time()
-    networkbuilder.build_pkfk_relation(network)
-    end_pkfk = time.time()
-    print("Total PKFK: {0}".format(str(end_pkfk - start_pkfk)))
+    #Stage("entity_sim", lambda n: networkbuilder.build_entity_sim_relation(n, fields, entities), [])
+
+    stages = [
+        # Schema_sim relation
+        Stage("schema_sim", networkbuilder.build_schema_sim_relation, []),
+        # Content_sim text relation
+        Stage("text_sig_sim", lambda n: networkbuilder.build_content_sim_relation_text_lsa(n, text_signatures), []),
+        # Content_sim num relation
+        #Stage("num_sig_sim", lambda n: networkbuilder.build_content_sim_relation_num(n, store.get_all_fields_num_signatures()), []),
+        Stage("num_sig_sim", lambda n: networkbuilder.build_content_sim_relation_num_overlap_distr(n, num_signatures), []),
+        # Primary Key / Foreign key relation
+        Stage("pkfk", networkbuilder.build_pkfk_relation, ["text_sig_sim", "num_sig_sim"])
+    ]
+    run_stages(network, stages, processes)
 
     #topk = 100
     #degree = network.fields_degree(topk)
@@ -77,13 +186,15 @@ def main(output_path=None):
     if output_path is not None:
         path = output_path
     fieldnetwork.serialize_network(network, path)
+    # mapped model format, read by deserialize_network while not older than the pickles
+    fieldnetwork.serialize_network_mapped(network, path)
 
     print("DONE!")
 
 
 def plot_num():
     network = FieldNetwork()
-    store = StoreHandler()
+    store = open_store()
     fields, num_signatures = store.get_all_fields_num_signatures()
 
     xaxis = []
@@ -110,7 +221,7 @@ def test_content_sim_num():
 
     start_all = time.time()
     network = FieldNetwork()
-    store = StoreHandler()
+    store = open_store()
 
     # Get all fields from store
     fields_gen = store.get_all_fields()
@@ -127,9 +238,9 @@ def test_content_sim_num():
 
     # Content_sim num relation
     start_num_sig_sim = time.time()
-    id_sig = store.get_all_fields_num_signatures()
-    # networkbuilder.build_content_sim_relation_num(network, id_sig)
-    networkbuilder.build_content_sim_relation_num_overlap_distr(network, id_sig)
+    num_signatures = store.get_all_fields_num_signature_columns()
+    # networkbuilder.build_content_sim_relation_num(network, store.get_all_fields_num_signatures())
+    networkbuilder.build_content_sim_relation_num_overlap_distr(network, num_signatures)
     end_num_sig_sim = time.time()
     print("Total num-sig-sim: {0}".format(str(end_num_sig_sim - start_num_sig_sim)))
 
@@ -0,0 +1,82 @@
+import unittest
+import ddapi
+from ddapi import DDAPI
+from ddapi import ResultFormatter
+from knowledgerepr.fieldnetwork import FieldNetwork
+from modelstore.sqlitestore import SQLiteStore
+
+
+def fields(num_fields):
+    for i in range(num_fields):
+        nid = str(100 + i)
+        yield (nid, "db", "table_" + str(i % 4), "field_" + str(i), 10, i % 11, "N")
+
+
+class KeywordStore:
+    """
+    Answers keyword searches with the fields whose name contains the keyword
+    """
+
+    def __init__(self, network):
+        self.network = network
+        self.requests = 0
+
+    def search_keywords_many(self, kws, kw_type, max_hits=15):
+        self.requests += 1
+        return [[self.network.get_hit(nid) for nid in self.network.iterate_ids()
+                 if kw in self.network.get_info_for([nid])[0][3]][:max_hits] for kw in kws]
+
+
+class TestKeywordSearch(unittest.TestCase):
+
+    def test_keywords_search(self):
+        print(self._testMethodName)
+
+        network = FieldNetwork.from_fields(fields(12))
+        store = KeywordStore(network)
+        ddapi.store_client = store
+        try:
+            api = DDAPI(network)
+            drs = api.keywords_search(["field_1", "field_5", "nothing"], max_results=2)
+            self.assertEqual(store.requests, 1)
+            # field_1 also matches field_10 and field_11, two results at most
+            self.assertEqual(sorted(h.nid for h in drs), ["101", "105", "110"])
+            drs = api.schema_names_search([])
+            self.assertEqual(len(drs.data), 0)
+        finally:
+            ddapi.store_client = None
+
+
+class TestResultFormatter(unittest.TestCase):
+
+    def setUp(self):
+        self.store = SQLiteStore()
+        self.store.add_table("db", "offices", {"office_city": ["cambridge", "boston"], "floors": [3, 5]})
+        self.store.add_table("db", "rooms", {"room": ["kiva", "star"]})
+        ddapi.store_client = self.store
+
+    def tearDown(self):
+        ddapi.store_client = None
+        self.store.close()
+
+    def test_format_output_for_webclient(self):
+        print(self._testMethodName)
+
+        entries = ResultFormatter.format_output_for_webclient([("offices", "office_city")], True)
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['filename'], "offices")
+        # all the fields of the source, the ones in the output selected
+        schema = {col['colname']: (col['selected'], col['samples']) for col in entries[0]['schema']}
+        self.assertEqual(schema, {"office_city": ('Y', ["cambridge", "boston"]),
+                                  "floors": ('N', ["3", "5"])})
+
+    def test_format_output_for_webclient_ss(self):
+        print(self._testMethodName)
+
+        entries = ResultFormatter.format_output_for_webclient_ss([("rooms", [("room", 1.0)])], False)
+        self.assertEqual([col['colname'] for col in entries[0]['schema']], ["room", "room"])
+        self.assertEqual(set(col['selected'] for col in entries[0]['schema']), {'N'})
+
+
+if __name__ == "__main__":
+    unittest.main()